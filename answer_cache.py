@@ -0,0 +1,175 @@
+import atexit
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+import database
+import metrics
+
+# Seconds a cached answer stays valid
+ANSWER_CACHE_TTL = int(os.getenv("DOCGPT_ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Entries kept before the least recently used ones are evicted
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("DOCGPT_ANSWER_CACHE_MAX_ENTRIES", "10000"))
+
+# "document": same question on the same document hits regardless of history.
+# "conversation": the conversation state is part of the key as well.
+ANSWER_CACHE_SCOPE = os.getenv("DOCGPT_ANSWER_CACHE_SCOPE", "document")
+
+# Seconds between writes of the hit/miss counters and last-used times: get()
+# only reads, and a background thread (or the next put) writes them in bulk
+ANSWER_CACHE_STATS_INTERVAL = float(os.getenv("DOCGPT_ANSWER_CACHE_STATS_INTERVAL", "5"))
+
+_lock = threading.Lock()
+_contagens = {"hits": 0, "misses": 0}
+# cache_key -> [last_used_at, hits since the last write]
+_usos = {}
+# cache_key -> created_at of the expired entry seen
+_expiradas = {}
+_pid = None
+
+# This process's lookups; stats() has the totals kept in the database
+LOOKUPS = metrics.counter("docgpt_answer_cache_lookups", "Answer cache lookups, by result")
+
+
+def normalize_question(pergunta):
+    """Lowercase, strip accents and punctuation, and collapse whitespace."""
+    texto = unicodedata.normalize("NFKD", pergunta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+def make_key(doc_hash, pergunta, historico=None):
+    """Cache key for a question about a document, optionally scoped to the history."""
+    partes = [doc_hash, normalize_question(pergunta)]
+    if ANSWER_CACHE_SCOPE == "conversation" and historico:
+        partes.extend(f"{message.type}:{message.content}" for message in historico)
+    return hashlib.sha256("\0".join(partes).encode("utf-8")).hexdigest()
+
+
+def _inicia():
+    # Called with _lock held. A forked process doesn't inherit the thread
+    global _pid
+    if _pid == os.getpid():
+        return
+    _pid = os.getpid()
+    _contagens.update(hits=0, misses=0)
+    _usos.clear()
+    _expiradas.clear()
+    threading.Thread(target=_escritor, name="docgpt-answer-cache-stats", daemon=True).start()
+    atexit.register(flush)
+
+
+def _escritor():
+    while True:
+        time.sleep(ANSWER_CACHE_STATS_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Could not save the answer cache stats: {e}")
+
+
+def _pendentes():
+    # Takes what get() recorded since the last write
+    with _lock:
+        contagens = [(nome, valor) for nome, valor in _contagens.items() if valor]
+        usos = [(ultimo, hits, chave) for chave, (ultimo, hits) in _usos.items()]
+        expiradas = list(_expiradas.items())
+        _contagens.update(hits=0, misses=0)
+        _usos.clear()
+        _expiradas.clear()
+    return contagens, usos, expiradas
+
+
+def _grava(cursor, contagens, usos, expiradas):
+    cursor.executemany(
+        """
+    INSERT INTO answer_cache_stats (name, value) VALUES (?, ?)
+    ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+    """,
+        contagens,
+    )
+    cursor.executemany(
+        "UPDATE answer_cache SET last_used_at = MAX(last_used_at, ?), hits = hits + ? WHERE cache_key = ?",
+        usos,
+    )
+    # Only the entry that was seen expired, not one stored again since
+    cursor.executemany("DELETE FROM answer_cache WHERE cache_key = ? AND created_at = ?", expiradas)
+
+
+def flush():
+    """Write the pending hit/miss counters and last-used times."""
+    pendentes = _pendentes()
+    if any(pendentes):
+        with database.transaction() as cursor:
+            _grava(cursor, *pendentes)
+
+
+def get(cache_key):
+    """Return the cached answer for a key, or None on a miss or expired entry.
+
+    Only reads the database; the counters are written later, in bulk.
+    """
+    now = time.time()
+    result = database.query_one(
+        "SELECT answer, created_at FROM answer_cache WHERE cache_key = ?",
+        (cache_key,),
+    )
+    with _lock:
+        _inicia()
+        if result is None or now - result[1] > ANSWER_CACHE_TTL:
+            if result is not None:
+                _expiradas[cache_key] = result[1]
+                _usos.pop(cache_key, None)
+            _contagens["misses"] += 1
+            LOOKUPS.inc(result="miss")
+            return None
+        uso = _usos.setdefault(cache_key, [now, 0])
+        uso[0] = now
+        uso[1] += 1
+        _contagens["hits"] += 1
+    LOOKUPS.inc(result="hit")
+    return result[0]
+
+
+def put(cache_key, doc_hash, pergunta, resposta):
+    """Store an answer and evict the least recently used entries over the cap."""
+    now = time.time()
+    pendentes = _pendentes()
+    with database.transaction() as cursor:
+        # The write is already being paid for: take the pending stats along
+        _grava(cursor, *pendentes)
+        cursor.execute(
+            """
+        INSERT OR REPLACE INTO answer_cache
+            (cache_key, doc_hash, question, answer, created_at, last_used_at, hits)
+        VALUES (?, ?, ?, ?, ?, ?, 0)
+        """,
+            (cache_key, doc_hash, pergunta, resposta, now, now),
+        )
+        cursor.execute(
+            """
+        DELETE FROM answer_cache WHERE cache_key IN (
+            SELECT cache_key FROM answer_cache
+            ORDER BY last_used_at DESC
+            LIMIT -1 OFFSET ?
+        )
+        """,
+            (ANSWER_CACHE_MAX_ENTRIES,),
+        )
+
+
+def stats():
+    """Return the hit and miss counters, including the ones not yet written."""
+    rows = dict(database.query("SELECT name, value FROM answer_cache_stats"))
+    with _lock:
+        return {nome: rows.get(nome, 0) + _contagens[nome] for nome in ("hits", "misses")}
+
+
+def replay(resposta):
+    """Yield a cached answer in word-sized pieces, like a model stream."""
+    for pedaco in re.findall(r"\s*\S+", resposta):
+        yield pedaco
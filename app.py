@@ -1,28 +1,89 @@
-import tempfile
 import os
 import sqlite3
+import database
+from migrations import MIGRATIONS
 import datetime
 import uuid
 import streamlit as st
 import hashlib
-from langchain.memory import ConversationBufferMemory
-from langchain_openai import ChatOpenAI
+import re
+import json
+import threading
+import time
+import collections
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from langchain.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
-from loaders import *
+import loaders
+import doc_cache
+import docstore
+import answer_cache
+import blobs
+import jobs
+import llm_router
+import message_queue
+import metrics
+from memory import TokenBudgetMemory
+from retrieval import DocumentIndex, carrega_embeddings, formata_contexto, TOP_K
+from tabular import SQL_PROMPT, TableQueryError, TableStore, extrai_sql, formata_resultado
+from tokens import count_tokens
 
 # Add these imports
 import pickle
 import base64
 
-TIPOS_ARQUIVOS_VALIDOS = ["Site", "Pdf", "Csv", "Txt"]
+TIPOS_ARQUIVOS_VALIDOS = loaders.tipos()
 
 # Default to OpenAI and gpt-4o-mini
 DEFAULT_PROVEDOR = "OpenAI"
 DEFAULT_MODELO = "gpt-4o"
 
-# Database setup
-DB_PATH = "docgpt.db"
+# "Provider:model" pairs the router picks from by time to first token,
+# e.g. "OpenAI:gpt-4o,Groq:llama-3.3-70b-versatile"; those without an API key are skipped
+LLM_PROVIDERS = os.getenv("DOCGPT_LLM_PROVIDERS", f"{DEFAULT_PROVEDOR}:{DEFAULT_MODELO}")
+
+# Messages rendered when a chat opens, and per "load older" click
+MESSAGE_WINDOW = 50
+
+# Documents of one upload batch loaded at the same time
+INGEST_THREADS = int(os.getenv("DOCGPT_INGEST_THREADS", "8"))
+
+# Characters of a lazy document read ahead while the batch's other
+# documents are indexed (at least one block is, whatever its size)
+INGEST_PREFETCH_CHARS = int(os.getenv("DOCGPT_INGEST_PREFETCH_CHARS", str(32 * 1024 * 1024)))
+
+# Threads shared by every session for the work left after an answer is
+# shown (folding the conversation into its summary)
+TURN_WORKERS = int(os.getenv("DOCGPT_TURN_WORKERS", "4"))
+
+# Seconds the script waits for a question's model request to go out before
+# drawing the page: both need the interpreter, and the request goes first
+REQUEST_HEAD_START = 0.05
+
+# Seconds between two refreshes of the document jobs panel
+JOB_POLL_SECONDS = float(os.getenv("DOCGPT_JOB_POLL_SECONDS", "1"))
+
+# A signed-in session's cookie is refreshed at most this often
+SESSION_REFRESH_SECONDS = 300
+
+# Usernames (comma-separated) that see the metrics panel
+ADMIN_USERS = {nome.strip() for nome in os.getenv("DOCGPT_ADMIN_USERS", "").split(",") if nome.strip()}
+
+PROMPT_TOKENS = metrics.histogram(
+    "docgpt_prompt_tokens", "Tokens of a prompt sent to the model, by chain", metrics.TOKEN_BUCKETS
+)
+FIRST_TOKEN_SECONDS = metrics.histogram(
+    "docgpt_llm_first_token_seconds", "Time from an answer request to its first streamed token"
+)
+TOKENS_PER_SECOND = metrics.histogram(
+    "docgpt_llm_tokens_per_second", "Answer tokens streamed per second after the first one", metrics.RATE_BUCKETS
+)
+TURN_FIRST_TOKEN_SECONDS = metrics.histogram(
+    "docgpt_turn_first_token_seconds", "Time from a question reaching the script to the first token of its answer on screen"
+)
+RERUN_SECONDS = metrics.histogram("docgpt_rerun_seconds", "Duration of a full script run")
+ANSWERS = metrics.counter("docgpt_answers", "Answers given, by source")
+LOAD_ERRORS = metrics.counter("docgpt_document_load_errors", "Documents that failed to load, by type")
 
 # Custom CSS for DeepSeek-like styling
 def inject_custom_css():
@@ -149,10 +210,17 @@ def save_session_cookie(user_id, username):
     st.session_state["authenticated"] = True
     st.session_state["user_id"] = user_id
     st.session_state["username"] = username
+    st.session_state["session_refreshed_at"] = time.monotonic()
     
     # Debug info
     print(f"Session cookie saved for user: {username}")
 
+def refresh_session_cookie():
+    """Extend the session cookie's lifetime, at most once every SESSION_REFRESH_SECONDS."""
+    ultima = st.session_state.get("session_refreshed_at")
+    if ultima is None or time.monotonic() - ultima >= SESSION_REFRESH_SECONDS:
+        save_session_cookie(st.session_state["user_id"], st.session_state["username"])
+
 def load_session_from_cookie():
     """Try to load session data from cookies."""
     # Check if we're already authenticated in this session
@@ -193,54 +261,48 @@ def clear_session_cookies():
             del st.session_state[key]
 
 def init_database():
-    """Initialize the SQLite database with required tables if they don't exist."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    """Initialize the SQLite database, applying any pending schema migrations."""
+    database.migrate(MIGRATIONS)
+    # Resume the document loads of a previous server process, and save
+    # the messages it had queued
+    jobs.recover()
+    message_queue.recover()
 
-    # Create users table
-    cursor.execute(
-        """
-    CREATE TABLE IF NOT EXISTS users (
-        user_id TEXT PRIMARY KEY,
-        username TEXT UNIQUE,
-        password_hash TEXT,
-        created_at TIMESTAMP
-    )
-    """
-    )
 
-    # Create chats table with user_id field
-    cursor.execute(
-        """
-    CREATE TABLE IF NOT EXISTS chats (
-        chat_id TEXT PRIMARY KEY,
-        user_id TEXT,
-        title TEXT,
-        created_at TIMESTAMP,
-        updated_at TIMESTAMP,
-        file_type TEXT,
-        file_path TEXT,
-        file_url TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )
+@st.cache_resource(show_spinner=False)
+def init_process(db_path):
+    """One-time setup of a server process: .env settings, schema, metrics exporters.
+
+    Cached per database path, so reruns skip it.
     """
-    )
+    load_dotenv()
+    init_database()
+    # Prometheus endpoint and text file, if configured
+    metrics.start()
 
-    cursor.execute(
-        """
-    CREATE TABLE IF NOT EXISTS messages (
-        message_id TEXT PRIMARY KEY,
-        chat_id TEXT,
-        role TEXT,
-        content TEXT,
-        timestamp TIMESTAMP,
-        FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-    )
+
+@st.cache_resource(show_spinner=False)
+def cadeias(provedores):
+    """The answer and SQL chains (prompt | routed model), built once per process.
+
+    Every session shares them; a chat only binds its document types
+    (st.session_state["tipo_arquivo"]) when it asks.
     """
-    )
+    chat = llm_router.chat_model(provedores)
+    resposta = ChatPromptTemplate.from_messages(
+        [
+            ("system", SYSTEM_MESSAGE),
+            ("placeholder", "{chat_history}"),
+            ("user", "{input}"),
+        ]
+    ) | chat
+    return resposta, ChatPromptTemplate.from_template(SQL_PROMPT) | chat
+
 
-    conn.commit()
-    conn.close()
+@st.cache_resource(show_spinner=False)
+def tarefas_turno():
+    """Thread pool for the work left after an answer is shown, shared by every session."""
+    return ThreadPoolExecutor(TURN_WORKERS, thread_name_prefix="docgpt-turn")
 
 
 def hash_password(password):
@@ -254,80 +316,57 @@ def create_user(username, password):
     now = datetime.datetime.now()
     password_hash = hash_password(password)
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute(
+        database.execute(
             """
         INSERT INTO users (user_id, username, password_hash, created_at)
         VALUES (?, ?, ?, ?)
         """,
             (user_id, username, password_hash, now),
         )
-        conn.commit()
         success = True
     except sqlite3.IntegrityError:
         # Username already exists
         success = False
     
-    conn.close()
     return success, user_id if success else None
 
 
 def authenticate_user(username, password):
     """Authenticate a user by username and password."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
+    result = database.query_one(
         """
     SELECT user_id, password_hash FROM users WHERE username = ?
     """,
         (username,),
     )
     
-    result = cursor.fetchone()
-    conn.close()
-    
     if result and result[1] == hash_password(password):
         return True, result[0]  # Authentication successful, return user_id
     return False, None
 
 
 def save_file(file, file_type):
-    """Save an uploaded file to disk and return the path."""
-    if file_type == "Site" or file_type == "Youtube":
-        return None, file
-
-    os.makedirs("uploads", exist_ok=True)
+    """Store an uploaded file in the blob store; returns (path, url, blob digest)."""
+    if loaders.usa_url(file_type):
+        return None, file, None
 
-    # Get original filename without extension
-    original_filename = os.path.splitext(file.name)[0]
+    # Identical uploads share one copy on disk, whoever sent them
+    digest, caminho = blobs.put(file)
+    return caminho, None, digest
 
-    # Add timestamp to filename
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    new_filename = f"{original_filename}_{timestamp}"
 
-    # Add appropriate extension based on file type
-    file_ext = "." + file_type.lower()
-    filename = f"uploads/{new_filename}{file_ext}"
+def create_new_chat(user_id, file_type, file_path=None, file_url=None, doc_hash=None, conn=None):
+    """Create a new chat in the database associated with a specific user.
 
-    with open(filename, "wb") as f:
-        f.write(file.read())
-        file.seek(0)  # Reset file pointer for further processing
-
-    return filename, None
-
-
-def create_new_chat(user_id, file_type, file_path=None, file_url=None):
-    """Create a new chat in the database associated with a specific user."""
+    With `conn`, the row is written in the caller's transaction.
+    """
     chat_id = str(uuid.uuid4())
     now = datetime.datetime.now()
 
     title = (
         file_url
-        if (file_type == "Site" or file_type == "Youtube")
+        if loaders.usa_url(file_type)
         else os.path.basename(file_path)
     )
     # Create a readable title
@@ -344,174 +383,508 @@ def create_new_chat(user_id, file_type, file_path=None, file_url=None):
     else:
         title = f"{file_type}: {os.path.basename(file_path)}"
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+    (conn.execute if conn else database.execute)(
         """
-    INSERT INTO chats (chat_id, user_id, title, created_at, updated_at, file_type, file_path, file_url)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    INSERT INTO chats (chat_id, user_id, title, created_at, updated_at, file_type, file_path, file_url, doc_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
     """,
-        (chat_id, user_id, title, now, now, file_type, file_path, file_url),
+        (chat_id, user_id, title, now, now, file_type, file_path, file_url, doc_hash),
     )
-    conn.commit()
-    conn.close()
 
     return chat_id
 
 
 def update_chat_title(chat_id, new_title):
     """Update the title of a chat."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+    database.execute(
         """
     UPDATE chats SET title = ? WHERE chat_id = ?
     """,
         (new_title, chat_id),
     )
-    conn.commit()
-    conn.close()
 
 
-def get_chat_list(user_id):
+def _intervalo_datas(desde, ate):
+    # Bounds for created_at >= desde AND created_at < ate, with `ate`
+    # inclusive. They must not look like numbers: created_at has NUMERIC
+    # affinity and would otherwise be compared as a number.
+    return (
+        desde.isoformat() if desde else "",
+        (ate + datetime.timedelta(days=1)).isoformat() if ate else "9999-12-31",
+    )
+
+
+def get_chat_list(user_id, desde=None, ate=None):
     """Get a list of all chats for a specific user from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+    # Dates are formatted by SQLite instead of parsed per row on every rerun
+    return database.query(
         """
-    SELECT chat_id, title, created_at, file_type
+    SELECT chat_id, title, strftime('%d/%m/%Y %H:%M', created_at), file_type
     FROM chats
-    WHERE user_id = ?
+    WHERE user_id = ? AND created_at >= ? AND created_at < ?
     ORDER BY updated_at DESC
     """,
-        (user_id,),
+        (user_id, *_intervalo_datas(desde, ate)),
+    )
+
+
+def monta_consulta_busca(termo):
+    """Turn search box text into an FTS5 query matching every word.
+
+    The last word is matched as a prefix, since it may still be being typed.
+    """
+    palavras = [f'"{palavra}"' for palavra in re.findall(r"\w+", termo.lower())]
+    if palavras:
+        palavras[-1] += "*"
+    return " ".join(palavras)
+
+
+def search_chats(user_id, termo, desde=None, ate=None, limit=50):
+    """Rank a user's chats by full-text matches in their title or messages.
+
+    `desde`/`ate` (dates, inclusive) filter on the chat creation date.
+    Returns (chat_id, title, formatted date, file_type, highlighted snippet).
+    """
+    consulta = monta_consulta_busca(termo)
+    if not consulta:
+        return []
+    desde, ate = _intervalo_datas(desde, ate)
+    # Title matches weigh double (bm25 is negative: lower is better); each
+    # chat keeps its best hit, and only the returned rows get a snippet.
+    # CROSS JOIN keeps the FTS match as the outer loop, instead of one FTS
+    # lookup per chat of the user.
+    return database.query(
+        """
+    WITH hits AS (
+        SELECT chats.chat_rowid, 2 * bm25(chats_fts) AS score, NULL AS message_rowid
+        FROM chats_fts CROSS JOIN chats ON chats.chat_rowid = chats_fts.rowid
+        WHERE chats_fts MATCH :consulta AND chats.user_id = :user_id
+          AND chats.created_at >= :desde AND chats.created_at < :ate
+        UNION ALL
+        SELECT chats.chat_rowid, bm25(messages_fts), messages_fts.rowid
+        FROM messages_fts
+        CROSS JOIN messages ON messages.message_rowid = messages_fts.rowid
+        CROSS JOIN chats ON chats.chat_id = messages.chat_id
+        WHERE messages_fts MATCH :consulta AND chats.user_id = :user_id
+          AND chats.created_at >= :desde AND chats.created_at < :ate
+    ),
+    best AS (
+        SELECT chat_rowid, MIN(score) AS score, message_rowid
+        FROM hits GROUP BY chat_rowid
+        ORDER BY score LIMIT :limit
+    )
+    SELECT chats.chat_id, chats.title, strftime('%d/%m/%Y %H:%M', chats.created_at),
+           chats.file_type,
+           CASE WHEN best.message_rowid IS NULL THEN
+               (SELECT highlight(chats_fts, 0, '**', '**') FROM chats_fts
+                WHERE chats_fts MATCH :consulta AND chats_fts.rowid = best.chat_rowid)
+           ELSE
+               (SELECT snippet(messages_fts, 0, '**', '**', '…', 12) FROM messages_fts
+                WHERE messages_fts MATCH :consulta AND messages_fts.rowid = best.message_rowid)
+           END
+    FROM best JOIN chats ON chats.chat_rowid = best.chat_rowid
+    ORDER BY best.score
+    """,
+        {"consulta": consulta, "user_id": user_id, "desde": desde, "ate": ate, "limit": limit},
     )
-    chats = cursor.fetchall()
-    conn.close()
-    return chats
 
 
 def get_chat(chat_id):
     """Get chat details from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+    return database.query_one(
         """
-    SELECT * FROM chats WHERE chat_id = ?
+    SELECT chat_id, user_id, title, created_at, updated_at, file_type,
+           file_path, file_url, doc_hash, answer_cache_enabled
+    FROM chats WHERE chat_id = ?
     """,
         (chat_id,),
     )
-    chat = cursor.fetchone()
-    conn.close()
-    return chat
 
 
-def is_chat_owner(chat_id, user_id):
-    """Check if the user is the owner of the chat."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+def set_answer_cache_enabled(chat_id, enabled):
+    """Turn the answer cache on or off for a chat."""
+    database.execute(
         """
-    SELECT user_id FROM chats WHERE chat_id = ?
+    UPDATE chats SET answer_cache_enabled = ? WHERE chat_id = ?
     """,
-        (chat_id,),
+        (1 if enabled else 0, chat_id),
     )
-    result = cursor.fetchone()
-    conn.close()
-    
-    return result and result[0] == user_id
 
 
-def save_message(chat_id, role, content):
-    """Save a message to the database."""
-    message_id = str(uuid.uuid4())
-    now = datetime.datetime.now()
+def set_chat_doc_hash(chat_id, doc_hash):
+    """Record the content hash of a chat's document."""
+    database.execute(
+        """
+    UPDATE chats SET doc_hash = ? WHERE chat_id = ?
+    """,
+        (doc_hash, chat_id),
+    )
+
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def add_chat_document(chat_id, file_type, file_path, file_url, doc_hash, title,
+                      options=None, blob_digest=None, conn=None):
+    """Attach a loaded document to a chat (taking a reference on its blob).
 
-    # Save the message
-    cursor.execute(
+    With `conn`, the row is written in the caller's transaction.
+    """
+    (conn.execute if conn else database.execute)(
         """
-    INSERT INTO messages (message_id, chat_id, role, content, timestamp)
-    VALUES (?, ?, ?, ?, ?)
+    INSERT INTO chat_documents (document_id, chat_id, file_type, file_path, file_url, doc_hash, title, added_at, options, blob_digest)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """,
-        (message_id, chat_id, role, content, now),
+        (str(uuid.uuid4()), chat_id, file_type, file_path, file_url, doc_hash, title,
+         datetime.datetime.now(), json.dumps(options) if options else None, blob_digest),
     )
 
-    # Update the chat's updated_at timestamp
-    cursor.execute(
+
+def get_chat_documents(chat_id):
+    """Get the documents of a chat, in the order they were added."""
+    return database.query(
         """
-    UPDATE chats SET updated_at = ? WHERE chat_id = ?
+    SELECT file_type, file_path, file_url, doc_hash, title, options FROM chat_documents
+    WHERE chat_id = ?
+    ORDER BY added_at
     """,
-        (now, chat_id),
+        (chat_id,),
     )
 
-    conn.commit()
-    conn.close()
+
+def hash_documentos(doc_hashes):
+    """Combined content hash of a chat's documents, for the answer cache."""
+    doc_hashes = sorted(h for h in doc_hashes if h)
+    if len(doc_hashes) <= 1:
+        return doc_hashes[0] if doc_hashes else None
+    return hashlib.sha256("\0".join(doc_hashes).encode()).hexdigest()
 
 
-def get_messages(chat_id):
-    """Get all messages for a chat from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+def is_chat_owner(chat_id, user_id):
+    """Check if the user is the owner of the chat."""
+    result = database.query_one(
         """
-    SELECT role, content FROM messages
-    WHERE chat_id = ?
-    ORDER BY timestamp
+    SELECT user_id FROM chats WHERE chat_id = ?
     """,
         (chat_id,),
     )
-    messages = cursor.fetchall()
-    conn.close()
-    return messages
 
+    return result and result[0] == user_id
 
-def carrega_arquivos(tipo_arquivo, arquivo):
-    if tipo_arquivo == "Site":
-        documento = carrega_site(arquivo)
-    if tipo_arquivo == "Youtube":
-        documento = carrega_youtube(arquivo)
-    if tipo_arquivo == "Pdf":
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp:
-            temp.write(arquivo.read())
-            nome_temp = temp.name
-        arquivo.seek(0)  # Reset file pointer for further processing
-        documento = carrega_pdf(nome_temp)
-    if tipo_arquivo == "Csv":
-        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as temp:
-            temp.write(arquivo.read())
-            nome_temp = temp.name
-        arquivo.seek(0)  # Reset file pointer for further processing
-        documento = carrega_csv(nome_temp)
-    if tipo_arquivo == "Txt":
-        with tempfile.NamedTemporaryFile(suffix=".txt", delete=False) as temp:
-            temp.write(arquivo.read())
-            nome_temp = temp.name
-        arquivo.seek(0)  # Reset file pointer for further processing
-        documento = carrega_txt(nome_temp)
-    return documento
-
-
-def carrega_modelo(tipo_arquivo, arquivo, chat_id=None):
-    load_dotenv()
 
-    api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key:
-        st.error(
-            "API key not found in environment variables. Please set OPENAI_API_KEY."
+def save_message(chat_id, role, content):
+    """Queue a message for the database; returns its (timestamp, rowid) cursor.
+
+    The message is journaled and committed in the background with others
+    (see message_queue); the cursor waits for that commit when unpacked.
+    """
+    return message_queue.save(chat_id, role, content)
+
+
+def get_messages(chat_id, before=None, limit=None, after=None):
+    """Get messages for a chat from the database, oldest first.
+
+    Rows are (message_rowid, timestamp, role, content). With a limit, only
+    the latest `limit` messages are returned; `before` is the
+    (timestamp, message_rowid) keyset cursor of the oldest message already
+    shown, to page further back. Without one, `after` is the cursor of the
+    last message already covered (e.g. by the chat's summary), to get only
+    the later ones.
+    """
+    if limit is None:
+        if after is None:
+            return database.query(
+                """
+            SELECT message_rowid, timestamp, role, content FROM messages
+            WHERE chat_id = ?
+            ORDER BY timestamp, message_rowid
+            """,
+                (chat_id,),
+            )
+        return database.query(
+            """
+        SELECT message_rowid, timestamp, role, content FROM messages
+        WHERE chat_id = ? AND (timestamp, message_rowid) > (?, ?)
+        ORDER BY timestamp, message_rowid
+        """,
+            (chat_id, after[0], after[1]),
         )
-        st.stop()
 
-    documento = carrega_arquivos(tipo_arquivo, arquivo)
+    if before is None:
+        messages = database.query(
+            """
+        SELECT message_rowid, timestamp, role, content FROM messages
+        WHERE chat_id = ?
+        ORDER BY timestamp DESC, message_rowid DESC
+        LIMIT ?
+        """,
+            (chat_id, limit),
+        )
+    else:
+        messages = database.query(
+            """
+        SELECT message_rowid, timestamp, role, content FROM messages
+        WHERE chat_id = ? AND (timestamp, message_rowid) < (?, ?)
+        ORDER BY timestamp DESC, message_rowid DESC
+        LIMIT ?
+        """,
+            (chat_id, before[0], before[1], limit),
+        )
+    messages.reverse()
+    return messages
+
+
+def load_message_window(chat_id, before=None):
+    """Fetch one window of messages and whether there are older ones."""
+    messages = get_messages(chat_id, before, MESSAGE_WINDOW)
+    return messages, len(messages) == MESSAGE_WINDOW
+
+
+def get_chat_summary(chat_id):
+    """Get the rolling summary of a chat and the cursor of the last message it covers."""
+    result = database.query_one(
+        """
+    SELECT summary, upto_timestamp, upto_message_rowid FROM chat_summaries
+    WHERE chat_id = ?
+    """,
+        (chat_id,),
+    )
+    if result is None:
+        return "", None
+    summary, timestamp, rowid = result
+    return summary, (timestamp, rowid) if rowid is not None else None
+
+
+def save_chat_summary(chat_id, summary, cursor):
+    """Persist the rolling summary of a chat."""
+    timestamp, rowid = cursor if cursor else (None, None)
+    database.execute(
+        """
+    INSERT INTO chat_summaries (chat_id, summary, upto_timestamp, upto_message_rowid, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (chat_id) DO UPDATE SET
+        summary = excluded.summary,
+        upto_timestamp = excluded.upto_timestamp,
+        upto_message_rowid = excluded.upto_message_rowid,
+        updated_at = excluded.updated_at
+    """,
+        (chat_id, summary, timestamp, rowid, datetime.datetime.now()),
+    )
+
+
+def carrega_arquivo(tipo_arquivo, arquivo, progresso=None, opcoes=None):
+    """Load a document (a URL, or the path of a stored file); returns (text, content hash key).
+
+    TXT and PDF documents, and crawled sites, come back as a lazy iterator
+    of text blocks; its first block is read here, so a document that can't
+    be loaded fails now rather than while it is indexed, and a thread of
+    its own goes on reading the rest ahead of the indexer.
+
+    `opcoes` holds per-document settings, e.g. {"rastrear": True,
+    "profundidade": 2, "max_paginas": 50} to crawl a site.
+    """
+    loader = loaders.loader(tipo_arquivo)
+    rastrear = tipo_arquivo == "Site" and bool(opcoes and opcoes.get("rastrear"))
+
+    # Parsed text is cached by content hash, so reopening a chat skips parsing
+    if loader.url:
+        origem = arquivo
+        if rastrear:
+            origem += f"#crawl:{opcoes.get('profundidade')}:{opcoes.get('max_paginas')}"
+        chave = doc_cache.chave_documento(tipo_arquivo, origem.encode())
+        # A URL's content changes under the same key: it is refetched once
+        # its entry is older than URL_MAX_AGE
+        max_age = doc_cache.URL_MAX_AGE
+    else:
+        chave = doc_cache.chave_arquivo(tipo_arquivo, arquivo)
+        max_age = None
+
+    if not loader.cache:
+        return _adianta(loader.carrega(arquivo, progresso, opcoes), progresso), chave
+
+    documento = doc_cache.get(chave, max_age)
+    if documento is None:
+        documento = _adianta(doc_cache.itera(chave, max_age), progresso)
+    if documento is not None:
+        return documento, _versao(loader, chave, doc_cache.escrito_em(chave))
+
+    # Files are read straight from the blob store
+    buscado = time.time()
+    documento = loader.carrega(arquivo, progresso, opcoes)
+    if isinstance(documento, str):
+        doc_cache.put(chave, documento, buscado)
+        return documento, _versao(loader, chave, buscado)
+    # Blocks are cached as they are read
+    documento = _adianta(doc_cache.grava_blocos(chave, documento, buscado), progresso)
+    return documento, _versao(loader, chave, buscado)
+
+
+def _versao(loader, chave, buscado):
+    # The key a URL's document is indexed and its answers cached under also
+    # names the fetch, so a refetched page never reuses what the old one left
+    if not loader.url or buscado is None:
+        return chave
+    return f"{chave}@{int(buscado)}"
+
+
+def _adianta(documento, progresso=None):
+    # Reads the first block of a lazy document, so that fetching and
+    # parsing start on the loader thread and their errors surface there
+    if documento is None or isinstance(documento, str):
+        return documento
+    blocos = iter(documento)
+    primeiro = next(blocos, None)
+    if primeiro is None:
+        return iter(())
+    return _Antecipado(primeiro, blocos, progresso)
+
+
+class _Leitura:
+    # State shared by a read-ahead thread and the document it feeds
+    def __init__(self):
+        self.blocos = collections.deque()
+        self.tamanho = 0
+        self.fim = False
+        self.parado = False
+        self.erro = None
+        self.cond = threading.Condition()
+
+
+def _le_adiante(leitura, blocos, progresso):
+    try:
+        for bloco in blocos:
+            with leitura.cond:
+                while (leitura.blocos and leitura.tamanho + len(bloco) > INGEST_PREFETCH_CHARS
+                       and not leitura.parado):
+                    leitura.cond.wait()
+                if leitura.parado:
+                    break
+                leitura.blocos.append(bloco)
+                leitura.tamanho += len(bloco)
+                leitura.cond.notify_all()
+        else:
+            if progresso:
+                progresso(1, 1)
+    except Exception as e:
+        leitura.erro = e
+    finally:
+        # Lets a stopped loader clean up (partial cache files, crawls)
+        if hasattr(blocos, "close"):
+            blocos.close()
+        with leitura.cond:
+            leitura.fim = True
+            leitura.cond.notify_all()
+
+
+class _Antecipado:
+    """A lazy document whose blocks a thread of its own reads ahead.
+
+    Documents of a batch are indexed one after the other, but extracted at
+    the same time: a document waiting for its turn keeps being read, up to
+    INGEST_PREFETCH_CHARS. Dropping the iterator stops its thread.
+    """
 
-    system_message = """Você é um assistente amigável chamado DocGPT.
-    Você possui acesso às seguintes informações vindas 
-    de um documento {}: 
+    def __init__(self, primeiro, blocos, progresso=None):
+        self._primeiro = [primeiro]
+        # The thread only holds the shared state, so dropping this object stops it
+        self._leitura = _Leitura()
+        threading.Thread(
+            target=_le_adiante, args=(self._leitura, blocos, progresso), name="docgpt-read-ahead", daemon=True
+        ).start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._primeiro:
+            return self._primeiro.pop()
+        leitura = self._leitura
+        with leitura.cond:
+            while not leitura.blocos and not leitura.fim:
+                leitura.cond.wait()
+            if leitura.blocos:
+                bloco = leitura.blocos.popleft()
+                leitura.tamanho -= len(bloco)
+                leitura.cond.notify_all()
+                return bloco
+            if leitura.erro is not None:
+                erro, leitura.erro = leitura.erro, None
+                raise erro
+            raise StopIteration
+
+    def close(self):
+        with self._leitura.cond:
+            self._leitura.parado = True
+            self._leitura.blocos.clear()
+            self._leitura.tamanho = 0
+            self._leitura.cond.notify_all()
+
+    def __del__(self):
+        self.close()
+
+
+def carrega_arquivos(documentos, progresso=None, andamento=None):
+    """Load several documents concurrently.
+
+    `documentos` is a list of (tipo_arquivo, arquivo, opcoes). Returns, in the same
+    order, (text, content hash key, error message) tuples: a document that
+    fails only reports its own error. `progresso(fracao)` is called while
+    the batch runs.
+
+    Lazy documents are still being read when this returns. `andamento`, a
+    list with a slot per document, follows the fraction of each one loaded.
+    """
+    resultados = [None] * len(documentos)
+    andamento = [0.0] * len(documentos) if andamento is None else andamento
+
+    def progresso_documento(i):
+        def atualiza(feitas, total):
+            andamento[i] = feitas / total
+        return atualiza
+
+    with ThreadPoolExecutor(max_workers=max(1, min(INGEST_THREADS, len(documentos)))) as pool:
+        pendentes = {
+            pool.submit(carrega_arquivo, tipo_arquivo, arquivo, progresso_documento(i), opcoes): i
+            for i, (tipo_arquivo, arquivo, opcoes) in enumerate(documentos)
+        }
+        while pendentes:
+            concluidos, _ = wait(pendentes, timeout=0.25, return_when=FIRST_COMPLETED)
+            for futuro in concluidos:
+                i = pendentes.pop(futuro)
+                try:
+                    documento, chave = futuro.result()
+                    resultados[i] = (documento, chave, None)
+                    # Read-ahead threads report the rest of a lazy document
+                    if not isinstance(documento, _Antecipado):
+                        andamento[i] = 1.0
+                except Exception as e:
+                    andamento[i] = 1.0
+                    print(f"Error loading document {i}: {e!r}")
+                    LOAD_ERRORS.inc(tipo=documentos[i][0])
+                    resultados[i] = (None, None, str(e) or type(e).__name__)
+            if progresso:
+                progresso(sum(andamento) / len(documentos))
+
+    return resultados
+
+
+def titulo_documento(tipo_arquivo, arquivo):
+    """Display name of a document: its URL or uploaded file name."""
+    if loaders.usa_url(tipo_arquivo):
+        return arquivo
+    return os.path.basename(getattr(arquivo, "name", tipo_arquivo))
+
+
+def abre_documento(file_type, file_path, file_url):
+    """What to load for a stored chat document: its URL or its blob path."""
+    if loaders.usa_url(file_type):
+        return file_url
+    return file_path
+
+
+SYSTEM_MESSAGE = """Você é um assistente amigável chamado DocGPT.
+    Você possui acesso aos seguintes trechos de documentos ({tipo_arquivo}),
+    selecionados por relevância para a pergunta do usuário:
 
     ####
-    {}
+    {contexto}
     ####
 
     Utilize as informações fornecidas para basear as suas respostas.
@@ -519,42 +892,255 @@ def carrega_modelo(tipo_arquivo, arquivo, chat_id=None):
     Sempre que houver $ na sua saída, substita por S.
 
     Se a informação do documento for algo como "Just a moment...Enable JavaScript and cookies to continue" 
-    sugira ao usuário carregar novamente o Oráculo!""".format(
-        tipo_arquivo, documento
-    )
+    sugira ao usuário carregar novamente o Oráculo!"""
 
-    template = ChatPromptTemplate.from_messages(
-        [
-            ("system", system_message),
-            ("placeholder", "{chat_history}"),
-            ("user", "{input}"),
-        ]
-    )
-    chat = ChatOpenAI(model=DEFAULT_MODELO, api_key=api_key)
-    chain = template | chat
 
-    st.session_state["chain"] = chain
+def indexa_documento(indice, tipo_arquivo, arquivo, documento, titulo, embeddings, doc_hash=None):
+    """Add a loaded document to a chat's index.
 
-    # If this is a new document, create a new chat
-    if not chat_id:
-        if tipo_arquivo in ["Site", "Youtube"]:
-            file_path, file_url = None, arquivo
+    Documents are indexed once by content hash (`doc_hash`) and shared by
+    every chat that has them. CSV rows are streamed into the chat's table
+    store; only the table's schema and sample profile, named after this
+    chat's table, is indexed as text, for this chat alone.
+    """
+    if tipo_arquivo == "Csv":
+        with open(arquivo, "rb") as f, loaders.LOADER_SECONDS.time(loader="csv", stage="parse"):
+            documento = TableStore(indice.chat_id).import_csv(f, titulo)
+        doc_hash = None
+    indice.add_document(documento, titulo, embeddings, doc_hash)
+
+
+def ingere_documentos(payload, progresso, checkpoint):
+    """Job handler: load documents concurrently and add the ones that succeed to a chat.
+
+    `payload` holds the user, the chat (None to create one with the first
+    document that loads) and the stored documents. Returns {"chat_id",
+    "erros"}, where erros lists (title, error message) of the failed ones.
+
+    The chat created, the documents added and the size of the chat's index
+    and table store after them are checkpointed into the payload in the
+    transaction of each write, so a requeued job picks up from there.
+    """
+    armazenados = payload["documentos"]
+    chat_id = payload["chat_id"] or payload.get("chat_criado")
+    concluidos = payload.setdefault("concluidos", [])
+    indice = DocumentIndex(chat_id) if chat_id else None
+    tabelas = TableStore(chat_id) if chat_id else None
+    if indice is not None:
+        if "indice_ate" in payload:
+            # Requeued: drop what an interrupted document had indexed
+            indice.truncate(payload["indice_ate"])
+            tabelas.truncate(payload["tabelas_ate"])
         else:
-            file_path, file_url = save_file(arquivo, tipo_arquivo)
+            payload["indice_ate"], payload["tabelas_ate"] = indice.size(), tabelas.size()
+            with database.transaction() as conn:
+                checkpoint(conn)
+
+    pendentes = [i for i in range(len(armazenados)) if i not in concluidos]
+    documentos = [
+        (doc["tipo"], abre_documento(doc["tipo"], doc["file_path"], doc["file_url"]), doc["opcoes"])
+        for doc in (armazenados[i] for i in pendentes)
+    ]
+    # Fraction of each document loaded, and indexed; both weigh the same
+    carregado = [0.0] * len(documentos)
+    indexado = [0.0] * len(documentos)
+
+    def andamento():
+        return (sum(carregado) + sum(indexado)) / (2 * max(1, len(documentos)))
+
+    resultados = carrega_arquivos(
+        documentos, lambda fracao: progresso(andamento(), "Carregando documentos"), carregado
+    )
+
+    def acompanha(blocos, k, titulo):
+        for bloco in blocos:
+            yield bloco
+            # The indexer is never further behind the loader than its read-ahead
+            indexado[k] = carregado[k]
+            progresso(andamento(), f"Indexando {titulo}")
+
+    embeddings = carrega_embeddings()
+    erros = []
+    for k, (i, (tipo_arquivo, arquivo, opcoes), (documento, doc_hash, erro)) in enumerate(
+        zip(pendentes, documentos, resultados)
+    ):
+        doc = armazenados[i]
+        titulo = doc["titulo"]
+        if erro:
+            indexado[k] = 1.0
+            erros.append((titulo, erro))
+            continue
+
+        if chat_id is None:
+            # The chat is created by the first document that loads
+            with database.transaction() as conn:
+                chat_id = create_new_chat(
+                    payload["user_id"], tipo_arquivo, doc["file_path"], doc["file_url"], doc_hash, conn=conn
+                )
+                payload["chat_criado"] = chat_id
+                payload["titulo_chat"] = conn.execute(
+                    "SELECT title FROM chats WHERE chat_id = ?", (chat_id,)
+                ).fetchone()[0]
+                payload["indice_ate"] = payload["tabelas_ate"] = 0
+                checkpoint(conn)
+            indice, tabelas = DocumentIndex(chat_id), TableStore(chat_id)
+
+        if documento is not None and not isinstance(documento, str):
+            documento = acompanha(documento, k, titulo)
+        try:
+            indexa_documento(indice, tipo_arquivo, arquivo, documento, titulo, embeddings, doc_hash)
+        except Exception as e:
+            print(f"Error indexing {titulo}: {e!r}")
+            erros.append((titulo, str(e) or type(e).__name__))
+            continue
+        finally:
+            indexado[k] = 1.0
+            progresso(andamento(), f"Indexando {titulo}")
+        with database.transaction() as conn:
+            add_chat_document(
+                chat_id, tipo_arquivo, doc["file_path"], doc["file_url"], doc_hash, titulo,
+                opcoes, doc.get("blob"), conn=conn,
+            )
+            concluidos.append(i)
+            payload["indice_ate"], payload["tabelas_ate"] = indice.size(), tabelas.size()
+            checkpoint(conn)
+
+    carregados = len(concluidos)
+    if payload["chat_id"] is None and carregados > 1:
+        update_chat_title(chat_id, f"{payload['titulo_chat']} +{carregados - 1}")
+    if chat_id is not None:
+        set_chat_doc_hash(
+            chat_id, hash_documentos(doc_hash for _, _, _, doc_hash, _, _ in get_chat_documents(chat_id))
+        )
+    return {"chat_id": chat_id, "erros": erros}
+
+
+jobs.register("ingest", ingere_documentos)
+
+
+def envia_documentos(user_id, documentos, chat_id=None):
+    """Store uploaded documents and queue their ingestion; returns the job id.
+
+    `documentos` is a list of (tipo_arquivo, arquivo, opcoes). Raises
+    jobs.JobQueueFull when too many loads are already pending.
+    """
+    armazenados = []
+    for tipo_arquivo, arquivo, opcoes in documentos:
+        # Uploads are written to disk first, so the job doesn't depend on
+        # this session and can be requeued after a restart
+        file_path, file_url, blob = save_file(arquivo, tipo_arquivo)
+        armazenados.append({
+            "tipo": tipo_arquivo,
+            "titulo": titulo_documento(tipo_arquivo, arquivo),
+            "file_path": file_path,
+            "file_url": file_url,
+            "blob": blob,
+            "opcoes": opcoes,
+        })
+
+    titulo = armazenados[0]["titulo"]
+    if len(armazenados) > 1:
+        titulo += f" +{len(armazenados) - 1}"
+    payload = {"user_id": user_id, "chat_id": chat_id, "documentos": armazenados}
+    return jobs.submit("ingest", user_id, titulo, payload, chat_id)
+
+
+def carrega_modelo(chat_id):
+    """Open a chat, rebuilding its index first if it is missing."""
+    # Its latest messages may still be queued
+    message_queue.flush()
+    try:
+        chain, sql_chain = cadeias(LLM_PROVIDERS)
+        # The routed model, for the memory's summaries
+        chat = chain.last
+    except llm_router.LLMUnavailable:
+        st.error(
+            "API key not found in environment variables. Please set OPENAI_API_KEY "
+            "(or the key of a provider listed in DOCGPT_LLM_PROVIDERS)."
+        )
+        st.stop()
+
+    erros = []
+    if not DocumentIndex(chat_id).exists() or (
+        not TableStore(chat_id).exists()
+        and any(file_type == "Csv" for file_type, *_ in get_chat_documents(chat_id))
+    ):
+        # Chats created before retrieval mode (or before CSV tables, or
+        # before indexed documents were shared) have no index yet: rebuild
+        # it from the stored documents
+        armazenados = get_chat_documents(chat_id)
+        indice = DocumentIndex(chat_id)
+        indice.remove()
+        TableStore(chat_id).remove()
+        abertos = [
+            (file_type, abre_documento(file_type, file_path, file_url), json.loads(options or "{}"))
+            for file_type, file_path, file_url, _, _, options in armazenados
+        ]
+        resultados = carrega_arquivos(abertos)
+        for (file_type, arquivo, _), (_, _, _, _, titulo, _), (documento, doc_hash, erro) in zip(
+            abertos, armazenados, resultados
+        ):
+            if not erro:
+                try:
+                    indexa_documento(indice, file_type, arquivo, documento, titulo, carrega_embeddings(), doc_hash)
+                except Exception as e:
+                    erro = str(e) or type(e).__name__
+            if erro:
+                erros.append((titulo, erro))
+
+    armazenados = get_chat_documents(chat_id)
+    set_chat_doc_hash(chat_id, hash_documentos(doc_hash for _, _, _, doc_hash, _, _ in armazenados))
+    st.session_state["tipo_arquivo"] = ", ".join(sorted({file_type for file_type, *_ in armazenados}))
+    st.session_state["chain"] = chain
+    st.session_state["indice"] = DocumentIndex(chat_id)
 
-        chat_id = create_new_chat(st.session_state["user_id"], tipo_arquivo, file_path, file_url)
+    # Chats with CSV documents answer aggregate questions with generated SQL
+    tabelas = TableStore(chat_id)
+    if tabelas.exists():
+        st.session_state["tabelas"] = tabelas
+        st.session_state["sql_chain"] = sql_chain
+    else:
+        st.session_state.pop("tabelas", None)
+        st.session_state.pop("sql_chain", None)
+    embeddings = carrega_embeddings()
+    if embeddings is not None:
+        # Documents indexed while vector search was off, or whose vectors
+        # fell out of line with their chunks, are embedded again
+        DocumentIndex(chat_id).repair_vectors(embeddings)
+    st.session_state["embeddings"] = embeddings
 
     st.session_state["current_chat_id"] = chat_id
-    # Initialize or reset memory for this chat
-    st.session_state["memoria"] = ConversationBufferMemory()
 
-    # Load existing messages if any
-    messages = get_messages(chat_id)
-    for role, content in messages:
+    # Load only the latest window of messages; older ones are paged in on demand
+    messages, has_older = load_message_window(chat_id)
+    st.session_state["historico"] = {
+        "mensagens": [(role, content) for _, _, role, content in messages],
+        "cursor": (messages[0][1], messages[0][0]) if messages else None,
+        "tem_anteriores": has_older,
+    }
+
+    # Memory: the persisted summary plus every turn it doesn't cover yet,
+    # however far back they go past the window shown
+    summary, summary_cursor = get_chat_summary(chat_id)
+    memoria = TokenBudgetMemory(
+        summarizer=lambda prompt: chat.invoke(prompt).content,
+        summary=summary,
+        summary_cursor=summary_cursor,
+    )
+    for rowid, timestamp, role, content in get_messages(chat_id, after=summary_cursor):
         if role == "human":
-            st.session_state["memoria"].chat_memory.add_user_message(content)
+            memoria.add_user_message(content, (timestamp, rowid))
         elif role == "ai":
-            st.session_state["memoria"].chat_memory.add_ai_message(content)
+            memoria.add_ai_message(content, (timestamp, rowid))
+    # Turns past the summary and over the budget (a fold that failed, or
+    # never ran) are summarized in the background, not dropped
+    memoria.prune_async(
+        tarefas_turno(),
+        lambda resumo, cursor: save_chat_summary(chat_id, resumo, cursor),
+    )
+    st.session_state["memoria"] = memoria
+
+    return erros
 
 
 def login_page():
@@ -628,7 +1214,101 @@ def login_page():
 
 
 # Remove the logout button from pagina_chat()
-def pagina_chat():
+def inicia_turno():
+    """Start answering a question just sent, before the page is drawn.
+
+    The answer cache lookup, the document search, a table query and the
+    model request run on a thread of their own (llm_router.prefetch), so
+    the script draws the sidebar and the history while the model thinks.
+    The question is queued for saving, and the answer is checkpointed as
+    it streams in (message_queue.Rascunho).
+
+    Returns the turn for pagina_chat, or None without a new question.
+    """
+    pergunta = st.session_state.get("chat_input")
+    chain = st.session_state.get("chain")
+    chat_id = st.session_state.get("current_chat_id")
+    if not pergunta or chain is None or chat_id is None or "historico" not in st.session_state:
+        return None
+    if not is_chat_owner(chat_id, st.session_state["user_id"]):
+        return None
+
+    _, _, _, _, _, _, _, _, doc_hash, cache_enabled = get_chat(chat_id)
+    usar_cache = doc_hash is not None and st.session_state.get(f"answer_cache_{chat_id}", bool(cache_enabled))
+    # Everything the thread needs from the session, read here: it can't use st
+    historico = st.session_state["memoria"].buffer_as_messages
+    indice = st.session_state["indice"]
+    embeddings = st.session_state.get("embeddings")
+    tabelas = st.session_state.get("tabelas")
+    sql_chain = st.session_state.get("sql_chain")
+    tipo_arquivo = st.session_state["tipo_arquivo"]
+
+    turno = {
+        "pergunta": pergunta,
+        "inicio": time.perf_counter(),
+        "cursor_pergunta": save_message(chat_id, "human", pergunta),
+        "rascunho": message_queue.Rascunho(chat_id, "ai"),
+        "sql": None,
+        "enviado": threading.Event(),
+    }
+
+    def responde():
+        cache_key = None
+        if usar_cache:
+            cache_key = answer_cache.make_key(doc_hash, pergunta, historico)
+            resposta_cache = answer_cache.get(cache_key)
+            if resposta_cache is not None:
+                turno["enviado"].set()
+                ANSWERS.inc(origem="cache")
+                yield from answer_cache.replay(resposta_cache)
+                return
+
+        # Only the chunks relevant to this question go to the model
+        trechos = indice.search(pergunta, TOP_K, embeddings)
+        if tabelas:
+            contexto, turno["sql"] = consulta_tabelas(pergunta, tabelas, sql_chain)
+            trechos.append(contexto)
+        entrada = {
+            "input": pergunta,
+            "chat_history": historico,
+            "contexto": formata_contexto(trechos),
+            "tipo_arquivo": tipo_arquivo,
+        }
+        turno["enviado"].set()
+        yield from mede_stream(chain.stream(entrada))
+        ANSWERS.inc(origem="modelo")
+
+        # After the answer, off the request's path: the chain is prompt |
+        # model, so format the prompt alone to measure it
+        PROMPT_TOKENS.observe(count_tokens(chain.first.invoke(entrada).to_string()), chain="resposta")
+        if cache_key:
+            answer_cache.put(cache_key, doc_hash, pergunta, turno["rascunho"].content)
+
+    turno["pedacos"] = llm_router.prefetch(grava_resposta(responde(), turno["rascunho"]))
+    turno["enviado"].wait(REQUEST_HEAD_START)
+    return turno
+
+
+def grava_resposta(pedacos, rascunho):
+    """Pass an answer stream through, checkpointing its text to `rascunho`.
+
+    The message is queued when the stream ends; if it fails midway, what
+    was streamed is saved marked as interrupted.
+    """
+    completa = False
+    try:
+        for pedaco in pedacos:
+            conteudo = getattr(pedaco, "content", pedaco)
+            if isinstance(conteudo, str):
+                rascunho.append(conteudo)
+            yield pedaco
+        completa = True
+    finally:
+        rascunho.finish(interrompido=not completa)
+
+
+def pagina_chat(turno=None):
+    """The open chat: its history and, with `turno` (from inicia_turno), the answer being streamed."""
     # Header with logo
     col1, col2 = st.columns([1, 4])
     with col1:
@@ -656,7 +1336,7 @@ def pagina_chat():
     chain = st.session_state.get("chain")
     current_chat_id = st.session_state.get("current_chat_id")
 
-    if chain is None or current_chat_id is None:
+    if chain is None or current_chat_id is None or "historico" not in st.session_state:
         st.info(
             "Adicione um documento para ser analisado ou selecione uma conversa existente..."
         )
@@ -674,7 +1354,18 @@ def pagina_chat():
 
     # Get current chat details
     chat_details = get_chat(current_chat_id)
-    _, _, current_title, _, _, file_type, _, _ = chat_details
+    _, _, current_title, _, _, file_type, _, _, doc_hash, cache_enabled = chat_details
+
+    # Per-chat opt-out of reusing cached answers
+    usar_cache = st.toggle(
+        "Reutilizar respostas em cache",
+        value=bool(cache_enabled),
+        key=f"answer_cache_{current_chat_id}",
+        disabled=doc_hash is None,
+        help="Perguntas repetidas sobre o mesmo documento são respondidas sem consultar o modelo",
+    )
+    if usar_cache != bool(cache_enabled):
+        set_answer_cache_enabled(current_chat_id, usar_cache)
 
     # Chat container with subtle border
     with st.container():
@@ -687,36 +1378,111 @@ def pagina_chat():
         )
         
         memoria = st.session_state.get("memoria")
+        historico = st.session_state["historico"]
+
+        if historico["tem_anteriores"] and st.button(
+            "⬆️ Carregar mensagens anteriores", key="load_older"
+        ):
+            anteriores, has_older = load_message_window(
+                current_chat_id, historico["cursor"]
+            )
+            historico["mensagens"] = [
+                (role, content) for _, _, role, content in anteriores
+            ] + historico["mensagens"]
+            if anteriores:
+                historico["cursor"] = (anteriores[0][1], anteriores[0][0])
+            historico["tem_anteriores"] = has_older
 
         # Display chat messages
-        for mensagem in memoria.buffer_as_messages:
-            chat = st.chat_message(mensagem.type)
-            chat.markdown(mensagem.content)
+        for role, content in historico["mensagens"]:
+            chat = st.chat_message(role)
+            chat.markdown(content)
 
         st.markdown("</div>", unsafe_allow_html=True)
 
-        # Chat input at the bottom
-        input_usuario = st.chat_input(f"Faça uma pergunta sobre o documento", key="chat_input")
-        if input_usuario:
+        # Chat input at the bottom; a question sent is already being answered
+        st.chat_input(f"Faça uma pergunta sobre o documento", key="chat_input")
+        if turno is not None:
+            pergunta = turno["pergunta"]
             chat = st.chat_message("human")
-            chat.markdown(input_usuario)
-
-            # Save user message to database
-            save_message(current_chat_id, "human", input_usuario)
+            chat.markdown(pergunta)
 
             chat = st.chat_message("ai")
-            resposta = chat.write_stream(
-                chain.stream(
-                    {"input": input_usuario, "chat_history": memoria.buffer_as_messages}
-                )
+            # Above the answer, filled once it is known
+            consulta = chat.container()
+            try:
+                resposta = chat.write_stream(mostra_stream(turno["pedacos"], turno["inicio"]))
+            except llm_router.LLMUnavailable as e:
+                print(f"No LLM provider answered: {e}")
+                st.error("Nenhum provedor de LLM respondeu. Tente novamente em instantes.")
+                st.stop()
+            if turno["sql"]:
+                with consulta.expander("Consulta SQL"):
+                    st.code(turno["sql"], language="sql")
+
+            memoria.add_user_message(pergunta, turno["cursor_pergunta"])
+            memoria.add_ai_message(resposta, turno["rascunho"].pendente)
+            # Fold turns over the token budget into the persisted summary, in
+            # the background: the next question doesn't wait for the summarizer
+            memoria.prune_async(
+                tarefas_turno(),
+                lambda resumo, cursor: save_chat_summary(current_chat_id, resumo, cursor),
             )
+            st.session_state["memoria"] = memoria
+            historico["mensagens"] += [("human", pergunta), ("ai", resposta)]
+
+
+def mostra_stream(pedacos, inicio):
+    """Pass an answer stream through, recording the time from `inicio` to its first piece."""
+    primeiro = True
+    for pedaco in pedacos:
+        if primeiro:
+            TURN_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - inicio)
+            primeiro = False
+        yield pedaco
+
+
+def mede_stream(pedacos):
+    """Pass a model stream through, recording time to first token and tokens per second."""
+    inicio = time.perf_counter()
+    primeiro = None
+    textos = []
+    for pedaco in pedacos:
+        if primeiro is None:
+            primeiro = time.perf_counter()
+            FIRST_TOKEN_SECONDS.observe(primeiro - inicio)
+        conteudo = getattr(pedaco, "content", pedaco)
+        if isinstance(conteudo, str):
+            textos.append(conteudo)
+        yield pedaco
+
+    if primeiro is not None:
+        duracao = time.perf_counter() - primeiro
+        if duracao > 0:
+            TOKENS_PER_SECOND.observe(count_tokens("".join(textos)) / duracao)
+
+
+def consulta_tabelas(pergunta, tabelas, sql_chain):
+    """Answer a question over the chat's CSV tables with generated SQL.
+
+    Returns (context block, query), with the query and its (limited)
+    result in the context; the query is None when none was needed or it
+    failed, and the context says so. Runs off the script thread: no st.
+    """
+    perfil = tabelas.profile()
+    PROMPT_TOKENS.observe(count_tokens(SQL_PROMPT.format(perfil=perfil, pergunta=pergunta)), chain="sql")
+    resposta = sql_chain.invoke({"perfil": perfil, "pergunta": pergunta})
+    sql = extrai_sql(resposta.content)
+    if sql is None:
+        return f"Tabelas disponíveis:\n{perfil}", None
 
-            # Save AI response to database
-            save_message(current_chat_id, "ai", resposta)
+    try:
+        colunas, linhas, truncado = tabelas.execute(sql)
+    except TableQueryError as e:
+        print(f"Table query failed: {e}\n{sql}")
+        return f"Tabelas disponíveis:\n{perfil}\n\nA consulta {sql} falhou: {e}", None
 
-            memoria.chat_memory.add_user_message(input_usuario)
-            memoria.chat_memory.add_ai_message(resposta)
-            st.session_state["memoria"] = memoria
+    return f"Resultado da consulta SQL:\n{sql}\n\n{formata_resultado(colunas, linhas, truncado)}", sql
 
 
 def render_chat_list(container):
@@ -738,26 +1504,32 @@ def render_chat_list(container):
     # Add search functionality
     search_term = container.text_input(
         "🔍 Buscar conversas", key="chat_search",
-        placeholder="Busque por título ou data..."
+        placeholder="Busque por título, mensagem ou data..."
+    ).strip()
+    periodo = container.date_input(
+        "Período", value=(), format="DD/MM/YYYY", key="chat_search_dates",
+        help="Filtra pela data de criação da conversa"
     )
+    desde, ate = (tuple(periodo) + (None, None))[:2]
+
+    # A date typed in the search box filters by that day
+    data_digitada = re.fullmatch(r"(\d{1,2})/(\d{1,2})/(\d{4})", search_term)
+    if data_digitada:
+        dia, mes, ano = map(int, data_digitada.groups())
+        try:
+            desde = ate = datetime.date(ano, mes, dia)
+            search_term = ""
+        except ValueError:
+            pass
 
     container.divider()
 
-    # Get all chats for current user
-    chats = get_chat_list(st.session_state["user_id"])
-
-    # Filter chats based on search term
+    # Ranked full-text search over titles and messages, or the plain list
     if search_term:
-        filtered_chats = []
-        for chat in chats:
-            chat_id, title, created_at, file_type = chat
-            date = datetime.datetime.fromisoformat(created_at)
-            date_str = date.strftime("%d/%m/%Y")
-
-            # Check if search term is in title or matches date format
-            if (search_term.lower() in title.lower()) or (search_term in date_str):
-                filtered_chats.append(chat)
-        chats = filtered_chats
+        chats = search_chats(st.session_state["user_id"], search_term, desde, ate)
+    else:
+        chats = get_chat_list(st.session_state["user_id"], desde, ate)
+    filtrando = bool(search_term or desde or ate)
 
     # Display chat list
     if not chats:
@@ -767,14 +1539,10 @@ def render_chat_list(container):
             container.info("Nenhuma conversa encontrada.")
     else:
         # Show number of results if there's a search
-        if search_term:
+        if filtrando:
             container.success(f"{len(chats)} conversa(s) encontrada(s).")
 
-        for chat_id, title, created_at, file_type in chats:
-            # Format the date to be more readable
-            date = datetime.datetime.fromisoformat(created_at)
-            date_str = date.strftime("%d/%m/%Y %H:%M")
-
+        for chat_id, title, date_str, file_type, *trecho in chats:
             # Determine if this is the active chat
             is_active = st.session_state.get("current_chat_id") == chat_id
             
@@ -801,29 +1569,13 @@ def render_chat_list(container):
                     help=f"Criado em: {date_str}"
                 ):
                     # Load the selected chat
-                    chat_details = get_chat(chat_id)
-                    _, _, _, _, _, file_type, file_path, file_url = chat_details
-
-                    # Load the file
-                    if file_type in ["Site", "Youtube"]:
-                        arquivo = file_url
-                    else:
-                        # Open the file from disk
-                        with open(file_path, "rb") as f:
-                            arquivo_conteudo = f.read()
-
-                        # Create object after file is read into memory
-                        arquivo = type(
-                            "obj",
-                            (object,),
-                            {"read": lambda: arquivo_conteudo, "seek": lambda x: None},
-                        )
-
-                    carrega_modelo(file_type, arquivo, chat_id)
+                    st.session_state["erros_carregamento"] = carrega_modelo(chat_id=chat_id)
                     st.rerun()
 
-                # Small date label
+                # Small date label, plus the matching text of a search hit
                 container.caption(date_str)
+                if trecho:
+                    container.caption(trecho[0])
 
             # Delete button
             with col2:
@@ -833,17 +1585,15 @@ def render_chat_list(container):
                     help="Excluir esta conversa"
                 ):
                     # Implement delete functionality
-                    conn = sqlite3.connect(DB_PATH)
-                    cursor = conn.cursor()
-
-                    # Delete messages first (foreign key constraint)
-                    cursor.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+                    # Messages go with it through ON DELETE CASCADE (queued
+                    # ones first, or they would fail on the missing chat)
+                    message_queue.flush()
+                    database.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
 
-                    # Delete the chat
-                    cursor.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
-
-                    conn.commit()
-                    conn.close()
+                    DocumentIndex(chat_id).remove()
+                    TableStore(chat_id).remove()
+                    # Files no other chat uses anymore
+                    blobs.collect()
 
                     # If the deleted chat was the current one, clear the current chat
                     if st.session_state.get("current_chat_id") == chat_id:
@@ -860,7 +1610,7 @@ def render_chat_list(container):
     # Add the "Sair" button at the bottom of the chat list
     if container.button("Sair", key="logout_button", use_container_width=True):
         # Clear all session state related to authentication
-        for key in ["authenticated", "username", "user_id", "current_chat_id", "chain", "memoria"]:
+        for key in ["authenticated", "username", "user_id", "current_chat_id", "chain", "memoria", "indice", "historico", "tabelas", "sql_chain", "tipo_arquivo", "session_refreshed_at"]:
             if key in st.session_state:
                 del st.session_state[key]
         
@@ -882,58 +1632,186 @@ def file_upload_section(container):
         "Tipo de documento", TIPOS_ARQUIVOS_VALIDOS,
         help="Selecione o tipo de documento que deseja carregar"
     )
+    loader = loaders.loader(tipo_arquivo)
 
     # Check if file type changed
     file_type_changed = tipo_arquivo != st.session_state["previous_tipo_arquivo"]
     st.session_state["previous_tipo_arquivo"] = tipo_arquivo
 
     # Create unique keys for each input type to avoid conflicts
-    arquivo = None
+    arquivos = []
+    opcoes = None
     if tipo_arquivo == "Site":
-        arquivo = container.text_input(
-            "URL do site", 
+        urls = container.text_area(
+            "URLs dos sites (uma por linha)", 
             placeholder="https://exemplo.com",
             key="site_input"
         )
+        arquivos = [url.strip() for url in urls.splitlines() if url.strip()]
+
+        # Crawl mode: follow links within the same site
+        if container.checkbox(
+            "Rastrear páginas do mesmo site", key="crawl_toggle",
+            help="Segue os links do site respeitando o robots.txt"
+        ):
+            # Only needed once crawling is chosen: it brings in httpx and BeautifulSoup
+            from crawl import CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES
+
+            opcoes = {
+                "rastrear": True,
+                "profundidade": int(container.number_input(
+                    "Profundidade máxima", min_value=0, max_value=5,
+                    value=CRAWL_MAX_DEPTH, key="crawl_depth"
+                )),
+                "max_paginas": int(container.number_input(
+                    "Máximo de páginas", min_value=1, max_value=500,
+                    value=CRAWL_MAX_PAGES, key="crawl_pages"
+                )),
+            }
     elif tipo_arquivo == "Youtube":
-        arquivo = container.text_input(
-            "URL do vídeo", 
+        urls = container.text_area(
+            "URLs dos vídeos (uma por linha)", 
             placeholder="https://youtube.com/watch?v=...",
             key="youtube_input"
         )
-    elif tipo_arquivo == "Pdf":
-        arquivo = container.file_uploader(
-            "Arquivo PDF", type=["pdf"], 
-            key="pdf_uploader",
-            help="Faça upload de um arquivo PDF"
+        arquivos = [url.strip() for url in urls.splitlines() if url.strip()]
+    elif loader.url:
+        urls = container.text_area(
+            "URLs (uma por linha)",
+            key=f"{tipo_arquivo.lower()}_input"
         )
-    elif tipo_arquivo == "Csv":
-        arquivo = container.file_uploader(
-            "Arquivo CSV", type=["csv"], 
-            key="csv_uploader",
-            help="Faça upload de um arquivo CSV"
+        arquivos = [url.strip() for url in urls.splitlines() if url.strip()]
+    else:
+        arquivos = container.file_uploader(
+            f"Arquivos {tipo_arquivo.upper()}", type=list(loader.extensoes),
+            key=f"{tipo_arquivo.lower()}_uploader",
+            accept_multiple_files=True,
+            help=f"Faça upload de um ou mais arquivos {tipo_arquivo.upper()}"
         )
-    elif tipo_arquivo == "Txt":
-        arquivo = container.file_uploader(
-            "Arquivo TXT", type=["txt"], 
-            key="txt_uploader",
-            help="Faça upload de um arquivo TXT"
+
+    # Optionally add the documents to the open conversation instead
+    adicionar = False
+    if st.session_state.get("current_chat_id"):
+        adicionar = container.checkbox(
+            "Adicionar à conversa atual", key="add_to_chat",
+            help="Os documentos passam a fazer parte da conversa aberta"
         )
 
     # Submit button with nice styling
     if container.button(
         "Carregar e Analisar", 
         use_container_width=True,
-        disabled=not arquivo,
+        disabled=not arquivos,
         key="submit_doc",
-        help="Clique para carregar o documento e começar a conversa"
-    ) and arquivo:
-        with st.spinner("Processando documento..."):
-            carrega_modelo(tipo_arquivo, arquivo)
-        container.success("Documento carregado com sucesso!")
+        help="Clique para carregar os documentos e começar a conversa"
+    ) and arquivos:
+        documentos = [(tipo_arquivo, arquivo, opcoes) for arquivo in arquivos]
+        chat_id = st.session_state["current_chat_id"] if adicionar else None
+        # Loading runs in the background; painel_tarefas() follows its progress
+        try:
+            envia_documentos(st.session_state["user_id"], documentos, chat_id)
+        except jobs.JobQueueFull:
+            container.warning("Muitos documentos em processamento. Tente novamente em instantes.")
+        else:
+            st.rerun()
+
+    # Per-document failures of the last batch
+    for titulo, erro in st.session_state.pop("erros_carregamento", None) or []:
+        container.error(f"{titulo}: {erro}")
+
+    return tipo_arquivo, arquivos
+
+def conclui_tarefa(job_id, status, error, result, chat_id):
+    """React to a finished document job of the current user."""
+    jobs.acknowledge(job_id)
+    if status == jobs.FAILED:
+        st.session_state["erros_carregamento"] = [("Carregamento", error)]
+        return
+
+    resultado = json.loads(result)
+    st.session_state["erros_carregamento"] = resultado["erros"]
+    if chat_id is None:
+        return
+    # Open the new chat, or reload the open one with its new documents;
+    # a user chatting elsewhere meanwhile is not interrupted
+    atual = st.session_state.get("current_chat_id")
+    if atual is None or atual == chat_id:
+        st.session_state["erros_carregamento"] += carrega_modelo(chat_id)
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def _acompanha_tarefas():
+    tarefas = jobs.list_for_user(st.session_state["user_id"])
+    concluidas = [tarefa for tarefa in tarefas if tarefa[2] in (jobs.DONE, jobs.FAILED)]
+    if concluidas:
+        for job_id, _, status, _, _, error, result, chat_id in concluidas:
+            conclui_tarefa(job_id, status, error, result, chat_id)
+        # Refresh the chat list and the open chat
         st.rerun()
 
-    return tipo_arquivo, arquivo
+    for _, titulo, status, progresso, mensagem, *_ in tarefas:
+        if status == jobs.QUEUED:
+            st.progress(0.0, text=f"⏳ {titulo}: na fila")
+        else:
+            st.progress(progresso, text=f"⚙️ {titulo}: {mensagem or 'processando'} ({progresso:.0%})")
+
+
+def painel_tarefas():
+    """Progress of the user's document loads, polled while any is pending."""
+    # Only poll while there is something to follow
+    if jobs.list_for_user(st.session_state["user_id"]):
+        _acompanha_tarefas()
+
+
+def formata_metrica(nome, valor):
+    if nome.endswith("_seconds"):
+        return f"{valor * 1000:.1f} ms" if valor < 1 else f"{valor:.2f} s"
+    if nome.endswith("_per_second"):
+        return f"{valor:.1f}/s"
+    return f"{valor:.0f}"
+
+
+def painel_metricas():
+    """p50/p95 per stage over the recent samples, for admin users only."""
+    if st.session_state.get("username") not in ADMIN_USERS:
+        return
+    with st.expander("📊 Métricas"):
+        linhas = metrics.summary()
+        if not linhas:
+            st.caption("Nenhuma medição ainda.")
+            return
+        st.dataframe(
+            [
+                {
+                    "Etapa": nome.removeprefix("docgpt_"),
+                    "Detalhe": " ".join(f"{chave}={valor}" for chave, valor in rotulos.items()),
+                    "Amostras": total,
+                    "p50": formata_metrica(nome, p50),
+                    "p95": formata_metrica(nome, p95),
+                }
+                for nome, rotulos, total, p50, p95 in linhas
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
+        st.caption(f"Percentis sobre as últimas {metrics.SAMPLE_WINDOW} medições de cada série")
+        ocupados, documentos, referencias = docstore.stats()
+        st.caption(
+            f"Memória do processo: {metrics.resident_bytes() / 2**20:.0f} MB, dos quais "
+            f"{ocupados / 2**20:.0f} MB em {documentos} documento(s) compartilhado(s) "
+            f"por {referencias} referência(s) de sessões"
+        )
+        consultas = answer_cache.stats()
+        total = consultas["hits"] + consultas["misses"]
+        if total:
+            st.caption(
+                f"Cache de respostas: {consultas['hits']} acerto(s) em {total} consulta(s) "
+                f"({consultas['hits'] / total:.0%})"
+            )
+        reuso = llm_router.connection_reuse_rate()
+        if reuso is not None:
+            st.caption(f"Conexões reaproveitadas nas chamadas ao LLM: {reuso:.0%}")
+
 
 def main():
     # Configure the page with a wider layout
@@ -947,13 +1825,13 @@ def main():
     # Inject custom CSS
     inject_custom_css()
 
-    # Initialize the database
-    init_database()
+    # Settings, database schema and exporters, once per process
+    init_process(database.DB_PATH)
 
     # Check for logout action
     if st.query_params.get("logout"):
         # Clear all session state related to authentication
-        for key in ["authenticated", "username", "user_id", "current_chat_id", "chain", "memoria"]:
+        for key in ["authenticated", "username", "user_id", "current_chat_id", "chain", "memoria", "indice", "historico", "tabelas", "sql_chain", "tipo_arquivo", "session_refreshed_at"]:
             if key in st.session_state:
                 del st.session_state[key]
         
@@ -968,12 +1846,16 @@ def main():
     if "authenticated" not in st.session_state:
         st.session_state["authenticated"] = False
     
+    # Reruns of a signed-in session skip the cookie lookup
+    ja_autenticado = st.session_state["authenticated"]
+
     # First try to load session from cookie
-    is_authenticated = load_session_from_cookie()
+    is_authenticated = ja_autenticado or load_session_from_cookie()
     
-    # Debug info
-    print(f"Session authentication status: {is_authenticated}")
-    if is_authenticated:
+    # Debug info, only when the session state changes
+    if not ja_autenticado:
+        print(f"Session authentication status: {is_authenticated}")
+    if is_authenticated and not ja_autenticado:
         print(f"User ID: {st.session_state.get('user_id')}")
         print(f"Username: {st.session_state.get('username')}")
 
@@ -981,8 +1863,11 @@ def main():
     if not is_authenticated:
         login_page()
     else:
-        # Refresh the session cookie on each page load to extend its lifetime
-        save_session_cookie(st.session_state["user_id"], st.session_state["username"])
+        # Refresh the session cookie now and then to extend its lifetime
+        refresh_session_cookie()
+
+        # A question just sent is asked before the page is drawn
+        turno = inicia_turno()
         
         # Create a two-column layout
         left_col, right_col = st.columns([1, 3])
@@ -991,6 +1876,7 @@ def main():
             # Create a container for the file upload section
             with st.container():
                 file_upload_section(st)
+                painel_tarefas()
 
             st.divider()
 
@@ -998,12 +1884,16 @@ def main():
             with st.container():
                 render_chat_list(st)
 
+            painel_metricas()
+
         with right_col:
             # Display the chat interface
-            pagina_chat()
+            pagina_chat(turno)
 
    
 
 if __name__ == "__main__":
-    main()
+    # st.stop() and st.rerun() end a run by raising, so this also times those
+    with RERUN_SECONDS.time():
+        main()
 
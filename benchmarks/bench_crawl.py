@@ -0,0 +1,76 @@
+"""Site crawl throughput against a local static site, per concurrency level.
+
+Serves a synthetic site from a local HTTP server (with optional per-request
+latency to mimic a remote host) and prints a JSON report with pages/s for
+each per-host concurrency.
+
+    python benchmarks/bench_crawl.py --pages 100 --latency 0.05 --concurrency 1 2 4 8
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from crawl import crawl_sync
+from synthetic import gera_site
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    latencia = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latencia)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(diretorio, latencia):
+    handler = functools.partial(type("H", (Handler,), {"latencia": latencia}), directory=diretorio)
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    servidor = serve(gera_site(tempfile.mkdtemp(), args.pages), args.latency)
+    url = f"http://127.0.0.1:{servidor.server_address[1]}/index.html"
+
+    resultados = []
+    base = None
+    for concorrencia in args.concurrency:
+        inicio = time.perf_counter()
+        paginas = sum(1 for _ in crawl_sync(url, max_depth=args.depth, max_pages=args.pages,
+                                            per_host=concorrencia))
+        segundos = time.perf_counter() - inicio
+        base = base or segundos
+        resultados.append({
+            "concurrency": concorrencia,
+            "pages": paginas,
+            "seconds": round(segundos, 3),
+            "pages_per_second": round(paginas / segundos, 1),
+            "speedup": round(base / segundos, 2),
+        })
+
+    servidor.shutdown()
+    print(json.dumps({"site_pages": args.pages, "latency": args.latency, "results": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Shared document store: memory, disk and search time with many sessions.
+
+Adds one synthetic document (with vectors) to as many chats as there are
+sessions, as when everyone uploads the same file, and has every session
+search its own chat. Prints a JSON report with the search time, the
+index's size on disk, the bytes owned by docstore and the process's
+resident memory, in total and on the heap (Linux only):
+
+- shared_by_content: every chat references the one index of the
+  document's content hash, loaded once into docstore
+- shared_capped: the same with DOCSTORE_MAX_BYTES below one entry, so
+  every search loads it again
+- copy_per_chat: each chat indexes its own copy of the document, so each
+  session loads its own entry (up to the cap)
+
+    python benchmarks/bench_docstore.py --chunks 5000 --sessions 20
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import docstore
+import metrics
+import retrieval
+from retrieval import DocumentIndex
+
+
+class FakeEmbeddings:
+    """Random unit vectors of OpenAI's dimension, without the API."""
+
+    def __init__(self, dimensao=1536, seed=0):
+        self.dimensao = dimensao
+        self.rng = np.random.default_rng(seed)
+
+    def embed_documents(self, textos):
+        return self.rng.standard_normal((len(textos), self.dimensao)).astype(np.float32)
+
+    def embed_query(self, texto):
+        return self.rng.standard_normal(self.dimensao).astype(np.float32)
+
+
+def prepara(diretorio, chunks, sessoes, chave):
+    """A chat per session with the same document: indexed under `chave`, or per chat if None."""
+    embeddings = FakeEmbeddings()
+    tamanho = retrieval.CHUNK_SIZE - retrieval.CHUNK_OVERLAP
+    texto = ("contrato prazo multa pagamento " * (tamanho // 32 + 1))[:tamanho] * chunks
+    for n in range(sessoes):
+        DocumentIndex(f"chat{n}", diretorio).add_document(texto, "contrato.pdf", embeddings, chave)
+    return embeddings
+
+
+def disco_bytes(diretorio):
+    return sum(os.path.getsize(os.path.join(raiz, nome)) for raiz, _, nomes in os.walk(diretorio) for nome in nomes)
+
+
+def heap_bytes():
+    """Anonymous (heap) resident memory; mapped file pages are not counted."""
+    with open("/proc/self/status") as f:
+        for linha in f:
+            if linha.startswith("RssAnon:"):
+                return int(linha.split()[1]) * 1024
+    return 0
+
+
+def roda(nome, diretorio, sessoes, perguntas, embeddings):
+    gc.collect()
+    antes = metrics.resident_bytes()
+    heap_antes = heap_bytes()
+    indices = [DocumentIndex(f"chat{n}", diretorio) for n in range(sessoes)]
+    tempos = []
+    for _ in range(perguntas):
+        for indice in indices:
+            inicio = time.perf_counter()
+            indice.search("Qual o prazo?", retrieval.TOP_K, embeddings)
+            tempos.append(time.perf_counter() - inicio)
+    ocupados, entradas, referencias = docstore.stats()
+    linha = {
+        "scenario": nome,
+        "searches": len(tempos),
+        "search_p50_ms": round(statistics.median(tempos) * 1000, 2),
+        "search_p95_ms": round(metrics.quantile(sorted(tempos), 0.95) * 1000, 2),
+        "disk_mb": round(disco_bytes(diretorio) / 2**20, 1),
+        "resident_growth_mb": round((metrics.resident_bytes() - antes) / 2**20, 1),
+        "heap_growth_mb": round((heap_bytes() - heap_antes) / 2**20, 1),
+        "store_owned_mb": round(ocupados / 2**20, 1),
+        "store_entries": entradas,
+        "store_references": referencias,
+    }
+    del indices, indice
+    gc.collect()
+    linha["store_references_after_sessions_end"] = docstore.stats()[2]
+    return linha
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--questions", type=int, default=5, help="searches per session")
+    args = parser.parse_args()
+
+    resultados = []
+    for nome, chave, limite in (
+        ("shared_by_content", "pdf-contrato", docstore.DOCSTORE_MAX_BYTES),
+        ("shared_capped", "pdf-contrato", 1),
+        ("copy_per_chat", None, docstore.DOCSTORE_MAX_BYTES),
+    ):
+        diretorio = tempfile.mkdtemp(prefix="docgpt-docstore-")
+        try:
+            embeddings = prepara(diretorio, args.chunks, args.sessions, chave)
+            docstore.DOCSTORE_MAX_BYTES = limite
+            # Each scenario starts from an empty store
+            with docstore._lock:
+                for entrada in list(docstore._entradas):
+                    docstore._remove(entrada)
+            resultados.append(roda(nome, diretorio, args.sessions, args.questions, embeddings))
+        finally:
+            shutil.rmtree(diretorio, ignore_errors=True)
+
+    print(json.dumps({
+        "chunks": args.chunks,
+        "vectors_mb": round(args.chunks * 1536 * 4 / 2**20, 1),
+        "sessions": args.sessions,
+        "results": resultados,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
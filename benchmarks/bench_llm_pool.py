@@ -0,0 +1,117 @@
+"""LLM client pooling against a local OpenAI-compatible server.
+
+Streams chat completions from a local server that mimics the OpenAI API
+(with an optional delay on every new connection, standing in for the TCP
+and TLS handshakes of a remote API), and prints a JSON report with the
+time to first token and the connections the server saw:
+
+- fresh_client: a new ChatOpenAI per request, as when every chat opened
+  built its own client
+- pooled_client: llm_router's process-wide client and keep-alive pool
+
+    python benchmarks/bench_llm_pool.py --requests 50 --handshake-ms 50
+"""
+import argparse
+import http.server
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_router
+import metrics
+from fake_llm import RESPOSTA
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive needs HTTP/1.1 and a Content-Length
+    protocol_version = "HTTP/1.1"
+    handshake = 0.0
+    conexoes = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with Handler.lock:
+            Handler.conexoes += 1
+        time.sleep(self.handshake)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        eventos = []
+        for palavra in RESPOSTA.split(" "):
+            chunk = {
+                "id": "bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+                "choices": [{"index": 0, "delta": {"content": palavra + " "}, "finish_reason": None}],
+            }
+            eventos.append(f"data: {json.dumps(chunk)}\n\n")
+        eventos.append("data: [DONE]\n\n")
+        corpo = "".join(eventos).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(handshake):
+    handler = type("H", (Handler,), {"handshake": handshake})
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def roda(nome, cria_modelo, requisicoes):
+    conexoes_antes = Handler.conexoes
+    tempos = []
+    for _ in range(requisicoes):
+        inicio = time.perf_counter()
+        fluxo = cria_modelo().stream("Qual o prazo?")
+        next(fluxo)
+        tempos.append(time.perf_counter() - inicio)
+        for _ in fluxo:
+            pass
+    tempos.sort()
+    return {
+        "scenario": nome,
+        "requests": requisicoes,
+        "connections": Handler.conexoes - conexoes_antes,
+        "first_token_p50_ms": round(statistics.median(tempos) * 1000, 1),
+        "first_token_p95_ms": round(metrics.quantile(tempos, 0.95) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--handshake-ms", type=int, default=50, help="delay on every new connection")
+    args = parser.parse_args()
+
+    from langchain_openai import ChatOpenAI
+
+    servidor = serve(args.handshake_ms / 1000)
+    url = f"http://127.0.0.1:{servidor.server_address[1]}/v1"
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+
+    resultados = [
+        roda("fresh_client", lambda: ChatOpenAI(model="bench", base_url=url), args.requests),
+        roda("pooled_client", lambda: llm_router.client("OpenAI", "bench", base_url=url), args.requests),
+    ]
+    servidor.shutdown()
+    print(json.dumps({
+        "handshake_ms": args.handshake_ms,
+        "pooled_connection_reuse_rate": llm_router.connection_reuse_rate(),
+        "results": resultados,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Message saves per second with concurrent writers.
+
+Every writer thread saves messages to its own chat, as sessions do when
+they answer at the same time, on a fresh database. Prints a JSON report
+with the throughput and the time a save() call takes:
+
+- synchronous: one transaction per message (the INSERT and the chat's
+  updated_at), as app.save_message did before the queue
+- group_commit: message_queue.save(), with a final flush() so every
+  message counted is committed
+
+    python benchmarks/bench_messages.py --writers 8 --messages 500
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import message_queue
+import metrics
+from migrations import MIGRATIONS
+
+
+def salva_sincrono(chat_id, role, content):
+    now = datetime.datetime.now()
+    with database.transaction() as cursor:
+        rowid = cursor.execute(
+            "INSERT INTO messages (message_id, chat_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+            (str(uuid.uuid4()), chat_id, role, content, now),
+        ).lastrowid
+        cursor.execute("UPDATE chats SET updated_at = ? WHERE chat_id = ?", (now, chat_id))
+    return now.isoformat(" "), rowid
+
+
+def prepara(diretorio, nome, escritores):
+    database.close_all()
+    database.DB_PATH = os.path.join(diretorio, f"{nome}.db")
+    database.migrate(MIGRATIONS)
+    with database.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO chats (chat_id, user_id, title, created_at, updated_at) VALUES (?, NULL, 't', '2024-01-01', '2024-01-01')",
+            [(f"chat{n}",) for n in range(escritores)],
+        )
+
+
+def roda(nome, salva, escritores, mensagens):
+    tempos = [[] for _ in range(escritores)]
+    largada = threading.Barrier(escritores + 1)
+
+    def escritor(n):
+        largada.wait()
+        for i in range(mensagens):
+            inicio = time.perf_counter()
+            salva(f"chat{n}", "human" if i % 2 == 0 else "ai", f"mensagem {i} " * 20)
+            tempos[n].append(time.perf_counter() - inicio)
+
+    threads = [threading.Thread(target=escritor, args=(n,)) for n in range(escritores)]
+    for thread in threads:
+        thread.start()
+    largada.wait()
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    message_queue.flush()
+    total = time.perf_counter() - inicio
+
+    salvas = database.query_one("SELECT COUNT(*) FROM messages")[0]
+    chamadas = sorted(t for lista in tempos for t in lista)
+    return {
+        "scenario": nome,
+        "messages": salvas,
+        "seconds": round(total, 3),
+        "messages_per_second": round(salvas / total),
+        "save_p50_ms": round(statistics.median(chamadas) * 1000, 3),
+        "save_p95_ms": round(metrics.quantile(chamadas, 0.95) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=500, help="messages per writer")
+    args = parser.parse_args()
+
+    diretorio = tempfile.mkdtemp(prefix="docgpt-messages-")
+    inicial = os.getcwd()
+    os.chdir(diretorio)
+    try:
+        prepara(diretorio, "synchronous", args.writers)
+        resultados = [roda("synchronous", salva_sincrono, args.writers, args.messages)]
+        prepara(diretorio, "group_commit", args.writers)
+        resultados.append(roda("group_commit", message_queue.save, args.writers, args.messages))
+        lotes = message_queue.BATCH_MESSAGES.samples()
+    finally:
+        os.chdir(inicial)
+        database.close_all()
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    print(json.dumps({
+        "writers": args.writers,
+        "flush_ms": message_queue.MESSAGE_FLUSH_MS,
+        "batch": message_queue.MESSAGE_BATCH,
+        "group_commit_batch_p50": statistics.median(lotes),
+        "results": resultados,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
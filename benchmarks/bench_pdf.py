@@ -0,0 +1,100 @@
+"""PDF extraction: sequential vs. process pool, on synthetic PDFs.
+
+Prints a JSON report with pages/s and the speedup over one worker for each
+worker count. With --index, also times loading the PDF into a chunk index
+both ways the loader has worked: every page joined into one string before
+indexing, and carrega_pdf's page blocks indexed as they are extracted
+(with the time until the first block reaches the indexer).
+
+    python benchmarks/bench_pdf.py --pages 200 500 --workers 1 2 4 --index
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pdf_extract
+from loaders import carrega_pdf
+from pdf_extract import itera_paginas
+from retrieval import DocumentIndex
+from synthetic import gera_pdf
+
+
+def mede(caminho, workers, max_pendentes):
+    inicio = time.perf_counter()
+    paginas = sum(1 for _ in itera_paginas(caminho, workers=workers, max_pendentes_por_worker=max_pendentes))
+    return paginas, time.perf_counter() - inicio
+
+
+def indexa(caminho, workers, diretorio):
+    """(seconds joined then indexed, seconds streamed, seconds to the first streamed block)."""
+    pdf_extract.PDF_WORKERS = workers
+    inicio = time.perf_counter()
+    DocumentIndex("junto", diretorio).add_document("\n\n".join(itera_paginas(caminho, workers=workers)))
+    junto = time.perf_counter() - inicio
+
+    primeiro = None
+
+    def blocos():
+        nonlocal primeiro
+        for bloco in carrega_pdf(caminho):
+            if primeiro is None:
+                primeiro = time.perf_counter() - inicio
+            yield bloco
+
+    inicio = time.perf_counter()
+    DocumentIndex("blocos", diretorio).add_document(blocos())
+    streamed = time.perf_counter() - inicio
+    for nome in ("junto", "blocos"):
+        DocumentIndex(nome, diretorio).remove()
+    return junto, streamed, primeiro
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[200, 500])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--max-pending", type=int, default=2,
+                        help="ranges in flight per worker (0 = unbounded)")
+    parser.add_argument("--index", action="store_true", help="also time loading into a chunk index")
+    args = parser.parse_args()
+
+    diretorio = tempfile.mkdtemp()
+    resultados = []
+    for paginas in args.pages:
+        caminho = gera_pdf(os.path.join(diretorio, f"{paginas}.pdf"), paginas)
+        # Warm the pool so process start-up isn't part of the measurement
+        for workers in sorted(set(args.workers)):
+            mede(caminho, workers, args.max_pending)
+        base = None
+        for workers in sorted(set(args.workers)):
+            extraidas, segundos = mede(caminho, workers, args.max_pending)
+            base = base or segundos
+            resultados.append({
+                "pages": extraidas,
+                "workers": workers,
+                "seconds": round(segundos, 3),
+                "pages_per_second": round(extraidas / segundos, 1),
+                "speedup": round(base / segundos, 2),
+                "speedup_per_core": round(base / segundos / workers, 2),
+            })
+            if args.index:
+                junto, streamed, primeiro = indexa(caminho, workers, diretorio)
+                resultados[-1].update({
+                    "index_joined_seconds": round(junto, 3),
+                    "index_streamed_seconds": round(streamed, 3),
+                    "first_block_seconds": round(primeiro, 3),
+                })
+
+    shutil.rmtree(diretorio, ignore_errors=True)
+    print(json.dumps({"cpu_count": os.cpu_count(), "results": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""LLM router behaviour against local fake providers.
+
+Runs a few scenarios through llm_router.Router with fake streaming models
+of known latency and failure rates, and prints a JSON report with the
+time to first token and the requests each provider served:
+
+- routing: a fast and a slow provider; traffic should settle on the fast one
+- failover: the preferred provider always fails, or never answers
+- hedging: two providers with a slow tail, with and without a hedge
+
+    python benchmarks/bench_router.py --requests 200 --hedge-ms 250
+"""
+import argparse
+import collections
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm_router
+import metrics
+from fake_llm import FakeStreamingChat
+
+# model name -> fake model settings
+PERFIS = {
+    "rapido": {"first_token_latency": 0.02},
+    "lento": {"first_token_latency": 0.15},
+    "quebrado": {"first_token_latency": 0.01, "error_rate": 1.0},
+    "travado": {"first_token_latency": 30.0},
+    "cauda_a": {"first_token_latency": 0.03, "tail_rate": 0.1, "tail_latency": 1.0},
+    "cauda_b": {"first_token_latency": 0.03, "tail_rate": 0.1, "tail_latency": 1.0},
+}
+
+# Answers start with the model name, so the first chunk tells who answered
+llm_router.register_provider(
+    "Fake",
+    lambda modelo: FakeStreamingChat(
+        model=modelo, resposta=f"{modelo} respondeu: o prazo é 12 de março.", tokens_per_second=2000,
+        **PERFIS[modelo],
+    ),
+)
+
+
+def roda(nome, modelos, requisicoes, **opcoes):
+    router = llm_router.Router(cooldown=opcoes.pop("cooldown", 1.0), **opcoes)
+    chat_models = llm_router.chat_model(",".join(f"Fake:{modelo}" for modelo in modelos)).modelos
+    tempos, servidos, falhas = [], collections.Counter(), 0
+    for _ in range(requisicoes):
+        inicio = time.perf_counter()
+        try:
+            fluxo = router.stream(chat_models, "Qual o prazo?")
+            primeiro = next(fluxo)
+            tempos.append(time.perf_counter() - inicio)
+            for _ in fluxo:
+                pass
+        except llm_router.LLMUnavailable:
+            falhas += 1
+            continue
+        servidos[primeiro.content.strip()] += 1
+    tempos.sort()
+    return {
+        "scenario": nome,
+        "providers": modelos,
+        "requests": requisicoes,
+        "failed": falhas,
+        "served_by": dict(servidos),
+        "first_token_p50_ms": round(statistics.median(tempos) * 1000, 1) if tempos else None,
+        "first_token_p95_ms": round(metrics.quantile(tempos, 0.95) * 1000, 1) if tempos else None,
+        "first_token_max_ms": round(tempos[-1] * 1000, 1) if tempos else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--hedge-ms", type=int, default=100)
+    args = parser.parse_args()
+    random.seed(0)
+
+    # The router's failover and hedge prints would mix with the report
+    with contextlib.redirect_stdout(sys.stderr):
+        resultados = [
+            roda("routing", ["lento", "rapido"], args.requests),
+            roda("failover_error", ["quebrado", "rapido"], args.requests),
+            roda("failover_timeout", ["travado", "rapido"], 5, first_token_timeout=0.5),
+            roda("tail_no_hedge", ["cauda_a", "cauda_b"], args.requests),
+            roda("tail_hedged", ["cauda_a", "cauda_b"], args.requests, hedge_ms=args.hedge_ms),
+        ]
+    print(json.dumps({"hedge_ms": args.hedge_ms, "results": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Chat search latency for a user with thousands of chats.
+
+Seeds a fresh database with synthetic chats and messages (plus other users'
+chats as noise) and prints a JSON report with the p50/p95 latency of
+search_chats for a few kinds of terms.
+
+    python benchmarks/bench_search.py --chats 5000 --messages 20
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import database
+import metrics
+
+database.DB_PATH = os.path.join(tempfile.mkdtemp(), "search.db")
+
+import app
+from synthetic import PALAVRAS, VOCABULARIO, texto
+
+
+def semeia(usuarios, chats, mensagens, seed=0):
+    rng = random.Random(seed)
+    inicio = datetime.datetime(2024, 1, 1)
+    with database.transaction() as conn:
+        for usuario in usuarios:
+            conn.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (usuario, usuario))
+            for n in range(chats):
+                chat_id = str(uuid.uuid4())
+                criado = inicio + datetime.timedelta(minutes=rng.randrange(365 * 24 * 60))
+                conn.execute(
+                    "INSERT INTO chats (chat_id, user_id, title, created_at, updated_at, file_type) "
+                    "VALUES (?, ?, ?, ?, ?, 'Pdf')",
+                    (chat_id, usuario, f"Pdf: {rng.choice(PALAVRAS)}_{n}.pdf", criado, criado),
+                )
+                conn.executemany(
+                    "INSERT INTO messages (message_id, chat_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (str(uuid.uuid4()), chat_id, "human" if i % 2 == 0 else "ai",
+                         texto(rng), criado + datetime.timedelta(seconds=i))
+                        for i in range(mensagens)
+                    ],
+                )
+
+
+def mede(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    tempos.sort()
+    return {
+        "results": len(resultado),
+        "p50_ms": round(statistics.median(tempos), 2),
+        "p95_ms": round(metrics.quantile(tempos, 0.95), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=5000, help="chats per user")
+    parser.add_argument("--messages", type=int, default=20, help="messages per chat")
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app.init_database()
+    usuarios = [f"user{n}" for n in range(args.users)]
+    inicio = time.perf_counter()
+    semeia(usuarios, args.chats, args.messages)
+    segundos_carga = time.perf_counter() - inicio
+
+    usuario = usuarios[0]
+    casos = {
+        "frequent_word": lambda: app.search_chats(usuario, VOCABULARIO[40]),
+        "rare_word": lambda: app.search_chats(usuario, VOCABULARIO[5000]),
+        "two_words": lambda: app.search_chats(usuario, f"{VOCABULARIO[30]} {VOCABULARIO[300]}"),
+        "prefix": lambda: app.search_chats(usuario, VOCABULARIO[100][:3]),
+        "title": lambda: app.search_chats(usuario, f"{PALAVRAS[0]}_12"),
+        "with_dates": lambda: app.search_chats(
+            usuario, VOCABULARIO[40], datetime.date(2024, 3, 1), datetime.date(2024, 3, 31)
+        ),
+        "list_all": lambda: app.get_chat_list(usuario),
+    }
+    print(json.dumps({
+        "chats_per_user": args.chats,
+        "messages_per_chat": args.messages,
+        "users": args.users,
+        "seed_seconds": round(segundos_carga, 1),
+        "results": {nome: mede(funcao, args.repeat) for nome, funcao in casos.items()},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
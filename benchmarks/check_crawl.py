@@ -0,0 +1,152 @@
+"""Fail (exit code 1) if the crawler ignores Crawl-delay, leaves the host or outlives its consumer.
+
+Serves a local site whose pages link to each other and fetches it with
+several workers:
+
+- crawl delay: robots.txt asks for a Crawl-delay; requests from all the
+  workers together must start at least that far apart
+- redirects: a link that redirects to another host is dropped without
+  requesting that host, while a redirect within the host is followed
+- early close: closing crawl_sync() after the first page cancels the
+  crawl; the server sees no more requests afterwards
+- lazy loader: carrega_site_rastreado() yields one block per page, and
+  raises ErroCarregamento from the first next() when no page loads
+
+    python benchmarks/check_crawl.py --delay 1
+"""
+import argparse
+import http.server
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawl import crawl_sync
+from loaders import ErroCarregamento, carrega_site_rastreado
+
+# (host header, path, monotonic start) of every request received
+PEDIDOS = []
+_lock = threading.Lock()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    atraso = 0.0
+    lento = 0.0
+    paginas = 8
+
+    def do_GET(self):
+        with _lock:
+            PEDIDOS.append((self.headers.get("Host", ""), self.path, time.monotonic()))
+        porta = self.server.server_address[1]
+
+        if self.path == "/robots.txt":
+            corpo = f"User-agent: *\nCrawl-delay: {self.atraso:g}\n" if self.atraso else ""
+            return self.responde(200, corpo, "text/plain")
+        if self.path == "/fora":
+            return self.responde(302, cabecalhos={"Location": f"http://localhost:{porta}/roubada"})
+        if self.path == "/dentro":
+            return self.responde(302, cabecalhos={"Location": "/redirecionada"})
+        if self.path == "/vazia":
+            return self.responde(404)
+        time.sleep(self.lento)
+        links = "".join(f'<a href="/p{n}">p{n}</a>' for n in range(self.paginas))
+        corpo = (f"<html><body><p>Página {self.path} com texto próprio {self.path * 20}</p>"
+                 f'{links}<a href="/fora">fora</a><a href="/dentro">dentro</a></body></html>')
+        self.responde(200, corpo)
+
+    def responde(self, status, corpo="", tipo="text/html; charset=utf-8", cabecalhos=None):
+        dados = corpo.encode()
+        self.send_response(status)
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        try:
+            self.wfile.write(dados)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(**atributos):
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0), type("H", (Handler,), atributos))
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def pedidos():
+    with _lock:
+        return list(PEDIDOS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    # robotparser only reads whole seconds
+    parser.add_argument("--delay", type=int, default=1, help="Crawl-delay served in robots.txt")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    resultados = []
+
+    def confere(nome, ok, detalhe):
+        resultados.append(ok)
+        print(f"[{'ok' if ok else 'FAIL'}] {nome}: {detalhe}")
+
+    servidor, base = serve(atraso=args.delay, paginas=3)
+    urls = [url for url, _ in crawl_sync(f"{base}/index", max_depth=1, max_pages=20, per_host=args.workers)]
+    inicios = [inicio for _, caminho, inicio in pedidos() if caminho != "/robots.txt"]
+    intervalos = [b - a for a, b in zip(inicios, inicios[1:])]
+    # Slack for the timer and the event loop
+    menor = min(intervalos, default=0)
+    confere(
+        "crawl delay", len(inicios) > 2 and menor >= args.delay * 0.95,
+        f"{len(inicios)} requests by {args.workers} workers, at least {menor:.3f}s apart "
+        f"(Crawl-delay {args.delay:g}s)",
+    )
+
+    hosts = {host.split(":")[0] for host, _, _ in pedidos()}
+    confere(
+        "redirects",
+        "localhost" not in hosts and not any(url.endswith("/roubada") for url in urls)
+        and any(url.endswith("/redirecionada") for url in urls),
+        f"hosts requested {sorted(hosts)}; pages {sorted(url.rsplit('/', 1)[1] for url in urls)}",
+    )
+    servidor.shutdown()
+
+    PEDIDOS.clear()
+    servidor, base = serve(lento=0.1, paginas=40)
+    paginas = crawl_sync(f"{base}/index", max_depth=2, max_pages=40, per_host=2)
+    next(paginas)
+    paginas.close()
+    time.sleep(0.3)
+    depois_de_fechar = len(pedidos())
+    time.sleep(1.0)
+    mais = len(pedidos()) - depois_de_fechar
+    confere(
+        "early close", mais == 0 and depois_de_fechar < 40,
+        f"{depois_de_fechar} requests before the crawl was cancelled, {mais} after",
+    )
+
+    blocos = carrega_site_rastreado(f"{base}/index", 1, 3)
+    primeiro = next(blocos)
+    resto = list(blocos)
+    try:
+        next(carrega_site_rastreado(f"{base}/vazia", 1, 3))
+        vazio = "no error"
+    except ErroCarregamento:
+        vazio = "ErroCarregamento"
+    confere(
+        "lazy loader", primeiro.startswith("Página: ") and len(resto) == 2 and vazio == "ErroCarregamento",
+        f"{1 + len(resto)} page blocks; a site with no pages raised {vazio}",
+    )
+    servidor.shutdown()
+    return 0 if all(resultados) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
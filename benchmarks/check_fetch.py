@@ -0,0 +1,180 @@
+"""Fail (exit code 1) if fetch() stops retrying, backing off or meeting its deadline.
+
+Serves a local HTTP site whose paths misbehave on purpose and fetches
+them with short timeouts:
+
+- flaky: 503 for the first requests, then 200; fetch() must retry and
+  return the body, waiting no longer than the backoff windows allow
+- throttled: 429 with a Retry-After; the retry must wait that long
+- retry after the deadline: a Retry-After longer than what is left of
+  the deadline fails at once instead of sleeping past it
+- always down: 503 on every request; fetch() must give up with
+  FetchError(status=503) within the deadline, after several attempts
+- slow: the server answers after the attempt timeout; every attempt
+  times out and fetch() fails at the deadline, not later
+- not found: a 404 fails on the first attempt, without retries
+- too large: a body over max_bytes is rejected, without retries
+
+    python benchmarks/check_fetch.py --deadline 1.5
+"""
+import argparse
+import collections
+import http.server
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fetch
+from fetch import FetchError
+
+# Requests received per path
+PEDIDOS = collections.Counter()
+_lock = threading.Lock()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    lento = 1.0
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parametros = dict(urllib.parse.parse_qsl(url.query))
+        with _lock:
+            PEDIDOS[self.path] += 1
+            pedido = PEDIDOS[self.path]
+
+        if url.path == "/flaky" and pedido <= int(parametros["falhas"]):
+            return self.responde(503)
+        if url.path == "/throttled" and pedido == 1:
+            return self.responde(429, {"Retry-After": parametros["espera"]})
+        if url.path == "/down":
+            return self.responde(503)
+        if url.path == "/slow":
+            time.sleep(self.lento)
+        if url.path == "/missing":
+            return self.responde(404)
+        if url.path == "/large":
+            return self.responde(200, corpo=b"x" * int(parametros["bytes"]))
+        self.responde(200)
+
+    def responde(self, status, cabecalhos=None, corpo=b"conteudo"):
+        self.send_response(status)
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        try:
+            self.wfile.write(corpo)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def serve():
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def tenta(url, **kwargs):
+    """(body or FetchError, seconds, requests the server saw)."""
+    caminho = url.split("/", 3)[3]
+    inicio = time.monotonic()
+    try:
+        resultado = fetch.fetch_sync(url, **kwargs)[0]
+    except FetchError as e:
+        resultado = e
+    with _lock:
+        return resultado, time.monotonic() - inicio, PEDIDOS[f"/{caminho}"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deadline", type=float, default=1.5)
+    parser.add_argument("--attempt-timeout", type=float, default=0.3)
+    parser.add_argument("--backoff-base", type=float, default=0.05)
+    parser.add_argument("--backoff-max", type=float, default=0.2)
+    args = parser.parse_args()
+
+    servidor = serve()
+    # Start the client (and pick its User-Agent) outside the timed fetches
+    fetch.client()
+    Handler.lento = args.attempt_timeout * 3
+    base = f"http://127.0.0.1:{servidor.server_address[1]}"
+    opcoes = {
+        "deadline": args.deadline,
+        "attempt_timeout": args.attempt_timeout,
+        "backoff_base": args.backoff_base,
+        "backoff_max": args.backoff_max,
+    }
+    # Slack for the server, the event loop and the process being busy
+    folga = 0.25
+    resultados = []
+
+    def confere(nome, ok, detalhe):
+        resultados.append(ok)
+        print(f"[{'ok' if ok else 'FAIL'}] {nome}: {detalhe}")
+
+    falhas = 3
+    corpo, segundos, pedidos = tenta(f"{base}/flaky?falhas={falhas}", **opcoes)
+    # Full jitter: attempt n waits at most min(max, base * 2**n)
+    espera_maxima = sum(min(args.backoff_max, args.backoff_base * 2**n) for n in range(falhas))
+    confere(
+        "flaky", corpo == b"conteudo" and pedidos == falhas + 1 and segundos <= espera_maxima + folga,
+        f"{pedidos} requests, {segundos:.2f}s (backoff allows {espera_maxima:.2f}s)",
+    )
+
+    corpo, segundos, pedidos = tenta(f"{base}/throttled?espera=0.4", **opcoes)
+    confere(
+        "throttled", corpo == b"conteudo" and pedidos == 2 and 0.4 <= segundos <= 0.4 + folga,
+        f"{pedidos} requests, {segundos:.2f}s after a 429 with Retry-After: 0.4",
+    )
+
+    espera = args.deadline * 4
+    erro, segundos, pedidos = tenta(f"{base}/throttled?espera={espera:g}", **opcoes)
+    confere(
+        "retry after the deadline",
+        isinstance(erro, FetchError) and erro.status == 429 and pedidos == 1 and segundos <= folga,
+        f"gave up in {segundos:.2f}s on a Retry-After of {espera:g}s",
+    )
+
+    erro, segundos, pedidos = tenta(f"{base}/down", **opcoes)
+    confere(
+        "always down",
+        isinstance(erro, FetchError) and erro.status == 503 and pedidos > 2
+        and segundos <= args.deadline + folga,
+        f"{pedidos} requests, gave up in {segundos:.2f}s (deadline {args.deadline:g}s)",
+    )
+
+    erro, segundos, pedidos = tenta(f"{base}/slow", **opcoes)
+    confere(
+        "slow",
+        isinstance(erro, FetchError) and pedidos >= 2 and segundos <= args.deadline + folga,
+        f"{pedidos} attempts timed out, gave up in {segundos:.2f}s (deadline {args.deadline:g}s)",
+    )
+
+    erro, segundos, pedidos = tenta(f"{base}/missing", **opcoes)
+    confere(
+        "not found", isinstance(erro, FetchError) and erro.status == 404 and pedidos == 1,
+        f"{pedidos} request, {segundos:.2f}s",
+    )
+
+    erro, segundos, pedidos = tenta(f"{base}/large?bytes=4096", max_bytes=1024, **opcoes)
+    confere(
+        "too large", isinstance(erro, FetchError) and pedidos == 1,
+        f"{pedidos} request, {erro if isinstance(erro, FetchError) else 'body accepted'}",
+    )
+
+    servidor.shutdown()
+    return 0 if all(resultados) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""Fail (exit code 1) if a requeued job redoes work or a live job is stolen.
+
+- crash: a child process runs an ingest job of three TXT documents into a
+  new chat and is SIGKILLed right after indexing the second one, before
+  its chat_documents row is written. Once its heartbeat lapses, recover()
+  must finish the job with one chat, three documents and exactly the
+  index of a clean load: the first document isn't added twice, and the
+  interrupted one is dropped from the index before it is added again
+- restart: a running job owned by an earlier start of a process with
+  this very pid is requeued once its heartbeat lapses, while a job of a
+  live owner (fresh heartbeat) is left alone until its heartbeat lapses too
+
+    python benchmarks/check_job_recovery.py
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+LEASE_SECONDS = 0.5
+
+# Run in the child, from the scenario's directory
+INGESTAO = textwrap.dedent("""
+    import json, os, signal, sys, time
+    sys.path.insert(0, {raiz!r})
+    import app, jobs, retrieval
+    original = retrieval.DocumentIndex.add_document
+    indexados = []
+    def add_document(self, *args, **kwargs):
+        total = original(self, *args, **kwargs)
+        indexados.append(total)
+        if len(indexados) == 2:
+            os.kill(os.getpid(), signal.SIGKILL)
+        return total
+    retrieval.DocumentIndex.add_document = add_document
+    jobs.submit("ingest", "usuario", "t", json.loads({payload!r}))
+    time.sleep(120)
+""")
+
+
+def prepara(diretorio):
+    import database
+    from migrations import MIGRATIONS
+
+    os.chdir(diretorio)
+    database.close_all()
+    database.DB_PATH = os.path.join(diretorio, "docgpt.db")
+    database.migrate(MIGRATIONS)
+    database.execute("INSERT INTO users (user_id, username) VALUES ('usuario', 'usuario')")
+    return {**os.environ, "DOCGPT_DB_PATH": database.DB_PATH, "DOCGPT_JOB_LEASE_SECONDS": str(LEASE_SECONDS)}
+
+
+def espera(job_id, segundos=120):
+    import jobs
+
+    fim = time.monotonic() + segundos
+    while time.monotonic() < fim:
+        estado = jobs.get(job_id)
+        if estado[2] in (jobs.DONE, jobs.FAILED):
+            return estado
+        time.sleep(0.1)
+    return jobs.get(job_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-kb", type=int, default=256, help="size of each TXT document")
+    args = parser.parse_args()
+    raiz = tempfile.mkdtemp(prefix="docgpt-jobs-")
+    inicial = os.getcwd()
+    resultados = []
+
+    def confere(nome, ok, detalhe):
+        resultados.append(ok)
+        print(f"[{'ok' if ok else 'FAIL'}] {nome}: {detalhe}")
+
+    try:
+        import database
+        import jobs
+        from synthetic import gera_txt
+
+        jobs.JOB_LEASE_SECONDS = LEASE_SECONDS
+
+        diretorio = os.path.join(raiz, "crash")
+        os.makedirs(diretorio)
+        ambiente = prepara(diretorio)
+        documentos = []
+        for n in range(3):
+            caminho = gera_txt(os.path.join(diretorio, f"doc{n}.txt"), args.size_kb * 1024, seed=n)
+            documentos.append({"tipo": "Txt", "titulo": f"doc{n}.txt", "file_path": caminho,
+                               "file_url": None, "blob": None, "opcoes": None})
+        payload = json.dumps({"user_id": "usuario", "chat_id": None, "documentos": documentos})
+        subprocess.run([sys.executable, "-c", INGESTAO.format(raiz=RAIZ, payload=payload)],
+                       cwd=diretorio, env=ambiente, capture_output=True, timeout=300)
+
+        import app
+        from retrieval import DocumentIndex
+
+        antes = database.query_one("SELECT COUNT(*) FROM chat_documents")[0]
+        time.sleep(LEASE_SECONDS * 1.2)
+        jobs.recover()
+        job_id = database.query_one("SELECT job_id FROM jobs")[0]
+        estado = espera(job_id)
+        chats = [row[0] for row in database.query("SELECT chat_id FROM chats")]
+        titulos = [row[0] for row in database.query("SELECT title FROM chat_documents ORDER BY added_at")]
+
+        referencia = DocumentIndex("referencia")
+        for doc in documentos:
+            documento, chave = app.carrega_arquivo("Txt", doc["file_path"])
+            referencia.add_document(documento, doc["titulo"], chave=chave)
+        esperados = referencia.size()
+        indexados = DocumentIndex(chats[0]).size() if chats else 0
+        resultado = json.loads(estado[6] or "{}")
+        confere(
+            "crash",
+            estado[2] == jobs.DONE and len(chats) == 1 and resultado.get("chat_id") == chats[0]
+            and sorted(titulos) == ["doc0.txt", "doc1.txt", "doc2.txt"] and indexados == esperados,
+            f"job {estado[2]}, {len(chats)} chat(s), documents {titulos} ({antes} before the requeue), "
+            f"{indexados} documents indexed of {esperados}",
+        )
+
+        diretorio = os.path.join(raiz, "restart")
+        os.makedirs(diretorio)
+        prepara(diretorio)
+        jobs.register("eco", lambda payload, progresso, checkpoint: {"eco": payload["n"]})
+        agora = datetime.datetime.now()
+        for job_id, owner, heartbeat in (
+            ("anterior", f"{os.getpid()}_anterior", time.time() - LEASE_SECONDS * 2),
+            ("vivo", "outro_processo", time.time()),
+        ):
+            database.execute(
+                """
+            INSERT INTO jobs (job_id, user_id, kind, title, status, progress, payload, pid, owner, heartbeat_at,
+                              created_at, updated_at)
+            VALUES (?, 'usuario', 'eco', 't', 'running', 0.5, '{"n": 1}', ?, ?, ?, ?, ?)
+            """,
+                (job_id, os.getpid(), owner, heartbeat, agora, agora),
+            )
+        jobs._recupera()
+        anterior = espera("anterior", 10)[2]
+        vivo_antes = jobs.get("vivo")[2]
+        # The heartbeat thread rescans: the live owner's job goes once its heartbeat lapses
+        vivo_depois = espera("vivo", LEASE_SECONDS * 10)[2]
+        confere(
+            "restart",
+            anterior == jobs.DONE and vivo_antes == jobs.RUNNING and vivo_depois == jobs.DONE,
+            f"same-pid earlier start's job {anterior}; live owner's job {vivo_antes} while its "
+            f"heartbeat was fresh, {vivo_depois} after it lapsed",
+        )
+    finally:
+        os.chdir(inicial)
+        shutil.rmtree(raiz, ignore_errors=True)
+
+    return 0 if all(resultados) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
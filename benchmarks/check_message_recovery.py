@@ -0,0 +1,232 @@
+"""Fail (exit code 1) if the message queue loses or duplicates a message.
+
+Each scenario runs a writer in a child process against a fresh database
+and checks the messages table afterwards:
+
+- crash: the writer queues messages (with a flush interval so long that
+  only full batches are committed), tears a journal line in half and is
+  SIGKILLed; recover() must commit every whole message, once
+- replay: recovering a journal whose messages were already committed
+  (a crash between commit and journal cleanup) must save nothing twice
+- shutdown: the writer exits normally with messages still queued; the
+  exit handler must commit them and leave no journal behind
+- deleted chat: a queued message of a chat that no longer exists is
+  dropped without failing the rest of its batch
+- streaming: the writer is SIGKILLed while one answer is still being
+  written (a Rascunho) and right after another was finished; recover()
+  must save the text checkpointed so far of the first, marked as
+  interrupted, and the second exactly once
+- restart: a journal and a batch file left by an earlier start of a
+  process with this very pid (as after a restart in a container) must
+  be replayed, and this process's own journal must not mix with them
+
+Writers run with a short lease, so their files count as orphaned right
+after they die.
+
+    python benchmarks/check_message_recovery.py --messages 500
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+LEASE_SECONDS = 0.5
+
+# Run in the child, from the scenario's directory
+ESCRITOR = textwrap.dedent("""
+    import os, signal, sys
+    sys.path.insert(0, {raiz!r})
+    import message_queue
+    for n in range({mensagens}):
+        message_queue.save("chat", "human" if n % 2 == 0 else "ai", f"mensagem {{n}}")
+    message_queue.save("apagado", "human", "conversa excluída")
+    if {rasga}:
+        with open(message_queue._caminho, "a") as f:
+            f.write('{{"message_id": "meia-linha", "chat_id": "ch')
+    if {mata}:
+        os.kill(os.getpid(), signal.SIGKILL)
+""")
+
+STREAMING = textwrap.dedent("""
+    import os, signal, sys
+    sys.path.insert(0, {raiz!r})
+    import message_queue
+    message_queue.DRAFT_CHECKPOINT_SECONDS = 0
+    terminada = message_queue.Rascunho("chat", "ai")
+    terminada.append("resposta completa")
+    terminada.finish()
+    cortada = message_queue.Rascunho("chat", "ai")
+    for n in range(50):
+        cortada.append(f"parte {{n}} ")
+    os.kill(os.getpid(), signal.SIGKILL)
+""")
+
+
+def prepara(diretorio):
+    import database
+    from migrations import MIGRATIONS
+
+    database.close_all()
+    database.DB_PATH = os.path.join(diretorio, "mensagens.db")
+    database.migrate(MIGRATIONS)
+    database.execute(
+        "INSERT INTO chats (chat_id, user_id, title, created_at, updated_at) VALUES ('chat', NULL, 't', '2024-01-01', '2024-01-01')"
+    )
+    return {**os.environ, "DOCGPT_DB_PATH": database.DB_PATH}
+
+
+def escreve(diretorio, ambiente, mensagens, mata=False, rasga=False, flush_ms=600_000, codigo=None):
+    codigo = codigo or ESCRITOR.format(raiz=RAIZ, mensagens=mensagens, mata=mata, rasga=rasga)
+    subprocess.run(
+        [sys.executable, "-c", codigo], cwd=diretorio, capture_output=True,
+        env={**ambiente, "DOCGPT_MESSAGE_FLUSH_MS": str(flush_ms), "DOCGPT_MESSAGE_LEASE_SECONDS": str(LEASE_SECONDS)},
+    )
+
+
+def contagens():
+    import database
+
+    total, distintas = database.query_one("SELECT COUNT(*), COUNT(DISTINCT content) FROM messages")
+    orfas = database.query_one("SELECT COUNT(*) FROM messages WHERE chat_id = 'apagado'")[0]
+    return total, distintas, orfas
+
+
+def recupera(diretorio):
+    import message_queue
+
+    os.chdir(diretorio)
+    message_queue.MESSAGE_LEASE_SECONDS = LEASE_SECONDS
+    # Until the dead writer's lease lapses
+    time.sleep(LEASE_SECONDS * 1.2)
+    message_queue.recover()
+
+
+def orfaos(diretorio):
+    """Files left in a journal directory, other than this process's own."""
+    import message_queue
+
+    return [nome for nome in os.listdir(os.path.join(diretorio, "journal")) if message_queue._processo not in nome]
+
+
+def deixa_journal(diretorio, processo, mensagens):
+    """Journal files of a dead process start: a batch file and the live journal."""
+    journal = os.path.join(diretorio, "journal")
+    os.makedirs(journal, exist_ok=True)
+    for nome, lote in ((f"messages-{processo}.jsonl.1", mensagens[:1]), (f"messages-{processo}.jsonl", mensagens[1:])):
+        # Written aside and moved in whole, so the recovery thread never sees half of it
+        temporario = os.path.join(diretorio, nome)
+        with open(temporario, "w", encoding="utf-8") as f:
+            for conteudo in lote:
+                f.write(json.dumps({"message_id": conteudo, "chat_id": "chat", "role": "human",
+                                    "content": conteudo, "timestamp": "2024-01-02 00:00:00"}) + "\n")
+        os.replace(temporario, os.path.join(journal, nome))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+    n = args.messages
+    raiz = tempfile.mkdtemp(prefix="docgpt-recovery-")
+    inicial = os.getcwd()
+    resultados = []
+
+    def confere(nome, ok, detalhe):
+        resultados.append(ok)
+        print(f"[{'ok' if ok else 'FAIL'}] {nome}: {detalhe}")
+
+    try:
+        import database
+
+        diretorio = os.path.join(raiz, "crash")
+        os.makedirs(diretorio)
+        ambiente = prepara(diretorio)
+        escreve(diretorio, ambiente, n, mata=True, rasga=True)
+        antes = contagens()[0]
+        journals = glob.glob(os.path.join(diretorio, "journal", "*"))
+        copia = os.path.join(raiz, "journal-copia.jsonl")
+        shutil.copy(journals[0], copia)
+        recupera(diretorio)
+        total, distintas, orfas = contagens()
+        ultima = database.query_one("SELECT updated_at FROM chats WHERE chat_id = 'chat'")[0]
+        maxima = database.query_one("SELECT MAX(timestamp) FROM messages")[0]
+        confere(
+            "crash", antes < n and total == distintas == n and orfas == 0 and ultima == maxima
+            and not orfaos(diretorio),
+            f"{antes} committed before the crash, {total} after recovery ({distintas} distinct) of {n}, "
+            f"chat updated_at {'matches' if ultima == maxima else 'does not match'} the last message",
+        )
+
+        # The same journal again, as if the crash came after the commit
+        os.makedirs(os.path.join(diretorio, "journal"), exist_ok=True)
+        shutil.copy(copia, os.path.join(diretorio, "journal", os.path.basename(journals[0])))
+        recupera(diretorio)
+        total, distintas, _ = contagens()
+        confere("replay", total == distintas == n, f"{total} messages after replaying a committed journal")
+
+        diretorio = os.path.join(raiz, "shutdown")
+        os.makedirs(diretorio)
+        ambiente = prepara(diretorio)
+        escreve(diretorio, ambiente, n)
+        total, distintas, orfas = contagens()
+        restantes = glob.glob(os.path.join(diretorio, "journal", "*"))
+        confere(
+            "shutdown", total == distintas == n and orfas == 0 and not restantes,
+            f"{total} of {n} committed at exit, {len(restantes)} journal files left",
+        )
+
+        diretorio = os.path.join(raiz, "deleted")
+        os.makedirs(diretorio)
+        ambiente = prepara(diretorio)
+        escreve(diretorio, ambiente, n, flush_ms=5)
+        total, distintas, orfas = contagens()
+        confere("deleted chat", total == distintas == n and orfas == 0, f"{total} of {n} saved, {orfas} orphans")
+
+        diretorio = os.path.join(raiz, "streaming")
+        os.makedirs(diretorio)
+        ambiente = prepara(diretorio)
+        escreve(diretorio, ambiente, 0, codigo=STREAMING.format(raiz=RAIZ))
+        recupera(diretorio)
+        import message_queue
+
+        salvas = [conteudo for (conteudo,) in database.query("SELECT content FROM messages ORDER BY message_rowid")]
+        esperada = "".join(f"parte {n} " for n in range(50)) + message_queue.INTERRUPTED
+        confere(
+            "streaming", sorted(salvas) == sorted(["resposta completa", esperada])
+            and not orfaos(diretorio),
+            f"{len(salvas)} messages saved, interrupted answer "
+            f"{'complete up to its last checkpoint' if esperada in salvas else 'missing or cut'}",
+        )
+
+        diretorio = os.path.join(raiz, "restart")
+        os.makedirs(diretorio)
+        prepara(diretorio)
+        deixa_journal(diretorio, f"{os.getpid()}_anterior", ["antes do crash 1", "antes do crash 2"])
+        recupera(diretorio)
+        message_queue.save("chat", "human", "depois do restart")
+        message_queue.flush()
+        salvas = sorted(conteudo for (conteudo,) in database.query("SELECT content FROM messages"))
+        restantes = [nome for nome in os.listdir(os.path.join(diretorio, "journal")) if "_anterior" in nome]
+        confere(
+            "restart", salvas == ["antes do crash 1", "antes do crash 2", "depois do restart"] and not restantes,
+            f"{len(salvas)} of 3 messages saved after a restart with the same pid, "
+            f"{len(restantes)} files of the earlier start left",
+        )
+    finally:
+        os.chdir(inicial)
+        shutil.rmtree(raiz, ignore_errors=True)
+
+    return 0 if all(resultados) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Fail (exit code 1) if a hot query regresses to a table scan or a sort.
+
+The queries are captured from the real app.py data functions, run against
+a freshly migrated database, and checked with EXPLAIN QUERY PLAN.
+
+    python benchmarks/check_query_plans.py
+"""
+import datetime
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+database.DB_PATH = os.path.join(tempfile.mkdtemp(), "plans.db")
+
+import app
+
+# Plan fragments that mean the query no longer uses its index
+FORBIDDEN = ("SCAN messages", "SCAN chats", "USE TEMP B-TREE")
+
+
+def capture_queries(calls):
+    captured = []
+    real_query = database.query
+
+    def recording_query(sql, params=()):
+        captured.append((sql, params))
+        return real_query(sql, params)
+
+    database.query = recording_query
+    try:
+        for call in calls:
+            call()
+    finally:
+        database.query = real_query
+    return captured
+
+
+def main():
+    app.init_database()
+
+    queries = capture_queries(
+        [
+            lambda: app.get_messages("chat"),
+            lambda: app.get_messages("chat", limit=50),
+            lambda: app.get_messages("chat", before=("2024-01-01", 1), limit=50),
+            lambda: app.get_chat_list("user"),
+            lambda: app.get_chat_list("user", datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)),
+        ]
+    )
+
+    failed = False
+    for sql, params in queries:
+        plan = database.explain(sql, params)
+        bad = [line for line in plan if line.startswith(FORBIDDEN)]
+        status = "FAIL" if bad else "ok"
+        failed = failed or bool(bad)
+        print(f"[{status}] {' '.join(sql.split())}")
+        for line in plan:
+            print(f"       {line}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Fail (exit code 1) if streaming a large TXT file exceeds a peak-RSS ceiling.
+
+Generates a synthetic text file (1 GB by default), reads it with the
+mmap-based TXT loader and chunks every block the way the index does
+(optionally indexing it for real), then compares the process's peak RSS
+growth with the ceiling.
+
+    python benchmarks/check_txt_memory.py --size-mb 1024 --max-rss-mb 256
+"""
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loaders import carrega_txt
+from retrieval import DocumentIndex, divide_texto
+from synthetic import gera_txt
+
+
+def pico_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--max-rss-mb", type=float, default=256)
+    parser.add_argument("--index", action="store_true", help="also build a DocumentIndex from it")
+    args = parser.parse_args()
+
+    diretorio = tempfile.mkdtemp()
+    try:
+        caminho = gera_txt(os.path.join(diretorio, "grande.txt"), args.size_mb * 1024 * 1024)
+        base = pico_rss_mb()
+
+        inicio = time.perf_counter()
+        if args.index:
+            chunks = DocumentIndex("memoria", index_dir=diretorio).add_document(carrega_txt(caminho), "grande.txt")
+        else:
+            chunks = sum(len(divide_texto(bloco)) for bloco in carrega_txt(caminho))
+        segundos = time.perf_counter() - inicio
+
+        crescimento = pico_rss_mb() - base
+        ok = crescimento <= args.max_rss_mb
+        print(
+            f"[{'ok' if ok else 'FAIL'}] {args.size_mb} MB -> {chunks} chunks in {segundos:.1f}s, "
+            f"peak RSS +{crescimento:.0f} MB (ceiling {args.max_rss_mb:.0f} MB)"
+        )
+        return 0 if ok else 1
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Offline stand-in for ChatOpenAI that streams a canned answer with set latencies."""
+import random
+import time
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+RESPOSTA = (
+    "De acordo com os trechos do documento, o prazo final do contrato é 12 de março "
+    "e o pagamento deve ser feito em até trinta dias após a entrega, sob pena de multa."
+)
+
+# [time.perf_counter() of the request, of its first chunk] for every
+# streaming request, to time a turn from outside the app
+PEDIDOS = []
+
+
+class FakeStreamingChat(BaseChatModel):
+    """Answers every prompt with RESPOSTA, word by word.
+
+    Accepts (and ignores) ChatOpenAI's model and api_key arguments. A
+    fraction of the requests can fail before the first token (error_rate)
+    or take tail_latency instead of first_token_latency (tail_rate).
+    """
+
+    model: str = "fake"
+    api_key: str = ""
+    first_token_latency: float = 0.3
+    tokens_per_second: float = 50.0
+    resposta: str = RESPOSTA
+    error_rate: float = 0.0
+    tail_rate: float = 0.0
+    tail_latency: float = 5.0
+
+    @property
+    def _llm_type(self):
+        return "fake-streaming"
+
+    def _palavras(self):
+        palavras = self.resposta.split(" ")
+        return [palavra + " " for palavra in palavras[:-1]] + palavras[-1:]
+
+    def _espera_primeiro_token(self):
+        if random.random() < self.tail_rate:
+            time.sleep(self.tail_latency)
+        else:
+            time.sleep(self.first_token_latency)
+        if random.random() < self.error_rate:
+            raise ConnectionError(f"{self.model}: simulated provider error")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        palavras = self._palavras()
+        self._espera_primeiro_token()
+        time.sleep(len(palavras) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.resposta))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        pedido = [time.perf_counter(), None]
+        PEDIDOS.append(pedido)
+        self._espera_primeiro_token()
+        for n, palavra in enumerate(self._palavras()):
+            if n:
+                time.sleep(1 / self.tokens_per_second)
+            else:
+                pedido[1] = time.perf_counter()
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=palavra))
+            if run_manager:
+                run_manager.on_llm_new_token(palavra, chunk=chunk)
+            yield chunk
+
+
+def instala(first_token_latency=0.3, tokens_per_second=50.0):
+    """Make `langchain_openai.ChatOpenAI` build FakeStreamingChat models from now on.
+
+    app.py imports ChatOpenAI on every script run, so this must happen
+    before the app runs.
+    """
+    import langchain_openai
+
+    langchain_openai.ChatOpenAI = type(
+        "ChatOpenAI",
+        (FakeStreamingChat,),
+        {
+            "__module__": __name__,
+            "__annotations__": {"first_token_latency": float, "tokens_per_second": float},
+            "first_token_latency": first_token_latency,
+            "tokens_per_second": tokens_per_second,
+        },
+    )
@@ -0,0 +1,84 @@
+"""Multi-process stress run for the shared SQLite layer.
+
+Several processes write messages into one database at the same time, the
+way several Streamlit servers share docgpt.db. The run fails (exit code 1)
+if any write is lost or raises.
+
+    python benchmarks/stress_db.py --processes 8 --writes 500
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def writer(db_path, chat_id, writes, errors):
+    import database
+
+    database.DB_PATH = db_path
+    try:
+        for i in range(writes):
+            with database.transaction() as cursor:
+                cursor.execute(
+                    "INSERT INTO messages (message_id, chat_id, role, content, timestamp) "
+                    "VALUES (?, ?, ?, ?, datetime('now'))",
+                    (str(uuid.uuid4()), chat_id, "human", f"mensagem {i}"),
+                )
+                cursor.execute(
+                    "UPDATE chats SET updated_at = datetime('now') WHERE chat_id = ?",
+                    (chat_id,),
+                )
+            # Interleave reads with the writes, like a real rerun does
+            database.query("SELECT role, content FROM messages WHERE chat_id = ?", (chat_id,))
+    except Exception as e:
+        errors.put(f"{os.getpid()}: {e!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=500)
+    args = parser.parse_args()
+
+    import database
+    from app import init_database
+
+    db_path = os.path.join(tempfile.mkdtemp(), "stress.db")
+    database.DB_PATH = db_path
+    init_database()
+    with database.transaction() as cursor:
+        cursor.execute(
+            "INSERT INTO chats (chat_id, user_id, title) VALUES ('stress', NULL, 'stress')"
+        )
+
+    errors = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=writer, args=(db_path, "stress", args.writes, errors))
+        for _ in range(args.processes)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    failures = []
+    while not errors.empty():
+        failures.append(errors.get())
+    (count,) = database.query_one("SELECT COUNT(*) FROM messages WHERE chat_id = 'stress'")
+    expected = args.processes * args.writes
+
+    print(f"{count}/{expected} messages in {elapsed:.2f}s ({count / elapsed:.0f} writes/s)")
+    for failure in failures:
+        print(f"error: {failure}")
+    return 0 if count == expected and not failures else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
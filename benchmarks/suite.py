@@ -0,0 +1,543 @@
+"""Reproducible benchmark suite: loaders, chat opening and turns, data functions.
+
+For each size, generates synthetic documents (PDF, CSV, TXT and a local
+HTML site) and a chat history, then measures:
+
+- every carrega_* loader (and the CSV table import, which replaced
+  carrega_csv), on the generated files and site;
+- the ingestion job, carrega_modelo end to end (opening a chat, with and
+  without its index) and full chat turns, through Streamlit's AppTest
+  against an offline fake streaming model that stands in for ChatOpenAI;
+- idle reruns of the script: on the login page, signed in, and with a
+  chat open;
+- chat turns as the script sees them, from the start of its run: when
+  the model request goes out and when its first token comes back (with
+  a short and a long history on screen), and how long the run lasts
+  when every turn folds the memory into a summary;
+- process cold start: importing app.py, and the first render of the
+  login page, each in a fresh interpreter;
+- the app.py data functions on a database with that many messages.
+
+Everything runs in a temporary directory against a fresh database, and
+the report is written as JSON; --compare prints the change between two
+reports.
+
+    python benchmarks/suite.py --sizes small medium large --out depois.json
+    python benchmarks/suite.py --compare antes.json depois.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import database
+
+DIRETORIO = tempfile.mkdtemp(prefix="docgpt-bench-")
+database.DB_PATH = os.path.join(DIRETORIO, "suite.db")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import app
+import fake_llm
+import metrics
+from bench_crawl import serve
+from loaders import carrega_pdf, carrega_site, carrega_site_rastreado, carrega_txt
+from migrations import MIGRATIONS
+from synthetic import PALAVRAS, VOCABULARIO, gera_csv, gera_pdf, gera_site, gera_txt, texto
+from tabular import TableStore
+
+SIZES = {
+    "small": {"pdf_pages": 20, "txt_mb": 4, "csv_rows": 10_000, "site_pages": 20, "messages": 10_000},
+    "medium": {"pdf_pages": 100, "txt_mb": 32, "csv_rows": 100_000, "site_pages": 100, "messages": 100_000},
+    "large": {"pdf_pages": 500, "txt_mb": 256, "csv_rows": 1_000_000, "site_pages": 300, "messages": 1_000_000},
+}
+
+PERGUNTAS = [
+    "Qual o prazo final do contrato?",
+    "Quais são as multas previstas?",
+    "Resuma as obrigações do fornecedor.",
+    "Qual o valor total dos pagamentos?",
+]
+
+
+def mede(funcao, repeticoes):
+    """Run a function `repeticoes` times; returns its last result and the timings."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, tempos
+
+
+def resultado(grupo, nome, tamanho, tempos, **extra):
+    tempos = sorted(tempos)
+    linha = {
+        "group": grupo,
+        "name": nome,
+        "size": tamanho,
+        "runs": len(tempos),
+        "seconds": round(statistics.median(tempos), 6),
+    }
+    if len(tempos) > 1:
+        linha["p95_seconds"] = round(metrics.quantile(tempos, 0.95), 6)
+    linha.update(extra)
+    return linha
+
+
+def banco_novo(nome):
+    """Point the app at a fresh, migrated database."""
+    database.close_all()
+    database.DB_PATH = os.path.join(DIRETORIO, f"{nome}.db")
+    database.migrate(MIGRATIONS)
+
+
+def bench_loaders(tamanho, parametros, arquivos, url_site, execucoes):
+    linhas = []
+
+    _, tempos = mede(lambda: sum(len(bloco) for bloco in carrega_pdf(arquivos["Pdf"])), execucoes)
+    linhas.append(resultado("loaders", "carrega_pdf", tamanho, tempos, pages=parametros["pdf_pages"],
+                            pages_per_second=round(parametros["pdf_pages"] / statistics.median(tempos), 1)))
+
+    caracteres, tempos = mede(lambda: sum(len(bloco) for bloco in carrega_txt(arquivos["Txt"])), execucoes)
+    megabytes = os.path.getsize(arquivos["Txt"]) / 1024 / 1024
+    linhas.append(resultado("loaders", "carrega_txt", tamanho, tempos, megabytes=round(megabytes, 1),
+                            mb_per_second=round(megabytes / statistics.median(tempos), 1)))
+
+    def importa_csv():
+        tabelas = TableStore(f"bench-{uuid.uuid4()}", index_dir=DIRETORIO)
+        try:
+            with open(arquivos["Csv"], "rb") as f:
+                tabelas.import_csv(f, "vendas.csv")
+        finally:
+            tabelas.remove()
+
+    _, tempos = mede(importa_csv, execucoes)
+    linhas.append(resultado("loaders", "import_csv", tamanho, tempos, rows=parametros["csv_rows"],
+                            rows_per_second=round(parametros["csv_rows"] / statistics.median(tempos))))
+
+    _, tempos = mede(lambda: carrega_site(f"{url_site}/index.html"), execucoes)
+    linhas.append(resultado("loaders", "carrega_site", tamanho, tempos))
+
+    _, tempos = mede(
+        lambda: sum(len(pagina) for pagina in carrega_site_rastreado(f"{url_site}/index.html", 100,
+                                                                      parametros["site_pages"])),
+        execucoes,
+    )
+    linhas.append(resultado("loaders", "carrega_site_rastreado", tamanho, tempos, pages=parametros["site_pages"],
+                            pages_per_second=round(parametros["site_pages"] / statistics.median(tempos), 1)))
+    # carrega_youtube needs the network, so it is not part of the suite
+    return linhas
+
+
+def ingere(user_id, tipo, caminho, opcoes=None, file_url=None):
+    """Run the ingestion job handler for one document; returns the chat id."""
+    armazenado = {"tipo": tipo, "titulo": os.path.basename(caminho), "file_path": None,
+                  "file_url": file_url, "blob": None, "opcoes": opcoes or {}}
+    if file_url is None:
+        with open(caminho, "rb") as f:
+            armazenado["blob"], armazenado["file_path"] = app.blobs.put(f)
+    resultado = app.ingere_documentos(
+        {"user_id": user_id, "chat_id": None, "documentos": [armazenado]}, lambda *args: None,
+        # Not run as a job: there is no job row to checkpoint into
+        lambda conn: None,
+    )
+    if resultado["erros"]:
+        raise RuntimeError(f"Ingestion of {caminho} failed: {resultado['erros']}")
+    return resultado["chat_id"]
+
+
+def bench_chat(tamanho, arquivos, url_site, turnos, reruns):
+    from streamlit.testing.v1 import AppTest
+
+    banco_novo(f"chat-{tamanho}")
+    _, user_id = app.create_user(f"bench-{tamanho}", "bench")
+    linhas = []
+
+    chats = {}
+    for tipo, caminho, url in [
+        ("Pdf", arquivos["Pdf"], None),
+        ("Txt", arquivos["Txt"], None),
+        ("Csv", arquivos["Csv"], None),
+        ("Site", f"{url_site}/index.html", f"{url_site}/index.html"),
+    ]:
+        inicio = time.perf_counter()
+        chats[tipo] = ingere(user_id, tipo, caminho, file_url=url)
+        linhas.append(resultado("chat", f"ingest_{tipo.lower()}", tamanho, [time.perf_counter() - inicio]))
+
+    at = AppTest.from_file(os.path.join(RAIZ, "app.py"), default_timeout=3600)
+    at.session_state["authenticated"] = True
+    at.session_state["user_id"] = user_id
+    at.session_state["username"] = f"bench-{tamanho}"
+    at.run()
+
+    def abre(chat_id):
+        botao = next(b for b in at.button if b.key == f"chat_{chat_id}")
+        inicio = time.perf_counter()
+        botao.click().run()
+        segundos = time.perf_counter() - inicio
+        if at.exception:
+            raise RuntimeError(at.exception)
+        return segundos
+
+    primeiro_token = metrics.histogram("docgpt_llm_first_token_seconds", "")
+    tokens_por_segundo = metrics.histogram("docgpt_llm_tokens_per_second", "", metrics.RATE_BUCKETS)
+    for tipo, chat_id in chats.items():
+        nome = tipo.lower()
+        linhas.append(resultado("chat", f"open_{nome}", tamanho, [abre(chat_id)]))
+
+        # Same chat with its index gone: carrega_modelo rebuilds it (parsed
+        # documents still come from the document cache)
+        app.DocumentIndex(chat_id).remove()
+        TableStore(chat_id).remove()
+        linhas.append(resultado("chat", f"open_{nome}_rebuild", tamanho, [abre(chat_id)]))
+
+        _, tempos = mede(at.run, reruns)
+        linhas.append(resultado("chat", f"rerun_{nome}", tamanho, tempos))
+
+        tempos = []
+        for n in range(turnos):
+            inicio = time.perf_counter()
+            at.chat_input[0].set_value(PERGUNTAS[n % len(PERGUNTAS)]).run()
+            tempos.append(time.perf_counter() - inicio)
+            if at.exception:
+                raise RuntimeError(at.exception)
+        linhas.append(resultado(
+            "chat", f"turn_{nome}", tamanho, tempos,
+            first_token_p50_seconds=round(statistics.median(primeiro_token.samples()[-turnos:]), 4),
+            tokens_per_second_p50=round(statistics.median(tokens_por_segundo.samples()[-turnos:]), 1),
+        ))
+    return linhas
+
+
+def bench_reruns(tamanho, arquivos, reruns):
+    from streamlit.testing.v1 import AppTest
+
+    banco_novo(f"rerun-{tamanho}")
+    _, user_id = app.create_user(f"rerun-{tamanho}", "bench")
+    chat_id = ingere(user_id, "Pdf", arquivos["Pdf"])
+
+    at = AppTest.from_file(os.path.join(RAIZ, "app.py"), default_timeout=3600)
+    linhas = []
+    # Reported times are the script's own (from its rerun histogram):
+    # AppTest's polling adds a noisy ~100 ms to each run
+    duracao_script = metrics.histogram("docgpt_rerun_seconds", "")
+
+    def mede_reruns(nome):
+        # The first run of each state pays for one-time work; only later ones count
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception)
+        _, tempos = mede(at.run, reruns)
+        linhas.append(resultado(
+            "rerun", nome, tamanho, duracao_script.samples()[-reruns:],
+            apptest_seconds=round(statistics.median(tempos), 6),
+        ))
+
+    mede_reruns("login_page")
+    at.session_state["authenticated"] = True
+    at.session_state["user_id"] = user_id
+    at.session_state["username"] = f"rerun-{tamanho}"
+    mede_reruns("signed_in")
+    next(b for b in at.button if b.key == f"chat_{chat_id}").click().run()
+    mede_reruns("chat_open")
+    return linhas
+
+
+def semeia_historico(chat_id, mensagens, seed=0):
+    """Long messages already in a chat, for the script to render every run."""
+    rng = random.Random(seed)
+    inicio = datetime.datetime.now() - datetime.timedelta(days=1)
+    with database.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO messages (message_id, chat_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+            [
+                (str(uuid.uuid4()), chat_id, "human" if i % 2 == 0 else "ai",
+                 "\n\n".join(texto(rng) for _ in range(10)), inicio + datetime.timedelta(seconds=i))
+                for i in range(mensagens)
+            ],
+        )
+
+
+def bench_turnos(tamanho, arquivos, turnos, latencia):
+    from streamlit.testing.v1 import AppTest
+
+    banco_novo(f"turn-{tamanho}")
+    _, user_id = app.create_user(f"turn-{tamanho}", "bench")
+    linhas = []
+    # Times are taken from the start of the script's run (AppTest's own
+    # overhead before it is left out): mark it where the run is timed
+    duracao_script = metrics.histogram("docgpt_rerun_seconds", "")
+    inicios = []
+    cronometro = duracao_script.time
+
+    def marca_inicio(**labels):
+        inicios.append(time.perf_counter())
+        return cronometro(**labels)
+
+    duracao_script.time = marca_inicio
+    try:
+        for nome, historico, orcamento in [
+            ("first_token", 0, None),
+            ("first_token_long_history", app.MESSAGE_WINDOW, None),
+            ("summarizing", 0, 200),
+        ]:
+            chat_id = ingere(user_id, "Pdf", arquivos["Pdf"])
+            semeia_historico(chat_id, historico)
+            at = AppTest.from_file(os.path.join(RAIZ, "app.py"), default_timeout=3600)
+            at.session_state["authenticated"] = True
+            at.session_state["user_id"] = user_id
+            at.session_state["username"] = f"turn-{tamanho}"
+            at.run()
+            next(b for b in at.button if b.key == f"chat_{chat_id}").click().run()
+            if orcamento:
+                # Every turn goes over the budget and is summarized
+                at.session_state["memoria"].max_tokens = orcamento
+
+            pedidos, primeiros, scripts = [], [], []
+            for n in range(turnos):
+                # A different question every turn: none is answered from the cache
+                at.chat_input[0].set_value(f"{PERGUNTAS[n % len(PERGUNTAS)]} ({nome} {n})").run()
+                if at.exception:
+                    raise RuntimeError(at.exception)
+                # The turn's answer is its first request (a summary comes after it)
+                inicio = inicios[-1]
+                pedido, primeiro = next(p for p in fake_llm.PEDIDOS if p[0] > inicio)
+                pedidos.append(pedido - inicio)
+                primeiros.append(primeiro - inicio)
+                scripts.append(duracao_script.samples()[-1])
+            tempos = scripts if orcamento else primeiros
+            linhas.append(resultado(
+                "turn", nome, tamanho, tempos,
+                request_p50_seconds=round(statistics.median(pedidos), 4),
+                first_token_p50_seconds=round(statistics.median(primeiros), 4),
+                script_p50_seconds=round(statistics.median(scripts), 4),
+                model_first_token_latency=latencia,
+            ))
+    finally:
+        duracao_script.time = cronometro
+    return linhas
+
+
+# Run in a fresh interpreter; prints the seconds measured
+IMPORTA_APP = """
+import sys, time
+sys.path.insert(0, {raiz!r})
+inicio = time.perf_counter()
+import app
+print(time.perf_counter() - inicio)
+"""
+
+PRIMEIRA_PAGINA = """
+import sys, time
+# `streamlit run` puts the script's directory on the path; AppTest doesn't
+sys.path.insert(0, {raiz!r})
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=600)
+inicio = time.perf_counter()
+at.run()
+print(time.perf_counter() - inicio)
+if at.exception:
+    raise SystemExit(str(at.exception))
+"""
+
+
+def bench_startup(tamanho, execucoes):
+    banco_novo(f"startup-{tamanho}")
+    ambiente = {**os.environ, "DOCGPT_DB_PATH": database.DB_PATH}
+
+    def roda(codigo):
+        saida = subprocess.run(
+            [sys.executable, "-c", codigo], env=ambiente, cwd=DIRETORIO,
+            capture_output=True, text=True, check=True,
+        ).stdout
+        return float(saida.strip().splitlines()[-1])
+
+    linhas = []
+    for nome, codigo in [
+        ("import_app", IMPORTA_APP.format(raiz=RAIZ)),
+        ("first_page", PRIMEIRA_PAGINA.format(raiz=RAIZ, app=os.path.join(RAIZ, "app.py"))),
+    ]:
+        linhas.append(resultado("startup", nome, tamanho, [roda(codigo) for _ in range(execucoes)]))
+    return linhas
+
+
+def semeia_mensagens(user_id, total, seed=0):
+    """Half the messages in one long chat, the rest in chats of 200; returns the long chat."""
+    rng = random.Random(seed)
+    inicio = datetime.datetime(2024, 1, 1)
+    longo = str(uuid.uuid4())
+    tamanhos = [(longo, total // 2)]
+    restante = total - total // 2
+    while restante > 0:
+        tamanhos.append((str(uuid.uuid4()), min(200, restante)))
+        restante -= 200
+
+    with database.transaction() as conn:
+        for n, (chat_id, mensagens) in enumerate(tamanhos):
+            criado = inicio + datetime.timedelta(minutes=n)
+            conn.execute(
+                "INSERT INTO chats (chat_id, user_id, title, created_at, updated_at, file_type) "
+                "VALUES (?, ?, ?, ?, ?, 'Pdf')",
+                (chat_id, user_id, f"Pdf: {rng.choice(PALAVRAS)}_{n}.pdf", criado, criado),
+            )
+            for lote in range(0, mensagens, 10_000):
+                conn.executemany(
+                    "INSERT INTO messages (message_id, chat_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (str(uuid.uuid4()), chat_id, "human" if i % 2 == 0 else "ai",
+                         texto(rng), criado + datetime.timedelta(seconds=i))
+                        for i in range(lote, min(lote + 10_000, mensagens))
+                    ],
+                )
+    return longo
+
+
+def bench_dados(tamanho, mensagens, repeticoes):
+    banco_novo(f"dados-{tamanho}")
+    _, user_id = app.create_user(f"dados-{tamanho}", "bench")
+    inicio = time.perf_counter()
+    longo = semeia_mensagens(user_id, mensagens)
+    linhas = [resultado("data", "seed_messages", tamanho, [time.perf_counter() - inicio], messages=mensagens)]
+
+    janela, _ = app.load_message_window(longo)
+    meio = app.get_messages(longo, limit=mensagens // 4)[0]
+    casos = {
+        "get_chat_list": lambda: app.get_chat_list(user_id),
+        "load_message_window": lambda: app.load_message_window(longo),
+        "load_message_window_older": lambda: app.load_message_window(longo, (meio[1], meio[0])),
+        "save_message": lambda: app.save_message(longo, "human", texto(random.Random(1))),
+        "get_chat": lambda: app.get_chat(longo),
+        "get_chat_summary": lambda: app.get_chat_summary(longo),
+        "is_chat_owner": lambda: app.is_chat_owner(longo, user_id),
+        "search_chats_frequent": lambda: app.search_chats(user_id, VOCABULARIO[40]),
+        "search_chats_rare": lambda: app.search_chats(user_id, VOCABULARIO[5000]),
+        "search_chats_prefix": lambda: app.search_chats(user_id, VOCABULARIO[100][:3]),
+    }
+    for nome, funcao in casos.items():
+        _, tempos = mede(funcao, repeticoes)
+        linhas.append(resultado("data", nome, tamanho, tempos, messages=mensagens))
+    return linhas
+
+
+def commit_atual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compara(antes, depois):
+    """Print the median time of every benchmark in two reports, and the change."""
+    with open(antes) as f:
+        anteriores = {(r["group"], r["name"], r["size"]): r for r in json.load(f)["results"]}
+    with open(depois) as f:
+        atuais = json.load(f)["results"]
+    print(f"{'benchmark':<48} {'before':>10} {'after':>10} {'change':>8}")
+    for linha in atuais:
+        chave = (linha["group"], linha["name"], linha["size"])
+        anterior = anteriores.get(chave)
+        nome = "/".join(chave)
+        if anterior is None:
+            print(f"{nome:<48} {'-':>10} {linha['seconds']:>10.4f} {'new':>8}")
+            continue
+        mudanca = (linha["seconds"] / anterior["seconds"] - 1) * 100 if anterior["seconds"] else 0.0
+        print(f"{nome:<48} {anterior['seconds']:>10.4f} {linha['seconds']:>10.4f} {mudanca:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small"])
+    parser.add_argument("--groups", nargs="+", choices=["loaders", "chat", "rerun", "turn", "startup", "data"],
+                        default=["loaders", "chat", "rerun", "turn", "startup", "data"])
+    parser.add_argument("--loader-runs", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=5, help="chat turns per document type, and per turn benchmark")
+    parser.add_argument("--reruns", type=int, default=20, help="idle reruns per measured state")
+    parser.add_argument("--startup-runs", type=int, default=5, help="fresh interpreters per startup benchmark")
+    parser.add_argument("--repeat", type=int, default=50, help="calls per data function")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="fake model, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="fake model")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        compara(*args.compare)
+        return
+
+    fake_llm.instala(args.first_token_latency, args.tokens_per_second)
+    os.chdir(DIRETORIO)
+    app.init_database()
+
+    resultados = []
+    try:
+        # The app's progress prints would mix with the report
+        with contextlib.redirect_stdout(sys.stderr):
+            for tamanho in args.sizes:
+                parametros = SIZES[tamanho]
+                entradas = os.path.join(DIRETORIO, f"entradas-{tamanho}")
+                os.makedirs(entradas)
+                arquivos = {
+                    "Pdf": gera_pdf(os.path.join(entradas, "contrato.pdf"), parametros["pdf_pages"]),
+                    "Txt": gera_txt(os.path.join(entradas, "log.txt"), parametros["txt_mb"] * 1024 * 1024),
+                    "Csv": gera_csv(os.path.join(entradas, "vendas.csv"), parametros["csv_rows"]),
+                }
+                site = os.path.join(entradas, "site")
+                os.makedirs(site)
+                servidor = serve(gera_site(site, parametros["site_pages"]), 0)
+                url_site = f"http://127.0.0.1:{servidor.server_address[1]}"
+                try:
+                    if "loaders" in args.groups:
+                        resultados += bench_loaders(tamanho, parametros, arquivos, url_site, args.loader_runs)
+                    if "chat" in args.groups:
+                        resultados += bench_chat(tamanho, arquivos, url_site, args.turns, args.reruns)
+                    if "rerun" in args.groups:
+                        resultados += bench_reruns(tamanho, arquivos, args.reruns)
+                    if "turn" in args.groups:
+                        resultados += bench_turnos(tamanho, arquivos, args.turns, args.first_token_latency)
+                    if "startup" in args.groups:
+                        resultados += bench_startup(tamanho, args.startup_runs)
+                    if "data" in args.groups:
+                        resultados += bench_dados(tamanho, parametros["messages"], args.repeat)
+                finally:
+                    servidor.shutdown()
+                print(f"Finished size {tamanho}", file=sys.stderr)
+    finally:
+        database.close_all()
+        os.chdir(RAIZ)
+        shutil.rmtree(DIRETORIO, ignore_errors=True)
+
+    relatorio = json.dumps({
+        "commit": commit_atual(),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "sizes": {tamanho: SIZES[tamanho] for tamanho in args.sizes},
+        "fake_model": {"first_token_latency": args.first_token_latency,
+                       "tokens_per_second": args.tokens_per_second},
+        "results": resultados,
+    }, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(relatorio + "\n")
+    else:
+        print(relatorio)
+
+
+if __name__ == "__main__":
+    main()
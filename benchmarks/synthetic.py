@@ -0,0 +1,126 @@
+"""Deterministic synthetic documents for the benchmarks."""
+import csv
+import datetime
+import itertools
+import os
+import random
+
+PALAVRAS = (
+    "contrato prazo entrega pagamento cliente fornecedor cláusula multa valor "
+    "documento relatório análise receita despesa projeto equipe reunião data "
+    "produto serviço garantia rescisão vigência obrigação parte anexo índice"
+).split()
+
+
+# Message text follows a Zipf distribution over a large vocabulary, so term
+# frequencies look like real prose instead of every word matching everything
+_rng = random.Random(1)
+VOCABULARIO = PALAVRAS + sorted(
+    {"".join(_rng.choices("abcdefghijklmnopqrstuvwxyz", k=_rng.randint(4, 10))) for _ in range(20000)},
+    key=lambda _: _rng.random(),
+)
+PESOS = list(itertools.accumulate(1 / (posicao + 1) for posicao in range(len(VOCABULARIO))))
+
+
+def texto(rng, palavras=30):
+    return " ".join(rng.choices(VOCABULARIO, cum_weights=PESOS, k=palavras))
+
+
+def frase(rng, palavras=12):
+    return " ".join(rng.choice(PALAVRAS) for _ in range(palavras)).capitalize() + "."
+
+
+def _escapa_pdf(texto):
+    texto = texto.encode("latin-1", "replace").decode("latin-1")
+    return texto.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def gera_pdf(caminho, paginas, linhas_por_pagina=45, seed=0):
+    """Write a text PDF with the given number of pages, without extra deps."""
+    rng = random.Random(seed)
+    objetos = {}
+    # 1: catalog, 2: page tree, 3: font, then (page, content) pairs
+    kids = []
+    for n in range(paginas):
+        page_id, content_id = 4 + 2 * n, 5 + 2 * n
+        kids.append(f"{page_id} 0 R")
+        linhas = [f"Pagina {n + 1}. {frase(rng)}"] + [frase(rng) for _ in range(linhas_por_pagina - 1)]
+        corpo = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(
+            f"({_escapa_pdf(linha)}) '" for linha in linhas
+        ) + " ET"
+        stream = corpo.encode("latin-1")
+        objetos[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objetos[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+    objetos[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objetos[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {paginas} >>".encode()
+    objetos[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"
+
+    with open(caminho, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for numero in sorted(objetos):
+            offsets[numero] = f.tell()
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (numero, objetos[numero]))
+        xref = f.tell()
+        total = max(objetos) + 1
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % total)
+        for numero in range(1, total):
+            f.write(b"%010d 00000 n \n" % offsets[numero])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (total, xref))
+    return caminho
+
+
+def gera_site(diretorio, paginas, links_por_pagina=5, seed=0):
+    """Write a static HTML site of linked pages (index.html is the root)."""
+    rng = random.Random(seed)
+    nomes = ["index.html"] + [f"pagina{n}.html" for n in range(1, paginas)]
+    for n, nome in enumerate(nomes):
+        # A chain to the next page keeps every page reachable; the rest are random
+        destinos = {nomes[(n + 1) % paginas]} | {rng.choice(nomes) for _ in range(links_por_pagina - 1)}
+        links = "".join(f'<a href="{destino}?utm_source=bench">{destino}</a> ' for destino in sorted(destinos))
+        texto = " ".join(frase(rng) for _ in range(30))
+        with open(os.path.join(diretorio, nome), "w", encoding="utf-8") as f:
+            f.write(f"<html><body><h1>Página {n}</h1><p>{texto}</p><nav>{links}</nav></body></html>")
+    return diretorio
+
+
+def gera_txt(caminho, tamanho_bytes, seed=0):
+    """Write a log-like text file of about `tamanho_bytes`, in bounded memory."""
+    rng = random.Random(seed)
+    # A block of random lines is reused with a running line number
+    linhas = [frase(rng) for _ in range(2000)]
+    escritos, numero = 0, 0
+    with open(caminho, "w", encoding="utf-8") as f:
+        while escritos < tamanho_bytes:
+            bloco = "".join(f"{numero + i:09d} {linha}\n" for i, linha in enumerate(linhas))
+            f.write(bloco)
+            escritos += len(bloco.encode("utf-8"))
+            numero += len(linhas)
+    return caminho
+
+
+CLIENTES = ["Acme", "Globex", "Initech", "Umbrella", "Stark", "Wayne", "Tyrell", "Cyberdyne"]
+CATEGORIAS = ["serviço", "produto", "licença", "suporte", "consultoria"]
+
+
+def gera_csv(caminho, linhas, seed=0):
+    """Write a sales-like CSV (semicolon-separated, decimal commas) with `linhas` rows."""
+    rng = random.Random(seed)
+    inicio = datetime.date(2024, 1, 1)
+    with open(caminho, "w", encoding="utf-8", newline="") as f:
+        escritor = csv.writer(f, delimiter=";")
+        escritor.writerow(["id", "data", "cliente", "categoria", "quantidade", "valor", "observacao"])
+        for n in range(linhas):
+            escritor.writerow([
+                n + 1,
+                (inicio + datetime.timedelta(days=rng.randrange(730))).isoformat(),
+                rng.choice(CLIENTES),
+                rng.choice(CATEGORIAS),
+                rng.randint(1, 50),
+                f"{rng.uniform(10, 5000):.2f}".replace(".", ","),
+                frase(rng, 6),
+            ])
+    return caminho
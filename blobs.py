@@ -0,0 +1,113 @@
+import hashlib
+import os
+import time
+import uuid
+import database
+from jobs import QUEUED, RUNNING
+
+BLOB_DIR = "uploads"
+
+# Blobs stored or uploaded again this recently are never collected, so one
+# whose ingestion job isn't submitted yet survives its last chat going away
+BLOB_GC_GRACE = int(os.getenv("DOCGPT_BLOB_GC_GRACE", str(24 * 3600)))
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def caminho_blob(digest):
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+
+def _digest(arquivo):
+    sha = hashlib.sha256()
+    for parte in iter(lambda: arquivo.read(CHUNK_SIZE), b""):
+        sha.update(parte)
+    arquivo.seek(0)
+    return sha.hexdigest()
+
+
+def _copia(arquivo, destino):
+    with open(destino, "wb") as f:
+        for parte in iter(lambda: arquivo.read(CHUNK_SIZE), b""):
+            f.write(parte)
+    arquivo.seek(0)
+
+
+def put(arquivo):
+    """Store a file object by the SHA-256 of its content; returns (digest, path).
+
+    Content that is already stored is not written again, whoever uploaded it.
+    """
+    digest = _digest(arquivo)
+    caminho = caminho_blob(digest)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+
+    # Write outside the transaction, so the write lock is only held for a rename
+    temporario = None
+    if not os.path.exists(caminho):
+        # Unique per call: sessions of one process may upload the same file at once
+        temporario = f"{caminho}.{os.getpid()}_{uuid.uuid4().hex[:12]}.tmp"
+        _copia(arquivo, temporario)
+
+    with database.transaction() as conn:
+        # Registering (or touching) the row first keeps collect() off the blob
+        conn.execute(
+            """
+        INSERT INTO blobs (digest, path, size, refcount, created_at)
+        VALUES (?, ?, ?, 0, ?)
+        ON CONFLICT (digest) DO UPDATE SET created_at = excluded.created_at, released_at = NULL
+        """,
+            (digest, caminho, arquivo.seek(0, os.SEEK_END), time.time()),
+        )
+        arquivo.seek(0)
+        caminho = conn.execute("SELECT path FROM blobs WHERE digest = ?", (digest,)).fetchone()[0]
+        if not os.path.exists(caminho):
+            if temporario is None:
+                # Collected between the check above and the transaction
+                _copia(arquivo, caminho)
+            else:
+                os.replace(temporario, caminho)
+                temporario = None
+
+    if temporario is not None:
+        os.remove(temporario)
+    return digest, caminho
+
+
+def collect():
+    """Delete the blobs nothing references anymore; returns bytes freed.
+
+    A blob goes once no chat document and no queued or running job refers
+    to it, and it was neither stored nor uploaded again in the last
+    BLOB_GC_GRACE seconds.
+    """
+    liberados = 0
+    with database.transaction() as conn:
+        candidatos = conn.execute(
+            """
+        SELECT digest, path, size FROM blobs
+        WHERE refcount <= 0 AND created_at < ?
+          AND NOT EXISTS (
+              SELECT 1 FROM jobs
+              WHERE status IN (?, ?) AND instr(payload, blobs.digest) > 0
+          )
+        """,
+            (time.time() - BLOB_GC_GRACE, QUEUED, RUNNING),
+        ).fetchall()
+        for digest, caminho, tamanho in candidatos:
+            conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            liberados += tamanho or 0
+    if candidatos:
+        print(f"Collected {len(candidatos)} blobs ({liberados} bytes)")
+    return liberados
+
+
+def usage():
+    """(number of blobs, total bytes, unreferenced blobs) of the store."""
+    return database.query_one(
+        "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount <= 0), 0) FROM blobs"
+    )
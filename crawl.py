@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import os
+import queue
+import re
+import time
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+from bs4 import BeautifulSoup
+import fetch
+
+CRAWL_MAX_DEPTH = int(os.getenv("DOCGPT_CRAWL_MAX_DEPTH", "2"))
+CRAWL_MAX_PAGES = int(os.getenv("DOCGPT_CRAWL_MAX_PAGES", "50"))
+
+# Simultaneous requests to the same host
+CRAWL_PER_HOST_CONCURRENCY = int(os.getenv("DOCGPT_CRAWL_PER_HOST_CONCURRENCY", "4"))
+
+# Pages whose simhashes differ in at most this many bits are near-duplicates
+NEAR_DUPLICATE_BITS = 3
+
+# Query parameters that only track the visitor and never change the page
+TRACKING_PREFIXES = ("utm_",)
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid"}
+
+# Links that are never pages
+SKIPPED_EXTENSIONS = (
+    ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico", ".css", ".js",
+    ".zip", ".gz", ".tar", ".mp3", ".mp4", ".avi", ".mov", ".woff", ".woff2",
+    ".ttf", ".exe", ".dmg", ".pdf", ".xml", ".json",
+)
+
+
+def canonicaliza(url, base=None):
+    """Canonical form of a URL, used to deduplicate links; None if not http(s)."""
+    if base:
+        url = urljoin(base, url)
+    partes = urlsplit(url.strip())
+    esquema = partes.scheme.lower()
+    if esquema not in ("http", "https") or not partes.hostname:
+        return None
+
+    host = partes.hostname.lower()
+    porta = partes.port
+    if porta and not (esquema == "http" and porta == 80 or esquema == "https" and porta == 443):
+        host = f"{host}:{porta}"
+
+    caminho = re.sub(r"/{2,}", "/", partes.path or "/")
+    if caminho != "/" and caminho.endswith("/"):
+        caminho = caminho.rstrip("/")
+    consulta = urlencode(sorted(
+        (chave, valor) for chave, valor in parse_qsl(partes.query, keep_blank_values=True)
+        if not chave.lower().startswith(TRACKING_PREFIXES) and chave.lower() not in TRACKING_PARAMS
+    ))
+    # Fragments never change the page, so they are dropped
+    return urlunsplit((esquema, host, caminho, consulta, ""))
+
+
+def _mesmo_site(host, url):
+    outro = urlsplit(url).netloc
+    return outro.removeprefix("www.") == host.removeprefix("www.")
+
+
+def simhash(texto):
+    """64-bit simhash over word trigrams, for near-duplicate detection."""
+    palavras = re.findall(r"\w+", texto.lower())
+    pesos = [0] * 64
+    for i in range(max(1, len(palavras) - 2)):
+        trigrama = " ".join(palavras[i:i + 3]).encode()
+        valor = int.from_bytes(hashlib.blake2b(trigrama, digest_size=8).digest(), "big")
+        for bit in range(64):
+            pesos[bit] += 1 if valor >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if pesos[bit] > 0)
+
+
+def extrai_pagina(conteudo):
+    """Visible text and outgoing links of an HTML page."""
+    soup = BeautifulSoup(conteudo, "html.parser")
+    links = [a["href"] for a in soup.find_all("a", href=True)]
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    return soup.get_text("\n", strip=True), links
+
+
+async def _carrega_robots(url, http):
+    partes = urlsplit(url)
+    robots = RobotFileParser()
+    try:
+        conteudo, _, _ = await fetch.fetch(
+            f"{partes.scheme}://{partes.netloc}/robots.txt", deadline=5, http=http
+        )
+        robots.parse(conteudo.decode("utf-8", errors="replace").splitlines())
+    except fetch.FetchError:
+        # No robots.txt (or unreachable): everything is allowed
+        robots.parse([])
+    return robots
+
+
+class _Intervalo:
+    """Spaces the requests of every worker to one host `segundos` apart."""
+
+    def __init__(self, segundos):
+        self.segundos = segundos
+        self.proxima = 0.0
+
+    async def espera(self):
+        if not self.segundos:
+            return
+        # The turn is reserved before sleeping, so workers queue up in order
+        agora = time.monotonic()
+        vez = max(agora, self.proxima)
+        self.proxima = vez + self.segundos
+        if vez > agora:
+            await asyncio.sleep(vez - agora)
+
+
+async def crawl(url_inicial, max_depth=None, max_pages=None, per_host=None, http=None):
+    """Crawl pages of the same site breadth-first, yielding (url, text) as they arrive.
+
+    Honors robots.txt (Crawl-delay is shared by all the workers), doesn't
+    follow redirects to other hosts, deduplicates canonical URLs and skips
+    pages whose text is an exact or near duplicate of a page already yielded.
+    """
+    max_depth = CRAWL_MAX_DEPTH if max_depth is None else max_depth
+    max_pages = max_pages or CRAWL_MAX_PAGES
+    per_host = per_host or CRAWL_PER_HOST_CONCURRENCY
+    http = http or fetch.client()
+
+    inicial = canonicaliza(url_inicial)
+    host = urlsplit(inicial).netloc
+    robots = await _carrega_robots(inicial, http)
+    agente = fetch.user_agent()
+    intervalo = _Intervalo(robots.crawl_delay(agente) or 0)
+
+    fila = asyncio.Queue()
+    saida = asyncio.Queue()
+    vistos = {inicial}
+    digests, simhashes = set(), []
+    aceitas = 0
+    fila.put_nowait((inicial, 0))
+
+    async def trabalhador():
+        nonlocal aceitas
+        while True:
+            url, profundidade = await fila.get()
+            try:
+                if aceitas >= max_pages or not robots.can_fetch(agente, url):
+                    continue
+                try:
+                    conteudo, tipo, final = await fetch.fetch(
+                        url, http=http, throttle=intervalo.espera,
+                        allow_redirect=lambda destino: _mesmo_site(host, destino) and robots.can_fetch(agente, destino),
+                    )
+                except fetch.FetchError as e:
+                    print(f"Skipping {url}: {e}")
+                    continue
+                if tipo and "html" not in tipo:
+                    continue
+                # A redirect target counts as seen too
+                vistos.add(canonicaliza(final))
+                texto, links = extrai_pagina(conteudo)
+
+                normalizado = " ".join(texto.lower().split())
+                digest = hashlib.sha256(normalizado.encode()).digest()
+                assinatura = simhash(normalizado)
+                duplicada = digest in digests or any(
+                    bin(assinatura ^ outra).count("1") <= NEAR_DUPLICATE_BITS for outra in simhashes
+                )
+                if duplicada or not texto or aceitas >= max_pages:
+                    continue
+                digests.add(digest)
+                simhashes.append(assinatura)
+                aceitas += 1
+                await saida.put((final, texto))
+
+                if profundidade < max_depth:
+                    for link in links:
+                        canonica = canonicaliza(link, final)
+                        if (canonica and canonica not in vistos and _mesmo_site(host, canonica)
+                                and not urlsplit(canonica).path.lower().endswith(SKIPPED_EXTENSIONS)):
+                            vistos.add(canonica)
+                            fila.put_nowait((canonica, profundidade + 1))
+            finally:
+                fila.task_done()
+
+    trabalhadores = [asyncio.create_task(trabalhador()) for _ in range(per_host)]
+    concluido = asyncio.create_task(fila.join())
+    proxima = None
+    try:
+        while True:
+            proxima = asyncio.create_task(saida.get())
+            await asyncio.wait({proxima, concluido}, return_when=asyncio.FIRST_COMPLETED)
+            if proxima.done():
+                yield proxima.result()
+                continue
+            proxima.cancel()
+            while not saida.empty():
+                yield saida.get_nowait()
+            break
+    finally:
+        concluido.cancel()
+        if proxima:
+            proxima.cancel()
+        for tarefa in trabalhadores:
+            tarefa.cancel()
+
+
+def crawl_sync(url_inicial, **kwargs):
+    """Run crawl() on the shared fetch loop, yielding pages in the caller's thread.
+
+    Closing the generator early cancels the crawl.
+    """
+    paginas = queue.Queue()
+    FIM = object()
+    inicio = time.perf_counter()
+
+    async def produz():
+        try:
+            async for pagina in crawl(url_inicial, **kwargs):
+                paginas.put(pagina)
+        except Exception as e:
+            paginas.put(e)
+        finally:
+            paginas.put(FIM)
+
+    produtor = fetch.run_background(produz())
+    total = 0
+    try:
+        while True:
+            item = paginas.get()
+            if item is FIM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            total += 1
+            yield item
+    finally:
+        produtor.cancel()
+
+    segundos = time.perf_counter() - inicio
+    print(f"Crawled {total} pages from {url_inicial} in {segundos:.2f}s ({total / segundos:.1f} pages/s)")
@@ -0,0 +1,206 @@
+import contextlib
+import os
+import queue
+import random
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import metrics
+
+DB_PATH = os.getenv("DOCGPT_DB_PATH", "docgpt.db")
+
+# How long SQLite itself waits on a lock before reporting SQLITE_BUSY
+BUSY_TIMEOUT_MS = int(os.getenv("DOCGPT_DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Extra attempts on SQLITE_BUSY after the busy timeout has already expired
+MAX_RETRIES = 5
+
+# Idle connections kept open per process
+POOL_SIZE = int(os.getenv("DOCGPT_DB_POOL_SIZE", "8"))
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+QUERY_SECONDS = metrics.histogram(
+    "docgpt_db_query_seconds", "SQLite statement and transaction latency, by calling function"
+)
+
+# Frames skipped when naming the function a query comes from
+_INTERNAL_FILES = {__file__, contextlib.__file__}
+
+_pool = queue.LifoQueue()
+_pool_pid = os.getpid()
+_pool_lock = threading.Lock()
+
+
+def _connect():
+    # Autocommit mode: writes go through transaction(), which uses BEGIN
+    # IMMEDIATE so concurrent writers queue on the busy timeout instead of
+    # failing when a read transaction tries to upgrade to a write.
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=256,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _is_busy(error):
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def _retry(operation):
+    """Run an operation, retrying with jittered backoff while the DB is busy."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if attempt == MAX_RETRIES or not _is_busy(e):
+                raise
+            time.sleep(random.uniform(0, 0.05 * 2**attempt))
+
+
+def _caller():
+    """module.function of the code that called into this module."""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename in _INTERNAL_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    modulo = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{modulo}.{frame.f_code.co_name}"
+
+
+def _acquire():
+    global _pool, _pool_pid
+    # Connections must not cross a fork, so each process gets its own pool
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = queue.LifoQueue()
+                _pool_pid = os.getpid()
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
+
+
+def _release(conn):
+    if conn.in_transaction:
+        conn.rollback()
+    if _pool_pid == os.getpid() and _pool.qsize() < POOL_SIZE:
+        _pool.put(conn)
+    else:
+        conn.close()
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection for the duration of the block."""
+    conn = _acquire()
+    try:
+        yield conn
+    finally:
+        _release(conn)
+
+
+@contextmanager
+def _write(conn):
+    _retry(lambda: conn.execute("BEGIN IMMEDIATE"))
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    _retry(lambda: conn.execute("COMMIT"))
+
+
+@contextmanager
+def transaction():
+    """Run the block inside a write transaction on a pooled connection."""
+    with QUERY_SECONDS.time(op="transaction", query=_caller()):
+        with connection() as conn, _write(conn):
+            yield conn
+
+
+def query(sql, params=()):
+    """Run a read query and return all rows."""
+    with QUERY_SECONDS.time(op="query", query=_caller()), connection() as conn:
+        return _retry(lambda: conn.execute(sql, params).fetchall())
+
+
+def query_one(sql, params=()):
+    """Run a read query and return the first row, or None."""
+    with QUERY_SECONDS.time(op="query", query=_caller()), connection() as conn:
+        return _retry(lambda: conn.execute(sql, params).fetchone())
+
+
+def execute(sql, params=()):
+    """Run a single write statement in its own transaction."""
+    with QUERY_SECONDS.time(op="execute", query=_caller()):
+        with connection() as conn, _write(conn):
+            return conn.execute(sql, params).rowcount
+
+
+def migrate(migrations):
+    """Apply the migrations newer than the database's PRAGMA user_version."""
+    with connection() as conn:
+        # Table rebuilds need foreign keys off, and the pragma is ignored
+        # inside a transaction
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            _retry(lambda: conn.execute("BEGIN IMMEDIATE"))
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                for number, migration in enumerate(migrations, start=1):
+                    if number > version:
+                        migration(conn)
+                        conn.execute(f"PRAGMA user_version = {number}")
+                if len(migrations) > version:
+                    # Foreign keys were not enforced while the migrations
+                    # ran: refuse to commit rows that now point nowhere
+                    violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+                    if violations:
+                        table, rowid, parent, _ = violations[0]
+                        raise sqlite3.IntegrityError(
+                            f"Migration left {len(violations)} foreign key violation(s), "
+                            f"first in {table} rowid {rowid} (references {parent})"
+                        )
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            _retry(lambda: conn.execute("COMMIT"))
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+
+
+def explain(sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query."""
+    rows = query(f"EXPLAIN QUERY PLAN {sql}", params)
+    return [row[-1] for row in rows]
+
+
+def close_all():
+    """Close every idle pooled connection."""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
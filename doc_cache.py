@@ -0,0 +1,181 @@
+import hashlib
+import os
+import struct
+import time
+import zlib
+
+CACHE_DIR = "cache"
+
+# Total size of the compressed cache before least recently used entries go
+CACHE_MAX_BYTES = int(os.getenv("DOCGPT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Seconds a document fetched from a URL is served from the cache; files are
+# keyed by their content and never go stale
+URL_MAX_AGE = int(os.getenv("DOCGPT_CACHE_URL_MAX_AGE", str(24 * 3600)))
+
+
+def chave_documento(tipo_arquivo, conteudo):
+    """Cache key for a document: its type plus the SHA-256 of its content."""
+    return f"{tipo_arquivo.lower()}-{hashlib.sha256(conteudo).hexdigest()}"
+
+
+def chave_arquivo(tipo_arquivo, caminho):
+    """Same key as chave_documento(), streamed from a file on disk."""
+    sha = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for parte in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(parte)
+    return f"{tipo_arquivo.lower()}-{sha.hexdigest()}"
+
+
+def _caminho(chave, extensao=".z"):
+    digest = chave.rsplit("-", 1)[-1]
+    return os.path.join(CACHE_DIR, digest[:2], f"{chave}{extensao}")
+
+
+# An entry's mtime is when its content was fetched (its age) and its atime
+# when it was last used (for eviction); both are set explicitly, so neither
+# depends on how the filesystem is mounted
+def _usa(caminho, max_age):
+    # Marks an entry as used; a stale one is removed instead
+    try:
+        escrito = os.stat(caminho).st_mtime
+    except FileNotFoundError:
+        return False
+    if max_age is not None and time.time() - escrito > max_age:
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+        return False
+    os.utime(caminho, (time.time(), escrito))
+    return True
+
+
+def _gravado(temporario, caminho, escrito):
+    os.utime(temporario, (time.time(), escrito or time.time()))
+    os.replace(temporario, caminho)
+
+
+def get(chave, max_age=None):
+    """Return the cached text for a key, or None on a miss (or if older than max_age seconds)."""
+    caminho = _caminho(chave)
+    if not _usa(caminho, max_age):
+        return None
+    try:
+        with open(caminho, "rb") as f:
+            dados = f.read()
+    except FileNotFoundError:
+        return None
+    return zlib.decompress(dados).decode("utf-8")
+
+
+def put(chave, texto, escrito=None):
+    """Store the extracted text of a document and evict old entries if needed.
+
+    `escrito` is the time its content was fetched (now by default).
+    """
+    caminho = _caminho(chave)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(zlib.compress(texto.encode("utf-8"), 6))
+    _gravado(temporario, caminho, escrito)
+
+    evict(CACHE_MAX_BYTES)
+
+
+# Entries of documents cached block by block: each block is a 4-byte
+# big-endian length followed by that many bytes of zlib-compressed text
+_BLOCOS = ".zb"
+_TAMANHO = struct.Struct(">I")
+
+
+def itera(chave, max_age=None):
+    """Return an iterator over the cached text blocks for a key, or None on a miss.
+
+    Entries older than `max_age` seconds are misses.
+    """
+    caminho = _caminho(chave, _BLOCOS)
+    if not _usa(caminho, max_age):
+        return None
+    try:
+        f = open(caminho, "rb")
+    except FileNotFoundError:
+        return None
+
+    def blocos():
+        with f:
+            while cabecalho := f.read(_TAMANHO.size):
+                (tamanho,) = _TAMANHO.unpack(cabecalho)
+                yield zlib.decompress(f.read(tamanho)).decode("utf-8")
+
+    return blocos()
+
+
+def grava_blocos(chave, blocos, escrito=None):
+    """Yield the text blocks of a document, caching each one as it passes.
+
+    The entry only becomes visible once every block went through; a
+    consumer that stops early (or fails) leaves nothing behind. `escrito`
+    is as in put().
+    """
+    caminho = _caminho(chave, _BLOCOS)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f"{caminho}.{os.getpid()}.{id(blocos)}.tmp"
+    completo = False
+    try:
+        with open(temporario, "wb") as f:
+            for bloco in blocos:
+                dados = zlib.compress(bloco.encode("utf-8"), 6)
+                f.write(_TAMANHO.pack(len(dados)))
+                f.write(dados)
+                yield bloco
+        completo = True
+    finally:
+        if completo:
+            _gravado(temporario, caminho, escrito)
+        else:
+            try:
+                os.remove(temporario)
+            except FileNotFoundError:
+                pass
+    evict(CACHE_MAX_BYTES)
+
+
+def escrito_em(chave):
+    """When the cached entry of a key was written (its fetch time), or None."""
+    for extensao in (".z", _BLOCOS):
+        try:
+            return os.stat(_caminho(chave, extensao)).st_mtime
+        except FileNotFoundError:
+            pass
+    return None
+
+
+def evict(max_bytes):
+    """Delete least recently used entries until the cache fits in max_bytes."""
+    entradas = []
+    total = 0
+    for raiz, _, arquivos in os.walk(CACHE_DIR):
+        for nome in arquivos:
+            if not nome.endswith((".z", _BLOCOS)):
+                continue
+            caminho = os.path.join(raiz, nome)
+            try:
+                info = os.stat(caminho)
+            except FileNotFoundError:
+                continue
+            entradas.append((info.st_atime, info.st_size, caminho))
+            total += info.st_size
+
+    entradas.sort()
+    for _, tamanho, caminho in entradas:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+        total -= tamanho
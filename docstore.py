@@ -0,0 +1,134 @@
+"""Process-wide store of indexed documents, shared by every session.
+
+Entries are keyed by the content hash of the document, so every session
+searching the same document, in any chat, shares one entry. An entry
+holds what searching the document keeps in memory (see
+retrieval._Documento) and reports the bytes it owns as `nbytes`: the
+store caps the sum of those, not mapped or virtual memory.
+
+A session keeps a Referencia per document it uses: entries count the
+references held on them, and a reference is released when the session
+drops it (or is garbage collected with an abandoned session). When the
+entries go over DOCSTORE_MAX_BYTES, least recently used ones are
+dropped, unreferenced ones first; a dropped entry is loaded again the
+next time it is used.
+"""
+import os
+import threading
+import weakref
+from collections import Counter, OrderedDict
+import metrics
+
+# Bytes the store's entries may own before least recently used ones go
+DOCSTORE_MAX_BYTES = int(os.getenv("DOCGPT_DOCSTORE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# content key -> (value, bytes it owns), least recently used first
+_entradas = OrderedDict()
+# content key -> references held by sessions (loaded or not)
+_referencias = Counter()
+_bytes = 0
+_lock = threading.Lock()
+
+STORE_BYTES = metrics.gauge("docgpt_docstore_bytes", "Bytes owned by the shared document store")
+STORE_ENTRIES = metrics.gauge("docgpt_docstore_entries", "Documents loaded in the shared store")
+STORE_REFERENCES = metrics.gauge("docgpt_docstore_references", "Session references to shared documents")
+LOOKUPS = metrics.counter("docgpt_docstore_lookups", "Shared document store lookups, by result")
+
+
+def _atualiza_gauges():
+    STORE_BYTES.set(_bytes)
+    STORE_ENTRIES.set(len(_entradas))
+    STORE_REFERENCES.set(sum(_referencias.values()))
+
+
+def _remove(chave):
+    global _bytes
+    _, tamanho = _entradas.pop(chave)
+    _bytes -= tamanho
+
+
+def _evict():
+    # Unreferenced entries go first; then, still over the cap, the
+    # referenced ones (they are loaded again on their next use)
+    for referenciadas in (False, True):
+        for chave in list(_entradas):
+            if _bytes <= DOCSTORE_MAX_BYTES:
+                return
+            if bool(_referencias[chave]) == referenciadas:
+                _remove(chave)
+
+
+def _obtem(chave, carregar):
+    """Value of a key, loading it with `carregar(key)` on a miss."""
+    global _bytes
+    with _lock:
+        if chave in _entradas:
+            _entradas.move_to_end(chave)
+            LOOKUPS.inc(result="hit")
+            return _entradas[chave][0]
+
+    # Load outside the lock: other sessions keep their lookups
+    valor = carregar(chave)
+    with _lock:
+        LOOKUPS.inc(result="miss")
+        if chave in _entradas:
+            # Loaded by another session meanwhile
+            valor = _entradas[chave][0]
+        else:
+            _entradas[chave] = (valor, valor.nbytes)
+            _bytes += valor.nbytes
+            _evict()
+        _atualiza_gauges()
+        return valor
+
+
+def discard(chave):
+    """Drop an entry whose data is gone (e.g. its document was deleted)."""
+    with _lock:
+        if chave in _entradas:
+            _remove(chave)
+        _atualiza_gauges()
+
+
+def _solta(estado):
+    with _lock:
+        chave = estado[0]
+        estado[0] = None
+        if chave is not None:
+            _referencias[chave] -= 1
+            if _referencias[chave] <= 0:
+                del _referencias[chave]
+        _atualiza_gauges()
+
+
+class Referencia:
+    """A session's hold on one shared document.
+
+    get() returns the shared value, loading it again with `carregar(key)`
+    if it was evicted.
+    """
+
+    def __init__(self, chave, carregar):
+        self.chave = chave
+        self.carregar = carregar
+        # [key held], shared with the finalizer
+        self._estado = [None]
+        self._finalizador = weakref.finalize(self, _solta, self._estado)
+
+    def get(self):
+        valor = _obtem(self.chave, self.carregar)
+        if self._estado[0] is None:
+            with _lock:
+                self._estado[0] = self.chave
+                _referencias[self.chave] += 1
+                _atualiza_gauges()
+        return valor
+
+    def release(self):
+        _solta(self._estado)
+
+
+def stats():
+    """(bytes owned, entries loaded, session references)."""
+    with _lock:
+        return _bytes, len(_entradas), sum(_referencias.values())
@@ -0,0 +1,181 @@
+import asyncio
+import functools
+import os
+import random
+import threading
+import time
+from urllib.parse import urljoin
+import httpx
+
+# Total time budget for one URL, across all retries
+FETCH_DEADLINE = float(os.getenv("DOCGPT_FETCH_DEADLINE", "20"))
+
+# Timeout of a single attempt (capped by what is left of the deadline)
+FETCH_ATTEMPT_TIMEOUT = float(os.getenv("DOCGPT_FETCH_ATTEMPT_TIMEOUT", "10"))
+
+# Responses larger than this are rejected instead of being read into memory
+FETCH_MAX_BYTES = int(os.getenv("DOCGPT_FETCH_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# Shared connection pool of the HTTP client
+FETCH_MAX_CONNECTIONS = int(os.getenv("DOCGPT_FETCH_MAX_CONNECTIONS", "32"))
+
+# Backoff: full jitter over an exponentially growing window
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+# Statuses worth retrying; any other 4xx/5xx fails immediately
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# Redirects followed for one URL when fetch() follows them itself
+MAX_REDIRECTS = 10
+
+
+class FetchError(Exception):
+    """A URL could not be fetched; `status` is the last HTTP status, if any."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+_loop = None
+_client = None
+_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def user_agent():
+    """One browser User-Agent per process instead of one per attempt."""
+    try:
+        from fake_useragent import UserAgent
+
+        return UserAgent().random
+    except Exception:
+        return "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+
+def _start_loop():
+    global _loop, _client
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="docgpt-fetch", daemon=True).start()
+            # The client is bound to the loop that created it, so it lives in
+            # this long-running loop and is shared by every fetch
+            _client = asyncio.run_coroutine_threadsafe(_create_client(), loop).result()
+            _loop = loop
+    return _loop
+
+
+async def _create_client():
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        headers={"User-Agent": user_agent()},
+        limits=httpx.Limits(
+            max_connections=FETCH_MAX_CONNECTIONS,
+            max_keepalive_connections=FETCH_MAX_CONNECTIONS,
+            keepalive_expiry=30,
+        ),
+    )
+
+
+def client():
+    """The process-wide keep-alive HTTP client (use only on the fetch loop)."""
+    _start_loop()
+    return _client
+
+
+def run(coro):
+    """Run a coroutine on the shared fetch loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _start_loop()).result()
+
+
+def run_background(coro):
+    """Schedule a coroutine on the shared fetch loop without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(coro, _start_loop())
+
+
+def _retry_after(response):
+    valor = response.headers.get("Retry-After", "")
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        return None
+
+
+async def fetch(url, deadline=None, max_bytes=None, attempt_timeout=None,
+                backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, http=None, allow_redirect=None,
+                throttle=None):
+    """Fetch a URL with jittered exponential backoff and a total deadline.
+
+    Returns (body bytes, content type, final URL). Raises FetchError on a
+    non-retryable status, an oversized body, or when the deadline runs out.
+    With `allow_redirect`, redirects are followed here one hop at a time,
+    and a target it returns False for fails before it is requested.
+    `throttle` is awaited before every request, retries and redirect hops
+    included; the wait for the first one doesn't count against the deadline.
+    """
+    deadline = FETCH_DEADLINE if deadline is None else deadline
+    max_bytes = FETCH_MAX_BYTES if max_bytes is None else max_bytes
+    attempt_timeout = FETCH_ATTEMPT_TIMEOUT if attempt_timeout is None else attempt_timeout
+    http = http or client()
+
+    if throttle:
+        await throttle()
+    fim = time.monotonic() + deadline
+    tentativa = redirecionamentos = 0
+    ultimo_erro, status = "timeout", None
+    while True:
+        if throttle and (tentativa or redirecionamentos):
+            await throttle()
+        restante = fim - time.monotonic()
+        if restante <= 0:
+            raise FetchError(f"Deadline exceeded fetching {url} ({ultimo_erro})", status)
+
+        espera = None
+        try:
+            async with http.stream("GET", url, timeout=min(attempt_timeout, restante),
+                                   follow_redirects=allow_redirect is None) as response:
+                status = response.status_code
+                if allow_redirect is not None and response.has_redirect_location:
+                    destino = urljoin(str(response.url), response.headers["Location"])
+                    if not allow_redirect(destino):
+                        raise FetchError(f"Redirect to {destino} not allowed: {url}", status)
+                    redirecionamentos += 1
+                    if redirecionamentos > MAX_REDIRECTS:
+                        raise FetchError(f"Too many redirects: {url}", status)
+                    url = destino
+                    continue
+                if status in RETRYABLE_STATUS:
+                    ultimo_erro = f"HTTP {status}"
+                    espera = _retry_after(response)
+                elif status >= 400:
+                    raise FetchError(f"HTTP {status} fetching {url}", status)
+                else:
+                    tamanho = int(response.headers.get("Content-Length") or 0)
+                    if tamanho > max_bytes:
+                        raise FetchError(f"Response too large ({tamanho} bytes): {url}", status)
+                    partes, lidos = [], 0
+                    async for parte in response.aiter_bytes():
+                        lidos += len(parte)
+                        if lidos > max_bytes:
+                            raise FetchError(f"Response larger than {max_bytes} bytes: {url}", status)
+                        partes.append(parte)
+                    tipo = response.headers.get("Content-Type", "")
+                    return b"".join(partes), tipo, str(response.url)
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            ultimo_erro = f"{type(e).__name__}: {e}"
+
+        if espera is None:
+            espera = random.uniform(0, min(backoff_max, backoff_base * 2**tentativa))
+        tentativa += 1
+        restante = fim - time.monotonic()
+        if espera >= restante:
+            raise FetchError(f"Deadline exceeded fetching {url} ({ultimo_erro})", status)
+        print(f"Retrying {url} in {espera:.2f}s (attempt {tentativa}: {ultimo_erro})")
+        await asyncio.sleep(espera)
+
+
+def fetch_sync(url, **kwargs):
+    """Blocking wrapper around fetch() for the Streamlit script thread."""
+    return run(fetch(url, **kwargs))
@@ -0,0 +1,272 @@
+"""Process-wide background job queue with state persisted in SQLite.
+
+Jobs run on a small thread pool shared by every session, so a long
+document load never holds a user's script thread, and survives reruns and
+page refreshes. The UI polls the jobs table for progress.
+
+Each job is owned by one start of a server process (pid plus a random
+suffix, as pids are reused after a restart), which renews a heartbeat on
+its jobs every JOB_LEASE_SECONDS / 3. Unfinished jobs whose heartbeat
+lapsed are requeued by another process. A handler checkpoints its
+progress into the job's payload, in the same transaction as its own
+writes, so a requeued job resumes instead of redoing them.
+"""
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import database
+
+# Jobs running at once; kept small so ingestion bursts can't starve the chat path
+JOB_WORKERS = int(os.getenv("DOCGPT_JOB_WORKERS", "2"))
+
+# Jobs queued or running in this process; submissions beyond it are refused
+JOB_QUEUE_DEPTH = int(os.getenv("DOCGPT_JOB_QUEUE_DEPTH", "16"))
+
+# Minimum seconds between two progress writes of the same job
+PROGRESS_INTERVAL = 0.5
+
+# Seconds after its last heartbeat an unfinished job counts as orphaned
+JOB_LEASE_SECONDS = float(os.getenv("DOCGPT_JOB_LEASE_SECONDS", "30"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueueFull(Exception):
+    """Too many jobs are already queued or running."""
+
+
+class JobLeaseLost(Exception):
+    """The job was requeued by another process (its heartbeat lapsed)."""
+
+
+_handlers = {}
+_pool = None
+_pool_pid = None
+# This process start's id, the owner of the jobs it runs
+_owner = None
+_pending = 0
+_recovered = False
+_lock = threading.Lock()
+# One recovery scan at a time in this process
+_recovering = threading.Lock()
+
+
+def register(kind, handler):
+    """Register the function that runs jobs of a kind.
+
+    `handler(payload, progresso, checkpoint)` gets the job's JSON payload, a
+    `progresso(fracao, mensagem=None)` callback and `checkpoint(conn)`, which
+    saves the payload as it is now in the caller's transaction (raising
+    JobLeaseLost if the job has been requeued elsewhere). A requeued job
+    gets the last payload checkpointed. The handler returns a
+    JSON-serializable result; a result with a "chat_id" key links the job to
+    that chat.
+    """
+    _handlers[kind] = handler
+
+
+def _get_pool():
+    global _pool, _pool_pid, _owner, _pending
+    # A forked process doesn't inherit the pool's threads, nor its jobs
+    if _pool_pid != os.getpid():
+        _pool = ThreadPoolExecutor(JOB_WORKERS, thread_name_prefix="docgpt-job")
+        _pool_pid = os.getpid()
+        _owner = f"{_pool_pid}_{uuid.uuid4().hex[:12]}"
+        _pending = 0
+        threading.Thread(target=_heartbeat, name="docgpt-job-heartbeat", daemon=True).start()
+    return _pool
+
+
+def _heartbeat():
+    # Renews the lease on this process's jobs, and requeues the jobs of
+    # processes whose lease lapsed since (e.g. one that crashed later on)
+    while True:
+        try:
+            database.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN (?, ?)",
+                (time.time(), _owner, QUEUED, RUNNING),
+            )
+            if _recovered:
+                _recupera()
+        except Exception as e:
+            print(f"Job heartbeat failed: {e!r}")
+        time.sleep(JOB_LEASE_SECONDS / 3)
+
+
+def _reserve():
+    global _pending
+    with _lock:
+        pool = _get_pool()
+        if _pending >= JOB_QUEUE_DEPTH:
+            raise JobQueueFull(f"{_pending} jobs already queued or running")
+        _pending += 1
+    return pool
+
+
+def _release():
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+def submit(kind, user_id, title, payload, chat_id=None):
+    """Queue a job and return its id. Raises JobQueueFull."""
+    pool = _reserve()
+    job_id = str(uuid.uuid4())
+    now = datetime.datetime.now()
+    try:
+        database.execute(
+            """
+        INSERT INTO jobs (job_id, user_id, chat_id, kind, title, status, progress, payload, pid,
+                          owner, heartbeat_at, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?)
+        """,
+            (job_id, user_id, chat_id, kind, title, QUEUED, json.dumps(payload), os.getpid(),
+             _owner, time.time(), now, now),
+        )
+        pool.submit(_run, job_id, kind, payload)
+    except BaseException:
+        _release()
+        raise
+    return job_id
+
+
+def _update(job_id, dono=None, **campos):
+    # With `dono`, only while that process start still owns the job
+    campos["updated_at"] = datetime.datetime.now()
+    atribuicoes = ", ".join(f"{campo} = ?" for campo in campos)
+    if dono is None:
+        return database.execute(
+            f"UPDATE jobs SET {atribuicoes} WHERE job_id = ?", (*campos.values(), job_id)
+        )
+    return database.execute(
+        f"UPDATE jobs SET {atribuicoes} WHERE job_id = ? AND owner = ?", (*campos.values(), job_id, dono)
+    )
+
+
+def _run(job_id, kind, payload):
+    ultimo = 0.0
+    dono = _owner
+
+    def progresso(fracao, mensagem=None):
+        nonlocal ultimo
+        agora = time.monotonic()
+        if agora - ultimo < PROGRESS_INTERVAL:
+            return
+        ultimo = agora
+        campos = {"progress": min(max(fracao, 0.0), 1.0)}
+        if mensagem is not None:
+            campos["message"] = mensagem
+        _update(job_id, dono, **campos)
+
+    def checkpoint(conn):
+        alterados = conn.execute(
+            "UPDATE jobs SET payload = ?, updated_at = ? WHERE job_id = ? AND owner = ?",
+            (json.dumps(payload), datetime.datetime.now(), job_id, dono),
+        ).rowcount
+        if not alterados:
+            raise JobLeaseLost(f"Job {job_id} was requeued by another process")
+
+    try:
+        if not _update(job_id, dono, status=RUNNING):
+            raise JobLeaseLost(f"Job {job_id} was requeued by another process")
+        resultado = _handlers[kind](payload, progresso, checkpoint)
+        chat_id = resultado.get("chat_id") if isinstance(resultado, dict) else None
+        _update(job_id, dono, status=DONE, progress=1.0, result=json.dumps(resultado), chat_id=chat_id)
+    except JobLeaseLost as e:
+        # Its new owner runs it from the last checkpoint
+        print(f"Job {job_id} ({kind}) abandoned: {e}")
+    except Exception as e:
+        print(f"Job {job_id} ({kind}) failed: {e!r}")
+        _update(job_id, dono, status=FAILED, error=str(e) or type(e).__name__)
+    finally:
+        _release()
+
+
+def get(job_id):
+    """(job_id, title, status, progress, message, error, result, chat_id) of a job."""
+    return database.query_one(
+        """
+    SELECT job_id, title, status, progress, message, error, result, chat_id
+    FROM jobs WHERE job_id = ?
+    """,
+        (job_id,),
+    )
+
+
+def list_for_user(user_id):
+    """A user's unfinished jobs plus finished ones not yet acknowledged, oldest first.
+
+    Rows are (job_id, title, status, progress, message, error, result, chat_id).
+    """
+    return database.query(
+        """
+    SELECT job_id, title, status, progress, message, error, result, chat_id
+    FROM jobs
+    WHERE user_id = ? AND seen = 0
+    ORDER BY created_at
+    """,
+        (user_id,),
+    )
+
+
+def acknowledge(job_id):
+    """Hide a finished job from list_for_user()."""
+    database.execute("UPDATE jobs SET seen = 1 WHERE job_id = ?", (job_id,))
+
+
+def recover():
+    """Requeue the unfinished jobs whose owner's heartbeat lapsed.
+
+    From then on the heartbeat thread rescans for them; jobs of a kind with
+    no registered handler fail.
+    """
+    global _recovered
+    with _lock:
+        _get_pool()
+        if _recovered:
+            return
+        _recovered = True
+    _recupera()
+
+
+def _recupera():
+    with _recovering:
+        vencido = time.time() - JOB_LEASE_SECONDS
+        orfaos = database.query(
+            """
+        SELECT job_id, kind, payload, owner, heartbeat_at FROM jobs
+        WHERE status IN (?, ?) AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+        """,
+            (QUEUED, RUNNING, vencido),
+        )
+        for job_id, kind, payload, owner, heartbeat_at in orfaos:
+            if owner == _owner:
+                continue
+            if kind in _handlers:
+                try:
+                    pool = _reserve()
+                except JobQueueFull:
+                    # Left for the next scan
+                    continue
+            # Claim the job, in case another process is recovering it too
+            reclamado = database.execute(
+                """
+            UPDATE jobs SET owner = ?, pid = ?, heartbeat_at = ?, status = ?, progress = 0, updated_at = ?
+            WHERE job_id = ? AND owner IS ? AND heartbeat_at IS ?
+            """,
+                (_owner, os.getpid(), time.time(), QUEUED, datetime.datetime.now(), job_id, owner, heartbeat_at),
+            )
+            if kind not in _handlers:
+                if reclamado:
+                    _update(job_id, status=FAILED, error=f"Tipo de tarefa desconhecido: {kind}")
+                continue
+            if not reclamado:
+                _release()
+                continue
+            print(f"Requeueing interrupted job {job_id} ({kind})")
+            pool.submit(_run, job_id, kind, json.loads(payload))
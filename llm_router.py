@@ -0,0 +1,431 @@
+"""Route chat requests across LLM providers by their recent time to first token.
+
+Providers are configured as "Provider:model" pairs. Each request goes to
+the healthy provider with the lowest rolling median time to first token;
+one that fails or doesn't start answering within LLM_FIRST_TOKEN_TIMEOUT
+is put on a cooldown and the next one is tried. With LLM_HEDGE_MS set, a
+second provider is also fired when the first hasn't produced a token by
+then, and whichever answers first wins.
+
+RoutedChat wraps the routing in a LangChain chat model, so it composes
+with prompt templates like any other model. The provider clients behind
+it are pooled per process, keyed by provider, model and parameters, and
+share one keep-alive HTTP connection pool.
+"""
+import os
+import queue
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+import metrics
+
+# Seconds a provider may take to send its first token before the next one is tried
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv("DOCGPT_LLM_FIRST_TOKEN_TIMEOUT", "30"))
+
+# Milliseconds without a first token before a second provider is fired (0 = never)
+LLM_HEDGE_MS = int(os.getenv("DOCGPT_LLM_HEDGE_MS", "0"))
+
+# Seconds a failed provider is skipped; doubles with each consecutive failure
+LLM_COOLDOWN = float(os.getenv("DOCGPT_LLM_COOLDOWN", "30"))
+MAX_COOLDOWN = 600
+
+# Recent first-token times kept per provider and model
+ROLLING_WINDOW = 20
+
+# Connections the shared HTTP pool keeps open to the providers
+LLM_MAX_CONNECTIONS = int(os.getenv("DOCGPT_LLM_MAX_CONNECTIONS", "20"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("DOCGPT_LLM_KEEPALIVE_SECONDS", "60"))
+
+FIRST_TOKEN_SECONDS = metrics.histogram(
+    "docgpt_llm_provider_first_token_seconds", "Time to first token per provider and model"
+)
+REQUESTS = metrics.counter("docgpt_llm_requests", "Requests per provider, model and outcome")
+HEDGES = metrics.counter("docgpt_llm_hedges", "Second providers fired for a slow first token")
+HTTP_REQUESTS = metrics.counter(
+    "docgpt_llm_http_requests", "HTTP requests to LLM providers, by host and new or reused connection"
+)
+
+
+class LLMUnavailable(Exception):
+    """Every provider failed or timed out before answering."""
+
+
+class _Rastreio:
+    """httpcore trace callback: notes whether the request opened a connection."""
+
+    def __init__(self):
+        self.nova_conexao = False
+
+    def __call__(self, evento, info):
+        if evento.startswith("connection.connect_tcp."):
+            self.nova_conexao = True
+
+
+def _rastreia(request):
+    request.extensions["trace"] = _Rastreio()
+
+
+def _conta_conexao(response):
+    rastreio = response.request.extensions.get("trace")
+    if isinstance(rastreio, _Rastreio):
+        conexao = "new" if rastreio.nova_conexao else "reused"
+        HTTP_REQUESTS.inc(host=response.request.url.host, connection=conexao)
+
+
+_http_client = None
+_http_lock = threading.Lock()
+
+
+def http_client():
+    """The process-wide keep-alive HTTP client shared by every provider client."""
+    global _http_client
+    with _http_lock:
+        if _http_client is None:
+            import httpx
+
+            _http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+                ),
+                timeout=httpx.Timeout(600, connect=10),
+                event_hooks={"request": [_rastreia], "response": [_conta_conexao]},
+            )
+        return _http_client
+
+
+def connection_reuse_rate():
+    """Fraction of LLM HTTP requests sent over an already open connection, or None."""
+    reusadas = HTTP_REQUESTS.total(connection="reused")
+    total = reusadas + HTTP_REQUESTS.total(connection="new")
+    return reusadas / total if total else None
+
+
+def _openai(modelo, **parametros):
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(model=modelo, api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client(), **parametros)
+
+
+def _groq(modelo, **parametros):
+    from langchain_groq import ChatGroq
+
+    return ChatGroq(model=modelo, api_key=os.getenv("GROQ_API_KEY"), http_client=http_client(), **parametros)
+
+
+# name -> (factory(model, **parameters) -> chat model, environment variable holding its key)
+_providers = {
+    "OpenAI": (_openai, "OPENAI_API_KEY"),
+    "Groq": (_groq, "GROQ_API_KEY"),
+}
+
+
+def register_provider(nome, factory, api_key_env=None):
+    """Make a provider available to parse_providers(); `factory(model, **parameters)` builds its chat model."""
+    _providers[nome] = (factory, api_key_env)
+
+
+# (provider, model, parameters) -> chat model
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def client(nome, modelo, **parametros):
+    """The process-wide chat model of a provider, model and parameters, built on first use."""
+    chave = (nome, modelo, tuple(sorted(parametros.items())))
+    with _clients_lock:
+        if chave not in _clients:
+            _clients[chave] = _providers[nome][0](modelo, **parametros)
+        return _clients[chave]
+
+
+def parse_providers(especificacao):
+    """(provider, model) pairs of a "Provider:model,..." string, keeping those with a key set."""
+    alvos = []
+    for item in especificacao.split(","):
+        if not item.strip():
+            continue
+        nome, _, modelo = item.strip().partition(":")
+        if nome not in _providers:
+            print(f"Unknown LLM provider {nome!r}, skipping")
+            continue
+        _, api_key_env = _providers[nome]
+        if api_key_env and not os.getenv(api_key_env):
+            continue
+        alvos.append((nome, modelo))
+    return alvos
+
+
+@dataclass
+class _Estado:
+    primeiro_token: deque = field(default_factory=lambda: deque(maxlen=ROLLING_WINDOW))
+    falhas: int = 0
+    indisponivel_ate: float = 0.0
+
+    def latencia(self):
+        # Unmeasured providers look fastest, so they get tried
+        return statistics.median(self.primeiro_token) if self.primeiro_token else 0.0
+
+
+class Router:
+    """Per-process routing state: rolling first-token times and provider health."""
+
+    def __init__(self, hedge_ms=None, first_token_timeout=None, cooldown=None):
+        self.hedge_ms = LLM_HEDGE_MS if hedge_ms is None else hedge_ms
+        self.first_token_timeout = first_token_timeout or LLM_FIRST_TOKEN_TIMEOUT
+        self.cooldown = LLM_COOLDOWN if cooldown is None else cooldown
+        self._estados = {}
+        self._lock = threading.Lock()
+
+    def _estado(self, chave):
+        with self._lock:
+            return self._estados.setdefault(chave, _Estado())
+
+    def registra_sucesso(self, chave, segundos):
+        estado = self._estado(chave)
+        with self._lock:
+            estado.primeiro_token.append(segundos)
+            estado.falhas = 0
+            estado.indisponivel_ate = 0.0
+        FIRST_TOKEN_SECONDS.observe(segundos, provider=chave[0], model=chave[1])
+        REQUESTS.inc(provider=chave[0], model=chave[1], result="ok")
+
+    def registra_descartado(self, chave, segundos):
+        # It took at least this long: keep that as its (optimistic) sample
+        estado = self._estado(chave)
+        with self._lock:
+            estado.primeiro_token.append(segundos)
+        REQUESTS.inc(provider=chave[0], model=chave[1], result="hedge_lost")
+
+    def registra_falha(self, chave, motivo):
+        estado = self._estado(chave)
+        with self._lock:
+            estado.falhas += 1
+            espera = min(self.cooldown * 2 ** (estado.falhas - 1), MAX_COOLDOWN)
+            estado.indisponivel_ate = time.monotonic() + espera
+        REQUESTS.inc(provider=chave[0], model=chave[1], result=motivo)
+
+    def ordena(self, chaves):
+        """Healthy providers fastest first, then the ones cooling down (soonest back first)."""
+        agora = time.monotonic()
+        posicoes = {chave: n for n, chave in enumerate(chaves)}
+
+        def prioridade(chave):
+            estado = self._estado(chave)
+            if estado.indisponivel_ate > agora:
+                return (1, estado.indisponivel_ate, posicoes[chave])
+            return (0, estado.latencia(), posicoes[chave])
+
+        return sorted(chaves, key=prioridade)
+
+    def snapshot(self):
+        """{(provider, model): (median first-token seconds or None, healthy)}."""
+        agora = time.monotonic()
+        with self._lock:
+            estados = dict(self._estados)
+        return {
+            chave: (estado.latencia() if estado.primeiro_token else None, estado.indisponivel_ate <= agora)
+            for chave, estado in estados.items()
+        }
+
+    def stream(self, modelos, messages, **kwargs):
+        """Stream message chunks from the best of `modelos`, {(provider, model): chat model}.
+
+        Raises LLMUnavailable if no provider starts answering. Once one has,
+        its stream is followed to the end (a failure then is raised as is).
+        """
+        pendentes = self.ordena(list(modelos))
+        fila = queue.Queue()
+        ativos = {}
+        erros = []
+        proximo_hedge = None
+        vencedor = None
+
+        def produz(chave, cancelado):
+            iterador = None
+            try:
+                iterador = modelos[chave].stream(messages, **kwargs)
+                for chunk in iterador:
+                    if cancelado.is_set():
+                        return
+                    fila.put(("chunk", chave, chunk))
+                fila.put(("fim", chave, None))
+            except Exception as e:
+                fila.put(("erro", chave, e))
+            finally:
+                if hasattr(iterador, "close"):
+                    iterador.close()
+
+        def lanca():
+            nonlocal proximo_hedge
+            chave = pendentes.pop(0)
+            cancelado = threading.Event()
+            ativos[chave] = (time.monotonic(), cancelado)
+            threading.Thread(target=produz, args=(chave, cancelado), name="docgpt-llm", daemon=True).start()
+            proximo_hedge = time.monotonic() + self.hedge_ms / 1000 if self.hedge_ms and pendentes else None
+
+        def descarta(chave, motivo):
+            inicio, cancelado = ativos.pop(chave)
+            cancelado.set()
+            if motivo == "hedge_lost":
+                self.registra_descartado(chave, time.monotonic() - inicio)
+            else:
+                self.registra_falha(chave, motivo)
+
+        try:
+            while vencedor is None:
+                if not ativos:
+                    if not pendentes:
+                        raise LLMUnavailable("; ".join(erros) or "Nenhum provedor de LLM configurado")
+                    lanca()
+
+                agora = time.monotonic()
+                prazos = [inicio + self.first_token_timeout for inicio, _ in ativos.values()]
+                if proximo_hedge is not None:
+                    prazos.append(proximo_hedge)
+                try:
+                    tipo, chave, valor = fila.get(timeout=max(0.0, min(prazos) - agora))
+                except queue.Empty:
+                    agora = time.monotonic()
+                    for chave, (inicio, _) in list(ativos.items()):
+                        if agora - inicio >= self.first_token_timeout:
+                            erros.append(f"{chave[0]}/{chave[1]}: sem resposta em {self.first_token_timeout:g}s")
+                            descarta(chave, "timeout")
+                    if proximo_hedge is not None and agora >= proximo_hedge:
+                        proximo_hedge = None
+                        # At most one hedge in flight
+                        if pendentes and len(ativos) == 1:
+                            print(f"Hedging LLM request on {pendentes[0][0]}/{pendentes[0][1]}")
+                            HEDGES.inc()
+                            lanca()
+                    continue
+
+                if chave not in ativos:
+                    continue
+                if tipo == "erro":
+                    print(f"LLM provider {chave[0]}/{chave[1]} failed: {valor!r}")
+                    erros.append(f"{chave[0]}/{chave[1]}: {valor}")
+                    descarta(chave, "error")
+                    # Fail over right away instead of waiting for the hedge timer
+                    proximo_hedge = None
+                    continue
+
+                vencedor = chave
+                inicio, _ = ativos.pop(chave)
+                self.registra_sucesso(chave, time.monotonic() - inicio)
+                for outro in list(ativos):
+                    descarta(outro, "hedge_lost")
+                if tipo == "fim":
+                    return
+                yield valor
+
+            while True:
+                try:
+                    tipo, chave, valor = fila.get(timeout=self.first_token_timeout)
+                except queue.Empty:
+                    raise LLMUnavailable(
+                        f"{vencedor[0]}/{vencedor[1]} parou de responder por {self.first_token_timeout:g}s"
+                    )
+                if chave != vencedor:
+                    continue
+                if tipo == "fim":
+                    return
+                if tipo == "erro":
+                    self.registra_falha(vencedor, "error")
+                    raise valor
+                yield valor
+        finally:
+            for _, cancelado in ativos.values():
+                cancelado.set()
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def router():
+    """The process-wide router, shared by every session."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = Router()
+        return _router
+
+
+class RoutedChat(BaseChatModel):
+    """Chat model that sends each request through a Router."""
+
+    modelos: Any
+    router: Any
+
+    @property
+    def _llm_type(self):
+        return "docgpt-routed"
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        if stop is not None:
+            kwargs["stop"] = stop
+        for chunk in self.router.stream(self.modelos, messages, **kwargs):
+            texto = chunk.content if isinstance(chunk.content, str) else ""
+            gerado = ChatGenerationChunk(message=AIMessageChunk(content=chunk.content))
+            if run_manager and texto:
+                run_manager.on_llm_new_token(texto, chunk=gerado)
+            yield gerado
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Non-streaming calls also go through the stream, for failover and timing
+        partes = [gerado.message.content for gerado in self._stream(messages, stop, run_manager, **kwargs)]
+        conteudo = "".join(parte for parte in partes if isinstance(parte, str))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=conteudo))])
+
+
+def chat_model(especificacao, **parametros):
+    """A RoutedChat over the configured providers of a "Provider:model,..." string.
+
+    `parametros` (e.g. temperature) go to every provider's client. Raises
+    LLMUnavailable if none of them has its API key set.
+    """
+    alvos = parse_providers(especificacao)
+    if not alvos:
+        raise LLMUnavailable(f"Nenhum provedor de LLM com chave configurada em {especificacao!r}")
+    modelos = {(nome, modelo): client(nome, modelo, **parametros) for nome, modelo in alvos}
+    return RoutedChat(modelos=modelos, router=router())
+
+
+def prefetch(pedacos):
+    """Start iterating `pedacos` on a thread of its own; returns an iterator over its items.
+
+    A lazy stream (e.g. chain.stream) sends its request on the first
+    next(); this sends it right away, while the caller does other work.
+    The thread follows the stream to its end even if the caller stops
+    reading; an exception reaches the caller where the stream raised it.
+    """
+    fila = queue.Queue()
+
+    def produz():
+        try:
+            for pedaco in pedacos:
+                fila.put(("chunk", pedaco))
+            fila.put(("fim", None))
+        except Exception as e:
+            fila.put(("erro", e))
+
+    threading.Thread(target=produz, name="docgpt-prefetch", daemon=True).start()
+
+    def consome():
+        while True:
+            tipo, valor = fila.get()
+            if tipo == "fim":
+                return
+            if tipo == "erro":
+                raise valor
+            yield valor
+
+    return consome()
@@ -1,53 +1,203 @@
+"""Document loaders, registered by document type.
+
+Each loader imports its parsing dependencies (BeautifulSoup, httpx,
+pypdf, LangChain's YouTube loader) the first time it runs, so importing
+this module stays cheap. Other packages can add document types through
+the "docgpt.loaders" entry point group: the entry point's name is the
+type and its value a "module:function" taking (file path, progress
+callback, options), imported on first use. Those types are offered as
+uploads with the type's name as file extension.
+"""
+import codecs
+import importlib.metadata
+import mmap
 import os
-from time import sleep
-import streamlit as st
-from langchain_community.document_loaders import (WebBaseLoader,
-                                                  YoutubeLoader, 
-                                                  CSVLoader, 
-                                                  PyPDFLoader, 
-                                                  TextLoader)
-from fake_useragent import UserAgent
+import threading
+import time
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any
+import metrics
 
-def carrega_site(url):
-    
+
+# Bytes of a TXT file decoded and handed over at a time (extended to the
+# next line break)
+TXT_BLOCK_BYTES = int(os.getenv("DOCGPT_TXT_BLOCK_BYTES", str(4 * 1024 * 1024)))
+
+# Used from the first block that isn't valid UTF-8
+TXT_FALLBACK_ENCODING = "cp1252"
+
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+
+LOADER_SECONDS = metrics.histogram(
+    "docgpt_loader_seconds", "Time to fetch or parse a document, by loader and stage"
+)
+
+
+class ErroCarregamento(Exception):
+    """A document could not be loaded; the message is shown to the user."""
+
+
+ENTRY_POINT_GROUP = "docgpt.loaders"
+
+
+@dataclass
+class Loader:
+    """How one document type is loaded.
+
+    `funcao(arquivo, progresso, opcoes)` returns the document text (or a
+    lazy iterator of text blocks); it may be given as a "module:function"
+    string, imported on first use.
+    """
+
+    tipo: str
+    funcao: Any
+    # Loads a URL instead of an uploaded file
+    url: bool = False
+    # File extensions accepted for upload
+    extensoes: tuple = ()
+    # Parsed text is kept in the document cache
+    cache: bool = True
+    # Offered for new documents
+    visivel: bool = True
+
+    def carrega(self, arquivo, progresso=None, opcoes=None):
+        if isinstance(self.funcao, str):
+            self.funcao = importlib.metadata.EntryPoint(
+                name=self.tipo, value=self.funcao, group=ENTRY_POINT_GROUP
+            ).load()
+        return self.funcao(arquivo, progresso, opcoes)
+
+
+# tipo -> Loader, in the order they are offered
+_loaders = {}
+_plugins_lock = threading.Lock()
+_plugins_carregados = False
+
+
+def register_loader(tipo, funcao, **opcoes):
+    """Make a document type loadable; see Loader for the options."""
+    _loaders[tipo] = Loader(tipo, funcao, **opcoes)
+
+
+def _carrega_plugins():
+    global _plugins_carregados
+    with _plugins_lock:
+        if _plugins_carregados:
+            return
+        _plugins_carregados = True
+        for entry_point in importlib.metadata.entry_points(group=ENTRY_POINT_GROUP):
+            if entry_point.name not in _loaders:
+                register_loader(entry_point.name, entry_point.value, extensoes=(entry_point.name.lower(),))
+
+
+def loader(tipo):
+    """The Loader of a document type; raises ErroCarregamento for unknown types."""
+    _carrega_plugins()
+    if tipo not in _loaders:
+        raise ErroCarregamento(f'Tipo de documento não suportado: {tipo}')
+    return _loaders[tipo]
+
+
+def tipos():
+    """Document types offered for new documents."""
+    _carrega_plugins()
+    return [tipo for tipo, registrado in _loaders.items() if registrado.visivel]
+
+
+def usa_url(tipo):
+    """Whether documents of this type are URLs rather than stored files."""
+    _carrega_plugins()
+    return tipo in _loaders and _loaders[tipo].url
+
+
+def extrai_texto_html(conteudo, tipo_conteudo=''):
+    """Visible text of an HTML page (other text types are decoded as-is)."""
+    if tipo_conteudo and 'html' not in tipo_conteudo:
+        return conteudo.decode('utf-8', errors='replace')
+    from bs4 import BeautifulSoup
+
+    # BeautifulSoup detects the encoding from the bytes and meta tags
+    soup = BeautifulSoup(conteudo, 'html.parser')
+    for tag in soup(['script', 'style', 'noscript']):
+        tag.decompose()
+    return soup.get_text('\n', strip=True)
+
+
+def normaliza_url(url):
     if not url or url.strip() == '':
-        st.error('URL não pode ser vazia')
-        st.stop()
+        raise ErroCarregamento('URL não pode ser vazia')
         
    
     if not url.startswith(('http://', 'https://')):
         url = 'https://' + url
         print(f"Added https:// scheme to URL: {url}")
+    return url
+
+
+def carrega_site(url):
+    from fetch import FetchError, fetch_sync
+
+    url = normaliza_url(url)
     
-    documento = ''
-    for i in range(5):
-        try:
-            
-            ua = UserAgent().random
-            
-            
-            loader = WebBaseLoader(
-                url,
-                raise_for_status=True,
-                header_template={"User-Agent": ua}
-            )
-            
-            print(f"Attempt {i+1} with User-Agent: {ua}")
-            lista_documentos = loader.load()
-            documento = '\n\n'.join([doc.page_content for doc in lista_documentos])
-            print(f"Successfully loaded content from {url}")
-            break
-        except Exception as e:
-            print(f'Error loading site (attempt {i+1}): {str(e)}')
-            sleep(3)
-    
-    if documento == '':
-        st.error(f'Não foi possível carregar o site: {url}')
-        st.stop()
-    
+    # Shared keep-alive client, jittered backoff and a total deadline, so a
+    # bad site can't hold the script thread for long
+    try:
+        with LOADER_SECONDS.time(loader='site', stage='fetch'):
+            conteudo, tipo_conteudo, _ = fetch_sync(url)
+    except FetchError as e:
+        print(f'Error loading site: {e}')
+        raise ErroCarregamento(f'Não foi possível carregar o site: {url}') from e
+
+    with LOADER_SECONDS.time(loader='site', stage='parse'):
+        documento = extrai_texto_html(conteudo, tipo_conteudo)
+    if documento.strip() == '':
+        raise ErroCarregamento(f'Não foi possível carregar o site: {url}')
+
+    print(f"Successfully loaded content from {url}")
     return documento
 
+def carrega_site_rastreado(url, profundidade=None, max_paginas=None, progresso=None):
+    """Yield the pages of a site, one block per page, as the crawler finds them.
+
+    Closing the generator stops the crawl.
+    """
+    from crawl import CRAWL_MAX_PAGES, crawl_sync
+
+    url = normaliza_url(url)
+    max_paginas = max_paginas or CRAWL_MAX_PAGES
+
+    paginas = crawl_sync(url, max_depth=profundidade, max_pages=max_paginas)
+    # Fetching and parsing overlap while crawling, so they are timed
+    # together; the consumer between pages is not
+    rastreando, total = 0.0, 0
+    try:
+        while True:
+            inicio = time.perf_counter()
+            pagina = next(paginas, None)
+            rastreando += time.perf_counter() - inicio
+            if pagina is None:
+                break
+            total += 1
+            if progresso:
+                progresso(total, max_paginas)
+            url_pagina, texto = pagina
+            yield f"Página: {url_pagina}\n{texto}"
+    finally:
+        paginas.close()
+    LOADER_SECONDS.observe(rastreando, loader='site_crawl', stage='crawl')
+
+    if not total:
+        raise ErroCarregamento(f'Não foi possível carregar o site: {url}')
+
 def carrega_youtube(video_url):
+    from langchain_community.document_loaders import YoutubeLoader
+
     # Extract video ID from the URL
     if "v=" in video_url:
         video_id = video_url.split("v=")[-1]
@@ -55,25 +205,100 @@ def carrega_youtube(video_url):
         video_id = video_url  # Assume it's already a video ID
     
     loader = YoutubeLoader(video_id, add_video_info=False, language=['pt'])
-    lista_documentos = loader.load()
+    with LOADER_SECONDS.time(loader='youtube', stage='fetch'):
+        lista_documentos = loader.load()
     documento = '\n\n'.join([doc.page_content for doc in lista_documentos])
     return documento
 
 
-def carrega_csv(caminho):
-    loader = CSVLoader(caminho)
-    lista_documentos = loader.load()
-    documento = '\n\n'.join([doc.page_content for doc in lista_documentos])
-    return documento
+def carrega_pdf(caminho, progresso=None):
+    """Yield the text of a PDF in blocks of PDF_PAGES_PER_TASK pages.
+
+    Pages are extracted in parallel and streamed in order: the indexer
+    gets each block as soon as its pages are ready, and the whole
+    document is never held as one string.
+    """
+    from pdf_extract import PDF_PAGES_PER_TASK, itera_paginas
+
+    paginas = itera_paginas(caminho, progresso=progresso)
+    # Only the extraction is timed, not the consumer between blocks
+    extraindo = 0.0
+    while True:
+        inicio = time.perf_counter()
+        bloco = list(islice(paginas, PDF_PAGES_PER_TASK))
+        extraindo += time.perf_counter() - inicio
+        if not bloco:
+            break
+        yield '\n\n'.join(bloco)
+    LOADER_SECONDS.observe(extraindo, loader='pdf', stage='parse')
+
+def itera_txt(caminho, tamanho_bloco=None):
+    """Yield the text of a TXT file in line-aligned blocks, read through mmap.
+
+    The encoding is detected as the file is read: a BOM selects UTF-8 or
+    UTF-16, otherwise UTF-8 is assumed until a block fails to decode, and
+    TXT_FALLBACK_ENCODING is used from there on. Pages already consumed
+    are released, so memory stays around one block whatever the file size.
+    """
+    tamanho_bloco = tamanho_bloco or TXT_BLOCK_BYTES
+    with open(caminho, 'rb') as f:
+        total = os.fstat(f.fileno()).st_size
+        if total == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+
+            encoding, posicao = 'utf-8', 0
+            for bom, nome in BOMS:
+                if mm[:len(bom)] == bom:
+                    encoding, posicao = nome, len(bom)
+                    break
+            decoder = codecs.getincrementaldecoder(encoding)()
+
+            # Only the decoding is timed, not the consumer between blocks
+            liberado, decodificando = 0, 0.0
+            while posicao < total:
+                inicio = time.perf_counter()
+                fim = mm.find(b'\n', min(posicao + tamanho_bloco, total))
+                fim = total if fim == -1 else fim + 1
+                dados = mm[posicao:fim]
+                try:
+                    texto = decoder.decode(dados, final=fim == total)
+                except UnicodeDecodeError:
+                    print(f"{caminho} is not UTF-8 from byte {posicao}, using {TXT_FALLBACK_ENCODING}")
+                    decoder = codecs.getincrementaldecoder(TXT_FALLBACK_ENCODING)(errors='replace')
+                    texto = decoder.decode(dados, final=fim == total)
+                del dados
+                posicao = fim
+                decodificando += time.perf_counter() - inicio
+                yield texto
+
+                # Drop the mapped pages already consumed from this process
+                ate = posicao - posicao % mmap.PAGESIZE
+                if hasattr(mm, 'madvise') and ate > liberado:
+                    mm.madvise(mmap.MADV_DONTNEED, liberado, ate - liberado)
+                    liberado = ate
+            LOADER_SECONDS.observe(decodificando, loader='txt', stage='parse')
 
-def carrega_pdf(caminho):
-    loader = PyPDFLoader(caminho)
-    lista_documentos = loader.load()
-    documento = '\n\n'.join([doc.page_content for doc in lista_documentos])
-    return documento
 
 def carrega_txt(caminho):
-    loader = TextLoader(caminho)
-    lista_documentos = loader.load()
-    documento = '\n\n'.join([doc.page_content for doc in lista_documentos])
-    return documento
+    # Returns the lazy block iterator: the file is never held as one string
+    return itera_txt(caminho)
+
+
+def _carrega_site(url, progresso, opcoes):
+    if opcoes and opcoes.get('rastrear'):
+        return carrega_site_rastreado(url, opcoes.get('profundidade'), opcoes.get('max_paginas'), progresso)
+    return carrega_site(url)
+
+
+register_loader('Site', _carrega_site, url=True)
+register_loader('Pdf', lambda caminho, progresso, opcoes: carrega_pdf(caminho, progresso), extensoes=('pdf',))
+# CSV rows go to a queryable table once the chat exists (see app.indexa_documento)
+register_loader('Csv', lambda caminho, progresso, opcoes: None, extensoes=('csv',), cache=False)
+# Streamed from the blob block by block while it is indexed; there is no
+# parsing to cache
+register_loader('Txt', lambda caminho, progresso, opcoes: carrega_txt(caminho), extensoes=('txt',), cache=False)
+# Chats created from YouTube videos still open, but new ones aren't offered
+register_loader('Youtube', lambda url, progresso, opcoes: carrega_youtube(url), url=True, visivel=False)
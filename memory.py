@@ -0,0 +1,135 @@
+import os
+import threading
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from tokens import count_tokens
+
+# Tokens of verbatim history sent with each question
+MEMORY_TOKEN_BUDGET = int(os.getenv("DOCGPT_MEMORY_TOKENS", "2000"))
+
+SUMMARY_PROMPT = """Você mantém o resumo de uma conversa entre um usuário e o
+assistente DocGPT sobre um documento. Atualize o resumo abaixo incorporando
+as novas mensagens. Preserve fatos, números, decisões e perguntas em aberto.
+Responda apenas com o resumo atualizado, em no máximo 250 palavras.
+
+Resumo atual:
+{resumo}
+
+Novas mensagens:
+{mensagens}"""
+
+
+class TokenBudgetMemory:
+    """Conversation memory that keeps recent turns verbatim within a token
+    budget and folds older turns into a rolling summary.
+
+    Each message carries the (timestamp, rowid) cursor it was saved with,
+    so the summary can be persisted together with how far it reaches.
+
+    prune_async() summarizes on another thread; the messages being folded
+    stay in the buffer, verbatim, until their summary is ready.
+    """
+
+    def __init__(self, summarizer=None, max_tokens=MEMORY_TOKEN_BUDGET,
+                 summary="", summary_cursor=None):
+        self.summarizer = summarizer
+        self.max_tokens = max_tokens
+        self.summary = summary
+        self.summary_cursor = summary_cursor
+        self.messages = []
+        # Messages taken out of `messages` by prune_async, still being summarized
+        self.folding = []
+        self._lock = threading.Lock()
+
+    def add_user_message(self, content, cursor=None):
+        mensagem = (HumanMessage(content=content), cursor, count_tokens(content))
+        with self._lock:
+            self.messages.append(mensagem)
+
+    def add_ai_message(self, content, cursor=None):
+        mensagem = (AIMessage(content=content), cursor, count_tokens(content))
+        with self._lock:
+            self.messages.append(mensagem)
+
+    @property
+    def token_count(self):
+        return sum(tokens for _, _, tokens in self.messages)
+
+    @property
+    def buffer_as_messages(self):
+        with self._lock:
+            mensagens = [message for message, _, _ in self.folding + self.messages]
+            resumo = self.summary
+        if resumo:
+            mensagens.insert(0, SystemMessage(content=f"Resumo da conversa até aqui:\n{resumo}"))
+        return mensagens
+
+    def _over_budget(self):
+        # The latest exchange is always kept, whatever its size
+        return self.token_count > self.max_tokens and len(self.messages) > 2
+
+    def _separa(self):
+        # Called with the lock held
+        dobradas = []
+        while self._over_budget():
+            dobradas.append(self.messages.pop(0))
+        return dobradas
+
+    def _resume(self, resumo, dobradas):
+        mensagens = "\n".join(
+            f"{'Usuário' if message.type == 'human' else 'DocGPT'}: {message.content}"
+            for message, _, _ in dobradas
+        )
+        return self.summarizer(SUMMARY_PROMPT.format(resumo=resumo or "(vazio)", mensagens=mensagens))
+
+    def _aplica(self, resumo, dobradas):
+        self.summary = resumo
+        cursor = dobradas[-1][1]
+        if cursor is not None:
+            self.summary_cursor = cursor
+
+    def prune(self):
+        """Fold the oldest messages over budget into the summary.
+
+        Returns True when the summary changed and should be persisted.
+        """
+        with self._lock:
+            if self.summarizer is None or self.folding or not self._over_budget():
+                return False
+            dobradas = self._separa()
+        resumo = self._resume(self.summary, dobradas)
+        with self._lock:
+            self._aplica(resumo, dobradas)
+        return True
+
+    def prune_async(self, executor, on_summary=None):
+        """prune() with the summarizer called on `executor`.
+
+        Until the summary is ready the folded messages stay in the buffer;
+        then `on_summary(summary, summary_cursor)` runs on the executor, to
+        persist it. If the summarizer fails they go back to the messages.
+        Returns the Future, or None when there is nothing to fold (or a
+        fold is still running).
+        """
+        with self._lock:
+            if self.summarizer is None or self.folding or not self._over_budget():
+                return None
+            self.folding = self._separa()
+            resumo_anterior = self.summary
+
+        def resume():
+            try:
+                resumo = self._resume(resumo_anterior, self.folding)
+            except Exception as e:
+                print(f"Could not summarize the conversation: {e!r}")
+                with self._lock:
+                    self.messages[:0] = self.folding
+                    self.folding = []
+                raise
+            with self._lock:
+                self._aplica(resumo, self.folding)
+                self.folding = []
+                summary, cursor = self.summary, self.summary_cursor
+            if on_summary is not None:
+                on_summary(summary, cursor)
+
+        return executor.submit(resume)
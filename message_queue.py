@@ -0,0 +1,480 @@
+"""Write-behind queue for chat messages, committed to SQLite in groups.
+
+save() appends the message to this process's journal file and returns
+right away; a writer thread commits what is queued in one transaction
+(with a single updated_at update per chat) once the oldest message has
+waited MESSAGE_FLUSH_MS, or as soon as MESSAGE_BATCH messages are
+waiting. A message is in the journal before save() returns, so a crashed
+process loses none: recover() replays the journals of processes that are
+gone. The queue is flushed when the process exits.
+
+Journal files are named after the process start that wrote them (its pid
+plus a random suffix), never reopened or renamed over, and kept alive by
+a lease file the process touches every MESSAGE_LEASE_SECONDS / 3: a file
+whose lease lapsed is an orphan, whatever pid the current process got.
+
+A message still being written (an answer being streamed) is a Rascunho:
+its text so far is checkpointed to a file of its own now and then, and
+recover() saves that, marked as interrupted, if the process dies before
+the message is finished and queued.
+"""
+import atexit
+import datetime
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import database
+import metrics
+
+# Longest a message waits in the queue before its batch is committed
+MESSAGE_FLUSH_MS = int(os.getenv("DOCGPT_MESSAGE_FLUSH_MS", "50"))
+
+# Messages that trigger a commit without waiting for the flush interval
+MESSAGE_BATCH = int(os.getenv("DOCGPT_MESSAGE_BATCH", "256"))
+
+JOURNAL_DIR = os.getenv("DOCGPT_MESSAGE_JOURNAL_DIR", "journal")
+
+# fsync every journal append, to also survive a power loss (not only a crash)
+JOURNAL_FSYNC = os.getenv("DOCGPT_MESSAGE_JOURNAL_FSYNC", "0") == "1"
+
+# Seconds the exit handler waits for the last commit
+SHUTDOWN_TIMEOUT = 30
+
+# Seconds after its last lease renewal a process's journals count as orphaned
+MESSAGE_LEASE_SECONDS = float(os.getenv("DOCGPT_MESSAGE_LEASE_SECONDS", "30"))
+
+# Seconds between two checkpoints of a message still being written
+DRAFT_CHECKPOINT_SECONDS = float(os.getenv("DOCGPT_DRAFT_CHECKPOINT_SECONDS", "0.5"))
+
+# Appended to a message that stopped before it was finished
+INTERRUPTED = "\n\n_(resposta interrompida)_"
+
+BATCH_MESSAGES = metrics.histogram(
+    "docgpt_message_batch_size", "Messages per group commit", (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+QUEUE_SECONDS = metrics.histogram(
+    "docgpt_message_queue_seconds", "Time from queueing the oldest message of a batch to its commit"
+)
+
+INSERT = """
+INSERT INTO messages (message_id, chat_id, role, content, timestamp)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+
+class MessageDropped(Exception):
+    """A queued message could not be saved (e.g. its chat was deleted meanwhile)."""
+
+
+class Pendente:
+    """A queued message. Unpacks as its (timestamp, rowid) cursor, waiting for the commit."""
+
+    def __init__(self, chat_id, role, content):
+        self.message_id = str(uuid.uuid4())
+        self.chat_id = chat_id
+        self.role = role
+        self.content = content
+        self.timestamp = datetime.datetime.now().isoformat(" ")
+        self.rowid = None
+        self.erro = None
+        self.enfileirado = time.monotonic()
+        self._salvo = threading.Event()
+
+    def registro(self):
+        return {
+            "message_id": self.message_id, "chat_id": self.chat_id, "role": self.role,
+            "content": self.content, "timestamp": self.timestamp,
+        }
+
+    def wait(self, timeout=None):
+        """The (timestamp, rowid) cursor once committed; raises MessageDropped or TimeoutError."""
+        if not self._salvo.wait(timeout):
+            raise TimeoutError(f"Message {self.message_id} not committed after {timeout}s")
+        if self.erro is not None:
+            raise self.erro
+        return self.timestamp, self.rowid
+
+    def __iter__(self):
+        return iter(self.wait())
+
+
+_pendentes = []
+_ultimo = None
+_cond = threading.Condition()
+_pid = None
+# This process start's id, in the name of every file it writes
+_processo = None
+_journal = None
+_caminho = None
+_lease = None
+_lote = 0
+_urgente = False
+_recovered = False
+# One recovery at a time in this process (recover() and the lease thread)
+_recuperando = threading.Lock()
+
+
+def _inicia():
+    # Called with _cond held. A forked process doesn't inherit the writer
+    # thread, and gets files of its own
+    global _pid, _processo, _journal, _caminho, _lease, _pendentes, _ultimo, _lote
+    if _pid == os.getpid():
+        return
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    _pid = os.getpid()
+    _processo = f"{_pid}_{uuid.uuid4().hex[:12]}"
+    _pendentes = []
+    _ultimo = None
+    _lote = 0
+    # Absolute, so a later chdir doesn't move the journal
+    _caminho = os.path.abspath(os.path.join(JOURNAL_DIR, f"messages-{_processo}.jsonl"))
+    _lease = os.path.abspath(os.path.join(JOURNAL_DIR, f"messages-{_processo}.lease"))
+    # The lease first: a journal is never seen without it
+    open(_lease, "x").close()
+    _journal = open(_caminho, "x", encoding="utf-8")
+    threading.Thread(target=_escritor, name="docgpt-messages", daemon=True).start()
+    threading.Thread(target=_vigia, name="docgpt-messages-lease", daemon=True).start()
+    atexit.register(_encerra)
+
+
+def _renomeia(origem, destino):
+    # Never over an existing file: the link fails if `destino` exists
+    os.link(origem, destino)
+    os.remove(origem)
+
+
+def save(chat_id, role, content):
+    """Queue a message for the next group commit and return its Pendente."""
+    return _enfileira(Pendente(chat_id, role, content))
+
+
+def _enfileira(pendente):
+    global _ultimo
+    linha = json.dumps(pendente.registro(), ensure_ascii=False) + "\n"
+    with _cond:
+        _inicia()
+        _journal.write(linha)
+        _journal.flush()
+        if JOURNAL_FSYNC:
+            os.fsync(_journal.fileno())
+        _pendentes.append(pendente)
+        _ultimo = pendente
+        if len(_pendentes) == 1 or len(_pendentes) >= MESSAGE_BATCH:
+            _cond.notify_all()
+    return pendente
+
+
+class Rascunho:
+    """A message still being written, e.g. an answer as it streams in.
+
+    append() adds text, checkpointing it every DRAFT_CHECKPOINT_SECONDS;
+    finish() queues the message like save(), with the id and timestamp it
+    got when the draft was started.
+    """
+
+    def __init__(self, chat_id, role):
+        self.pendente = Pendente(chat_id, role, "")
+        self._partes = []
+        self._checkpoint = time.monotonic()
+        with _cond:
+            _inicia()
+            self._caminho = os.path.join(
+                os.path.dirname(_caminho), f"draft-{_processo}-{self.pendente.message_id}.json"
+            )
+
+    @property
+    def content(self):
+        return "".join(self._partes)
+
+    def append(self, texto):
+        self._partes.append(texto)
+        if time.monotonic() - self._checkpoint >= DRAFT_CHECKPOINT_SECONDS:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Write the text so far where recover() finds it."""
+        registro = self.pendente.registro()
+        registro["content"] = self.content
+        # Written aside and renamed, so a crash never leaves half a checkpoint
+        temporario = f"{self._caminho}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(registro, f, ensure_ascii=False)
+            if JOURNAL_FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temporario, self._caminho)
+        self._checkpoint = time.monotonic()
+
+    def finish(self, interrompido=False):
+        """Queue the message and return its Pendente.
+
+        An interrupted message is saved marked as such, or dropped (None)
+        if it has no text yet.
+        """
+        conteudo = self.content
+        if interrompido and not conteudo:
+            pendente = None
+        else:
+            self.pendente.content = conteudo + INTERRUPTED if interrompido else conteudo
+            self.pendente.enfileirado = time.monotonic()
+            pendente = _enfileira(self.pendente)
+        # In the journal now (or dropped): the checkpoint has nothing left to save
+        try:
+            os.remove(self._caminho)
+        except FileNotFoundError:
+            pass
+        return pendente
+
+
+def flush(timeout=None):
+    """Commit everything queued so far and wait for it (a read-your-writes barrier)."""
+    global _urgente
+    with _cond:
+        # The last message queued, even if its batch is already being committed
+        if _ultimo is None or _pid != os.getpid():
+            return
+        ultimo = _ultimo
+        _urgente = bool(_pendentes)
+        _cond.notify_all()
+    # Batches commit in order: the last message done means all of them are
+    ultimo._salvo.wait(timeout)
+
+
+def _encerra():
+    flush(SHUTDOWN_TIMEOUT)
+    with _cond:
+        if _pid != os.getpid():
+            return
+        # Everything committed: the (empty) journal has nothing to recover
+        if _ultimo is None or _ultimo._salvo.is_set():
+            _journal.close()
+            _remove(_caminho)
+        # Whatever is left is recovered by the next process, without waiting for the lease
+        _remove(_lease)
+
+
+def _remove(caminho):
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+
+def _vigia():
+    # Renews this process's lease, and picks up the journals of processes
+    # whose lease lapsed since (e.g. one that crashed just before a restart)
+    while True:
+        try:
+            os.utime(_lease)
+        except OSError as e:
+            print(f"Could not renew the message journal lease {_lease}: {e!r}")
+        if _recovered:
+            try:
+                _recupera()
+            except Exception as e:
+                print(f"Message journal recovery failed: {e!r}")
+        time.sleep(MESSAGE_LEASE_SECONDS / 3)
+
+
+def _escritor():
+    global _pendentes, _journal, _lote, _urgente
+    while True:
+        with _cond:
+            while not _pendentes:
+                _cond.wait()
+            prazo = _pendentes[0].enfileirado + MESSAGE_FLUSH_MS / 1000
+            while len(_pendentes) < MESSAGE_BATCH and not _urgente:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                _cond.wait(restante)
+            lote, _pendentes = _pendentes, []
+            _urgente = False
+
+            # New messages go to a fresh journal; this batch's file goes once committed
+            _journal.close()
+            _lote += 1
+            arquivo_lote = f"{_caminho}.{_lote}"
+            _renomeia(_caminho, arquivo_lote)
+            _journal = open(_caminho, "x", encoding="utf-8")
+
+        if _grava(lote):
+            os.remove(arquivo_lote)
+        for pendente in lote:
+            pendente._salvo.set()
+
+
+def _insere(lote):
+    recentes = {}
+    with database.transaction() as conn:
+        for pendente in lote:
+            pendente.rowid = conn.execute(
+                INSERT,
+                (pendente.message_id, pendente.chat_id, pendente.role, pendente.content, pendente.timestamp),
+            ).lastrowid
+            recentes[pendente.chat_id] = max(recentes.get(pendente.chat_id, ""), pendente.timestamp)
+        # One updated_at write per chat, however many of its messages are in the batch
+        conn.executemany(
+            "UPDATE chats SET updated_at = ? WHERE chat_id = ?",
+            [(timestamp, chat_id) for chat_id, timestamp in recentes.items()],
+        )
+
+
+def _grava(lote):
+    """Commit a batch; returns False if it must stay in the journal for recover()."""
+    inicio = lote[0].enfileirado
+    try:
+        _insere(lote)
+    except sqlite3.IntegrityError:
+        # A message of a chat deleted meanwhile mustn't sink the whole batch
+        for pendente in lote:
+            try:
+                _insere([pendente])
+            except sqlite3.IntegrityError as e:
+                print(f"Dropping message {pendente.message_id} of chat {pendente.chat_id}: {e}")
+                pendente.erro = MessageDropped(str(e))
+    except Exception as e:
+        print(f"Could not commit {len(lote)} messages, kept in the journal: {e!r}")
+        for pendente in lote:
+            pendente.erro = MessageDropped(f"Mensagem não gravada: {e}")
+        return False
+    BATCH_MESSAGES.observe(len(lote))
+    QUEUE_SECONDS.observe(time.monotonic() - inicio)
+    return True
+
+
+def _nome_original(caminho):
+    # Without the ".recovering-<process>" suffixes of claims
+    return os.path.basename(caminho).split(".recovering-")[0]
+
+
+def _dono(caminho):
+    """The process a journal file belongs to: whoever claimed it last, or its writer."""
+    nome = os.path.basename(caminho)
+    if ".recovering-" in nome:
+        return nome.rsplit(".recovering-", 1)[1]
+    return nome.split("-")[1].split(".")[0]
+
+
+def _vivo(processo):
+    if processo == _processo:
+        return True
+    try:
+        renovado = os.path.getmtime(os.path.join(JOURNAL_DIR, f"messages-{processo}.lease"))
+    except FileNotFoundError:
+        return False
+    return time.time() - renovado < MESSAGE_LEASE_SECONDS
+
+
+def _ordem_journal(caminho):
+    # messages-<process>.jsonl.<batch> files are older than messages-<process>.jsonl
+    partes = _nome_original(caminho).split("-")[1].split(".")
+    lote = int(partes[2]) if len(partes) > 2 and partes[2].isdigit() else float("inf")
+    return partes[0], lote
+
+
+def _reclama(caminho):
+    """Claim an orphaned file for this process; None if someone else got it first."""
+    reclamado = f"{caminho}.recovering-{_processo}"
+    try:
+        os.link(caminho, reclamado)
+    except (FileNotFoundError, FileExistsError):
+        return None
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        # Another process linked it at the same time, and removed it first
+        os.remove(reclamado)
+        return None
+    return reclamado
+
+
+def recover():
+    """Commit the messages left in the journals and drafts of processes that are gone.
+
+    A process is gone once its lease lapsed, so a crash just before a
+    restart is picked up by this process later, every lease renewal.
+    Replaying a journal twice saves nothing twice.
+    """
+    global _recovered
+    with _cond:
+        _inicia()
+        _recovered = True
+    _recupera()
+
+
+def _recupera():
+    with _recuperando:
+        _recupera_orfaos()
+
+
+def _recupera_orfaos():
+    for caminho in sorted(glob.glob(os.path.join(JOURNAL_DIR, "messages-*.jsonl*")), key=_ordem_journal):
+        if _vivo(_dono(caminho)):
+            continue
+        reclamado = _reclama(caminho)
+        if reclamado is None:
+            continue
+        salvas = _reaplica(reclamado)
+        print(f"Recovered {salvas} unsaved messages from {_nome_original(caminho)}")
+        os.remove(reclamado)
+
+    # After the journals: a draft whose message was finished is skipped by id
+    for caminho in glob.glob(os.path.join(JOURNAL_DIR, "draft-*.json*")):
+        if _vivo(_dono(caminho)):
+            continue
+        if caminho.endswith(".tmp"):
+            # A checkpoint cut short; the previous one, if any, is whole
+            _remove(caminho)
+            continue
+        reclamado = _reclama(caminho)
+        if reclamado is None:
+            continue
+        with open(reclamado, encoding="utf-8") as f:
+            registro = json.load(f)
+        registro["content"] += INTERRUPTED
+        if _reaplica_registros([registro]):
+            print(f"Recovered the interrupted message {registro['message_id']} from {_nome_original(caminho)}")
+        os.remove(reclamado)
+
+    for caminho in glob.glob(os.path.join(JOURNAL_DIR, "messages-*.lease")):
+        if not _vivo(_dono(caminho)):
+            _remove(caminho)
+
+
+def _reaplica(caminho):
+    registros = []
+    with open(caminho, encoding="utf-8") as f:
+        for linha in f:
+            try:
+                registros.append(json.loads(linha))
+            except json.JSONDecodeError:
+                # The process died halfway through writing this line
+                continue
+    return _reaplica_registros(registros)
+
+
+def _reaplica_registros(registros):
+    salvas = 0
+    recentes = {}
+    with database.transaction() as conn:
+        for registro in registros:
+            # Already committed messages are skipped, and so are those of deleted chats
+            salvas += conn.execute(
+                """
+            INSERT OR IGNORE INTO messages (message_id, chat_id, role, content, timestamp)
+            SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM chats WHERE chat_id = ?)
+            """,
+                (registro["message_id"], registro["chat_id"], registro["role"], registro["content"],
+                 registro["timestamp"], registro["chat_id"]),
+            ).rowcount
+            recentes[registro["chat_id"]] = max(recentes.get(registro["chat_id"], ""), registro["timestamp"])
+        conn.executemany(
+            "UPDATE chats SET updated_at = MAX(COALESCE(updated_at, ''), ?) WHERE chat_id = ?",
+            [(timestamp, chat_id) for chat_id, timestamp in recentes.items()],
+        )
+    return salvas
@@ -0,0 +1,320 @@
+"""Process-wide latency and throughput metrics.
+
+Counters and histograms are kept in memory and exported in the Prometheus
+text format, over HTTP on DOCGPT_METRICS_PORT (bound to DOCGPT_METRICS_HOST,
+loopback by default) and/or rewritten every few
+seconds to DOCGPT_METRICS_FILE (for node_exporter's textfile collector).
+Each observation can also be appended to a JSON lines log
+(DOCGPT_METRICS_LOG). The most recent samples of every series are kept
+for the p50/p95 summary of the admin panel.
+"""
+import bisect
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Exporters are off unless configured
+METRICS_PORT = int(os.getenv("DOCGPT_METRICS_PORT", "0"))
+# The endpoint only listens on loopback unless told otherwise
+METRICS_HOST = os.getenv("DOCGPT_METRICS_HOST", "127.0.0.1")
+METRICS_FILE = os.getenv("DOCGPT_METRICS_FILE", "")
+METRICS_FILE_INTERVAL = float(os.getenv("DOCGPT_METRICS_FILE_INTERVAL", "15"))
+METRICS_LOG = os.getenv("DOCGPT_METRICS_LOG", "")
+
+# Observations kept per series for the percentiles
+SAMPLE_WINDOW = 1024
+
+SECONDS_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_registry = {}
+_registry_lock = threading.Lock()
+_log_lock = threading.Lock()
+_log_file = None
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def quantile(valores, q):
+    """Nearest-rank quantile of values already sorted ascending."""
+    return valores[max(0, math.ceil(len(valores) * q) - 1)]
+
+
+def _rotulos(labels):
+    return tuple(sorted((chave, str(valor)) for chave, valor in labels.items()))
+
+
+def _escapa(valor):
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formata_rotulos(rotulos, extra=()):
+    pares = [*rotulos, *extra]
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{chave}="{_escapa(valor)}"' for chave, valor in pares) + "}"
+
+
+def _log(nome, valor, labels):
+    global _log_file
+    if not METRICS_LOG:
+        return
+    linha = json.dumps({"ts": time.time(), "metric": nome, "value": valor, **labels})
+    with _log_lock:
+        if _log_file is None:
+            _log_file = open(METRICS_LOG, "a", encoding="utf-8", buffering=1)
+        _log_file.write(linha + "\n")
+
+
+class Counter:
+    """A monotonically increasing count, per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **labels):
+        rotulos = _rotulos(labels)
+        with self._lock:
+            self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+        _log(self.name, valor, labels)
+
+    def total(self, **labels):
+        """Sum over the series whose labels include these."""
+        procurados = set(_rotulos(labels))
+        with self._lock:
+            return sum(valor for rotulos, valor in self._valores.items() if procurados <= set(rotulos))
+
+    def _exporta(self):
+        with self._lock:
+            itens = sorted(self._valores.items())
+        return [f"{self.name}_total{_formata_rotulos(rotulos)} {valor:g}" for rotulos, valor in itens]
+
+
+class Gauge:
+    """A value that goes up and down, per label set, or read from `funcao()` at export."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, funcao=None):
+        self.name = name
+        self.documentation = documentation
+        self.funcao = funcao
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def set(self, valor, **labels):
+        with self._lock:
+            self._valores[_rotulos(labels)] = valor
+
+    def value(self, **labels):
+        if self.funcao is not None and not labels:
+            return self.funcao()
+        with self._lock:
+            return self._valores.get(_rotulos(labels), 0)
+
+    def _exporta(self):
+        if self.funcao is not None:
+            return [f"{self.name} {self.funcao():.15g}"]
+        with self._lock:
+            itens = sorted(self._valores.items())
+        return [f"{self.name}{_formata_rotulos(rotulos)} {valor:.15g}" for rotulos, valor in itens]
+
+
+class Histogram:
+    """Bucketed observations, per label set, plus a window of recent samples."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # rotulos -> [bucket counts, sum, count, recent samples]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, valor, **labels):
+        rotulos = _rotulos(labels)
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [[0] * len(self.buckets), 0.0, 0, deque(maxlen=SAMPLE_WINDOW)]
+            indice = bisect.bisect_left(self.buckets, valor)
+            if indice < len(self.buckets):
+                serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+            serie[3].append(valor)
+        _log(self.name, valor, labels)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds the block takes (even if it raises)."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **labels)
+
+    def samples(self, **labels):
+        """The recent observations of one series, oldest first."""
+        with self._lock:
+            serie = self._series.get(_rotulos(labels))
+            return list(serie[3]) if serie else []
+
+    def percentiles(self, quantis=(0.5, 0.95)):
+        """{labels: (sample count, [value per quantile])} over the recent samples."""
+        with self._lock:
+            series = {rotulos: (serie[2], sorted(serie[3])) for rotulos, serie in self._series.items()}
+        resultado = {}
+        for rotulos, (total, amostras) in series.items():
+            if amostras:
+                valores = [quantile(amostras, q) for q in quantis]
+                resultado[rotulos] = (total, valores)
+        return resultado
+
+    def _exporta(self):
+        with self._lock:
+            itens = sorted((rotulos, list(serie[0]), serie[1], serie[2]) for rotulos, serie in self._series.items())
+        linhas = []
+        for rotulos, contagens, soma, total in itens:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets, contagens):
+                acumulado += contagem
+                linhas.append(f"{self.name}_bucket{_formata_rotulos(rotulos, [('le', f'{limite:g}')])} {acumulado}")
+            linhas.append(f"{self.name}_bucket{_formata_rotulos(rotulos, [('le', '+Inf')])} {total}")
+            linhas.append(f"{self.name}_sum{_formata_rotulos(rotulos)} {soma:g}")
+            linhas.append(f"{self.name}_count{_formata_rotulos(rotulos)} {total}")
+        return linhas
+
+
+def _registra(classe, name, *args):
+    # app.py runs again on every Streamlit rerun: keep the series it collected
+    with _registry_lock:
+        metrica = _registry.get(name)
+        if metrica is None:
+            metrica = _registry[name] = classe(name, *args)
+    return metrica
+
+
+def counter(name, documentation):
+    """The process-wide counter of this name, created on first use."""
+    return _registra(Counter, name, documentation)
+
+
+def histogram(name, documentation, buckets=SECONDS_BUCKETS):
+    """The process-wide histogram of this name, created on first use."""
+    return _registra(Histogram, name, documentation, buckets)
+
+
+def gauge(name, documentation, funcao=None):
+    """The process-wide gauge of this name, created on first use."""
+    return _registra(Gauge, name, documentation, funcao)
+
+
+def resident_bytes():
+    """Resident memory of this process (its peak where /proc isn't available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maximo if sys.platform == "darwin" else maximo * 1024
+
+
+PROCESS_RESIDENT_BYTES = gauge("docgpt_process_resident_bytes", "Resident memory of the process", resident_bytes)
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metricas = sorted(_registry.items())
+    linhas = []
+    for nome, metrica in metricas:
+        linhas.append(f"# HELP {nome} {metrica.documentation}")
+        linhas.append(f"# TYPE {nome} {metrica.kind}")
+        linhas.extend(metrica._exporta())
+    return "\n".join(linhas) + "\n"
+
+
+def summary():
+    """(metric, labels, samples, p50, p95) of every histogram series, for the admin panel."""
+    with _registry_lock:
+        metricas = sorted(_registry.items())
+    linhas = []
+    for nome, metrica in metricas:
+        if isinstance(metrica, Histogram):
+            for rotulos, (total, (p50, p95)) in sorted(metrica.percentiles().items()):
+                linhas.append((nome, dict(rotulos), total, p50, p95))
+    return linhas
+
+
+def write_textfile(caminho):
+    """Atomically rewrite a Prometheus text file with the current values."""
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(temporario, caminho)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        corpo = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def _escreve_periodicamente():
+    while True:
+        time.sleep(METRICS_FILE_INTERVAL)
+        try:
+            write_textfile(METRICS_FILE)
+        except OSError as e:
+            print(f"Could not write metrics to {METRICS_FILE}: {e}")
+
+
+def start():
+    """Start the configured exporters, once per process."""
+    global _started_pid
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+
+    if METRICS_PORT:
+        try:
+            servidor = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _Handler)
+        except OSError as e:
+            # Another server process may already hold the port
+            print(f"Metrics endpoint not started on port {METRICS_PORT}: {e}")
+        else:
+            threading.Thread(target=servidor.serve_forever, name="docgpt-metrics", daemon=True).start()
+            print(f"Serving metrics on {METRICS_HOST}:{METRICS_PORT}")
+    if METRICS_FILE:
+        threading.Thread(target=_escreve_periodicamente, name="docgpt-metrics-file", daemon=True).start()
@@ -0,0 +1,507 @@
+"""Ordered schema migrations, applied by database.migrate().
+
+Each migration runs once, inside a transaction, and bumps PRAGMA
+user_version. Append new migrations to the end of MIGRATIONS; never edit
+one that has already shipped.
+"""
+import hashlib
+import os
+import time
+import uuid
+
+
+def base_schema(cursor):
+    """Create the original tables (no-op on databases that predate migrations)."""
+    # Create users table
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        username TEXT UNIQUE,
+        password_hash TEXT,
+        created_at TIMESTAMP
+    )
+    """
+    )
+
+    # Create chats table with user_id field
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS chats (
+        chat_id TEXT PRIMARY KEY,
+        user_id TEXT,
+        title TEXT,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        file_type TEXT,
+        file_path TEXT,
+        file_url TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    """
+    )
+
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS messages (
+        message_id TEXT PRIMARY KEY,
+        chat_id TEXT,
+        role TEXT,
+        content TEXT,
+        timestamp TIMESTAMP,
+        FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
+    )
+    """
+    )
+
+
+def message_and_chat_indexes(cursor):
+    """Index the chat list and message queries and cascade chat deletes."""
+    # SQLite can't alter a foreign key, so messages is rebuilt with the
+    # ON DELETE CASCADE clause and its rows copied over. Orphaned messages
+    # of already deleted chats are dropped on the way.
+    cursor.execute(
+        """
+    CREATE TABLE messages_new (
+        message_id TEXT PRIMARY KEY,
+        chat_id TEXT,
+        role TEXT,
+        content TEXT,
+        timestamp TIMESTAMP,
+        FOREIGN KEY (chat_id) REFERENCES chats (chat_id) ON DELETE CASCADE
+    )
+    """
+    )
+    cursor.execute(
+        """
+    INSERT INTO messages_new (message_id, chat_id, role, content, timestamp)
+    SELECT message_id, chat_id, role, content, timestamp FROM messages
+    WHERE chat_id IN (SELECT chat_id FROM chats)
+    """
+    )
+    cursor.execute("DROP TABLE messages")
+    cursor.execute("ALTER TABLE messages_new RENAME TO messages")
+
+    # get_messages: WHERE chat_id = ? ORDER BY timestamp
+    cursor.execute(
+        """
+    CREATE INDEX idx_messages_chat_timestamp
+    ON messages (chat_id, timestamp)
+    """
+    )
+
+    # get_chat_list: WHERE user_id = ? ORDER BY updated_at DESC, answered
+    # from the index alone
+    cursor.execute(
+        """
+    CREATE INDEX idx_chats_user_updated
+    ON chats (user_id, updated_at DESC, chat_id, title, created_at, file_type)
+    """
+    )
+
+
+def chat_summaries(cursor):
+    """Store the rolling conversation summary of each chat."""
+    # upto_timestamp/upto_rowid: keyset cursor of the last message folded in
+    cursor.execute(
+        """
+    CREATE TABLE chat_summaries (
+        chat_id TEXT PRIMARY KEY,
+        summary TEXT,
+        upto_timestamp TIMESTAMP,
+        upto_rowid INTEGER,
+        updated_at TIMESTAMP,
+        FOREIGN KEY (chat_id) REFERENCES chats (chat_id) ON DELETE CASCADE
+    )
+    """
+    )
+
+
+def answer_cache(cursor):
+    """Persist answers by document hash and question, with a per-chat opt-out."""
+    cursor.execute("ALTER TABLE chats ADD COLUMN doc_hash TEXT")
+    cursor.execute(
+        "ALTER TABLE chats ADD COLUMN answer_cache_enabled INTEGER NOT NULL DEFAULT 1"
+    )
+
+    # created_at/last_used_at are epoch seconds, for TTL and LRU eviction
+    cursor.execute(
+        """
+    CREATE TABLE answer_cache (
+        cache_key TEXT PRIMARY KEY,
+        doc_hash TEXT,
+        question TEXT,
+        answer TEXT,
+        created_at REAL,
+        last_used_at REAL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE INDEX idx_answer_cache_last_used
+    ON answer_cache (last_used_at)
+    """
+    )
+
+    cursor.execute(
+        """
+    CREATE TABLE answer_cache_stats (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    """
+    )
+
+
+def chat_documents(cursor):
+    """Let a chat hold several documents."""
+    cursor.execute(
+        """
+    CREATE TABLE chat_documents (
+        document_id TEXT PRIMARY KEY,
+        chat_id TEXT NOT NULL,
+        file_type TEXT,
+        file_path TEXT,
+        file_url TEXT,
+        doc_hash TEXT,
+        title TEXT,
+        added_at TIMESTAMP,
+        FOREIGN KEY (chat_id) REFERENCES chats (chat_id) ON DELETE CASCADE
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE INDEX idx_chat_documents_chat
+    ON chat_documents (chat_id, added_at)
+    """
+    )
+
+    # Existing chats become single-document chats
+    chats = cursor.execute(
+        "SELECT chat_id, file_type, file_path, file_url, doc_hash, created_at FROM chats"
+    ).fetchall()
+    cursor.executemany(
+        """
+    INSERT INTO chat_documents (document_id, chat_id, file_type, file_path, file_url, doc_hash, title, added_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+        [
+            (str(uuid.uuid4()), chat_id, file_type, file_path, file_url, doc_hash,
+             file_url or os.path.basename(file_path or ""), created_at)
+            for chat_id, file_type, file_path, file_url, doc_hash, created_at in chats
+        ],
+    )
+
+
+def chat_document_options(cursor):
+    """Remember per-document load settings (e.g. crawl depth) for rebuilds."""
+    cursor.execute("ALTER TABLE chat_documents ADD COLUMN options TEXT")
+
+
+def search_index(cursor):
+    """Full-text index over chat titles and message bodies, kept in sync by triggers."""
+    # External-content tables: the text lives in chats/messages only, and
+    # the FTS rows are keyed by their rowid
+    cursor.execute(
+        """
+    CREATE VIRTUAL TABLE chats_fts USING fts5(
+        title,
+        prefix = '2 3',
+        content = 'chats',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE VIRTUAL TABLE messages_fts USING fts5(
+        content,
+        prefix = '2 3',
+        content = 'messages',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """
+    )
+
+    for table, column in (("chats", "title"), ("messages", "content")):
+        cursor.execute(
+            f"""
+        CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {table}_fts (rowid, {column}) VALUES (new.rowid, new.{column});
+        END
+        """
+        )
+        # Also fires for messages removed by ON DELETE CASCADE
+        cursor.execute(
+            f"""
+        CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {table}_fts ({table}_fts, rowid, {column})
+            VALUES ('delete', old.rowid, old.{column});
+        END
+        """
+        )
+        cursor.execute(
+            f"""
+        CREATE TRIGGER {table}_fts_update AFTER UPDATE OF {column} ON {table} BEGIN
+            INSERT INTO {table}_fts ({table}_fts, rowid, {column})
+            VALUES ('delete', old.rowid, old.{column});
+            INSERT INTO {table}_fts (rowid, {column}) VALUES (new.rowid, new.{column});
+        END
+        """
+        )
+
+        # Index the existing rows
+        cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+
+def jobs(cursor):
+    """Persist background job state (see jobs.py)."""
+    # pid: server process that owns the job, so orphans can be requeued
+    cursor.execute(
+        """
+    CREATE TABLE jobs (
+        job_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        chat_id TEXT,
+        kind TEXT NOT NULL,
+        title TEXT,
+        status TEXT NOT NULL,
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        payload TEXT,
+        result TEXT,
+        error TEXT,
+        pid INTEGER,
+        seen INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+    )
+    """
+    )
+    # jobs.list_for_user: WHERE user_id = ? AND seen = 0 ORDER BY created_at
+    cursor.execute(
+        """
+    CREATE INDEX idx_jobs_user_seen
+    ON jobs (user_id, seen, created_at)
+    """
+    )
+    # jobs.recover: WHERE status IN ('queued', 'running')
+    cursor.execute("CREATE INDEX idx_jobs_status ON jobs (status)")
+
+
+def blob_store(cursor):
+    """Reference-count uploaded files, stored once by content hash (see blobs.py)."""
+    cursor.execute(
+        """
+    CREATE TABLE blobs (
+        digest TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at REAL,
+        released_at REAL
+    )
+    """
+    )
+    cursor.execute("ALTER TABLE chat_documents ADD COLUMN blob_digest TEXT")
+
+    # Files uploaded before the blob store stay where they are, registered
+    # under their hash; duplicates of an already registered file are pointed
+    # at it, so only one copy stays referenced
+    documentos = cursor.execute(
+        "SELECT document_id, file_path FROM chat_documents WHERE file_path IS NOT NULL"
+    ).fetchall()
+    for document_id, file_path in documentos:
+        if not os.path.exists(file_path):
+            continue
+        sha = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for parte in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(parte)
+        digest = sha.hexdigest()
+        cursor.execute(
+            "INSERT OR IGNORE INTO blobs (digest, path, size, created_at) VALUES (?, ?, ?, ?)",
+            (digest, file_path, os.path.getsize(file_path), time.time()),
+        )
+        caminho = cursor.execute("SELECT path FROM blobs WHERE digest = ?", (digest,)).fetchone()[0]
+        cursor.execute(
+            "UPDATE chat_documents SET blob_digest = ?, file_path = ? WHERE document_id = ?",
+            (digest, caminho, document_id),
+        )
+        cursor.execute("UPDATE chats SET file_path = ? WHERE file_path = ?", (caminho, file_path))
+    cursor.execute(
+        """
+    UPDATE blobs SET refcount = (
+        SELECT COUNT(*) FROM chat_documents WHERE blob_digest = blobs.digest
+    )
+    """
+    )
+
+    # Deleting a chat cascades to its documents, which releases their blobs
+    cursor.execute(
+        """
+    CREATE TRIGGER chat_documents_blob_insert AFTER INSERT ON chat_documents
+    WHEN new.blob_digest IS NOT NULL BEGIN
+        UPDATE blobs SET refcount = refcount + 1, released_at = NULL
+        WHERE digest = new.blob_digest;
+    END
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TRIGGER chat_documents_blob_delete AFTER DELETE ON chat_documents
+    WHEN old.blob_digest IS NOT NULL BEGIN
+        UPDATE blobs SET refcount = refcount - 1,
+            released_at = CAST(strftime('%s', 'now') AS REAL)
+        WHERE digest = old.blob_digest;
+    END
+    """
+    )
+
+
+def stable_rowids(cursor):
+    """Give chats and messages an explicit INTEGER PRIMARY KEY for the FTS and cursors."""
+    # chats and messages have TEXT primary keys, so their rowid is implicit
+    # and VACUUM may renumber it, silently detaching the FTS rows, the
+    # (timestamp, rowid) cursors and chat_summaries from their messages.
+    # Both tables are rebuilt with an INTEGER PRIMARY KEY column (an alias
+    # of the rowid, which is stable), taking the current rowid as its value
+    for table in ("chats", "messages"):
+        for evento in ("insert", "delete", "update"):
+            cursor.execute(f"DROP TRIGGER {table}_fts_{evento}")
+        cursor.execute(f"DROP TABLE {table}_fts")
+
+    cursor.execute(
+        """
+    CREATE TABLE chats_new (
+        chat_rowid INTEGER PRIMARY KEY,
+        chat_id TEXT NOT NULL UNIQUE,
+        user_id TEXT,
+        title TEXT,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        file_type TEXT,
+        file_path TEXT,
+        file_url TEXT,
+        doc_hash TEXT,
+        answer_cache_enabled INTEGER NOT NULL DEFAULT 1,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    """
+    )
+    cursor.execute(
+        """
+    INSERT INTO chats_new (chat_rowid, chat_id, user_id, title, created_at, updated_at,
+                           file_type, file_path, file_url, doc_hash, answer_cache_enabled)
+    SELECT rowid, chat_id, user_id, title, created_at, updated_at,
+           file_type, file_path, file_url, doc_hash, answer_cache_enabled
+    FROM chats
+    """
+    )
+    cursor.execute("DROP TABLE chats")
+    cursor.execute("ALTER TABLE chats_new RENAME TO chats")
+    cursor.execute(
+        """
+    CREATE INDEX idx_chats_user_updated
+    ON chats (user_id, updated_at DESC, chat_id, title, created_at, file_type)
+    """
+    )
+
+    cursor.execute(
+        """
+    CREATE TABLE messages_new (
+        message_rowid INTEGER PRIMARY KEY,
+        message_id TEXT NOT NULL UNIQUE,
+        chat_id TEXT,
+        role TEXT,
+        content TEXT,
+        timestamp TIMESTAMP,
+        FOREIGN KEY (chat_id) REFERENCES chats (chat_id) ON DELETE CASCADE
+    )
+    """
+    )
+    cursor.execute(
+        """
+    INSERT INTO messages_new (message_rowid, message_id, chat_id, role, content, timestamp)
+    SELECT rowid, message_id, chat_id, role, content, timestamp FROM messages
+    """
+    )
+    cursor.execute("DROP TABLE messages")
+    cursor.execute("ALTER TABLE messages_new RENAME TO messages")
+    # get_messages: WHERE chat_id = ? ORDER BY timestamp, message_rowid
+    cursor.execute(
+        """
+    CREATE INDEX idx_messages_chat_timestamp
+    ON messages (chat_id, timestamp)
+    """
+    )
+
+    cursor.execute("ALTER TABLE chat_summaries RENAME COLUMN upto_rowid TO upto_message_rowid")
+
+    # The FTS tables again, keyed by the new columns
+    for table, key, column in (("chats", "chat_rowid", "title"), ("messages", "message_rowid", "content")):
+        cursor.execute(
+            f"""
+        CREATE VIRTUAL TABLE {table}_fts USING fts5(
+            {column},
+            prefix = '2 3',
+            content = '{table}',
+            content_rowid = '{key}',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """
+        )
+        cursor.execute(
+            f"""
+        CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {table}_fts (rowid, {column}) VALUES (new.{key}, new.{column});
+        END
+        """
+        )
+        # Also fires for messages removed by ON DELETE CASCADE
+        cursor.execute(
+            f"""
+        CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {table}_fts ({table}_fts, rowid, {column})
+            VALUES ('delete', old.{key}, old.{column});
+        END
+        """
+        )
+        cursor.execute(
+            f"""
+        CREATE TRIGGER {table}_fts_update AFTER UPDATE OF {column} ON {table} BEGIN
+            INSERT INTO {table}_fts ({table}_fts, rowid, {column})
+            VALUES ('delete', old.{key}, old.{column});
+            INSERT INTO {table}_fts (rowid, {column}) VALUES (new.{key}, new.{column});
+        END
+        """
+        )
+        cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+
+def job_leases(cursor):
+    """Own jobs by process start and heartbeat instead of by pid (see jobs.py)."""
+    # owner: pid plus a random suffix of the process start running the job;
+    # heartbeat_at: epoch seconds of its last lease renewal. Jobs left by
+    # older versions have neither, so they count as orphaned
+    cursor.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+    cursor.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+
+
+MIGRATIONS = [
+    base_schema,
+    message_and_chat_indexes,
+    chat_summaries,
+    answer_cache,
+    chat_documents,
+    chat_document_options,
+    search_index,
+    jobs,
+    blob_store,
+    stable_rowids,
+    job_leases,
+]
@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pypdf import PdfReader
+
+# Worker processes for PDF extraction (1 disables the pool)
+PDF_WORKERS = int(os.getenv("DOCGPT_PDF_WORKERS", str(os.cpu_count() or 1)))
+
+# Pages each worker extracts per task
+PDF_PAGES_PER_TASK = int(os.getenv("DOCGPT_PDF_PAGES_PER_TASK", "20"))
+
+# Bounded-memory mode: at most this many page ranges in flight per worker
+# (0 submits every range at once, which is fastest but buffers out-of-order
+# results in memory)
+PDF_MAX_PENDING_PER_WORKER = int(os.getenv("DOCGPT_PDF_MAX_PENDING_PER_WORKER", "2"))
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # forkserver avoids forking the multi-threaded Streamlit server
+            metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(metodo))
+            _pool_workers = workers
+        return _pool
+
+
+def extrai_faixa(caminho, inicio, fim):
+    """Extract the text of pages [inicio, fim) of a PDF."""
+    reader = PdfReader(caminho)
+    return [reader.pages[i].extract_text() for i in range(inicio, fim)]
+
+
+def conta_paginas(caminho):
+    return len(PdfReader(caminho).pages)
+
+
+def itera_paginas(caminho, workers=None, paginas_por_tarefa=None,
+                  max_pendentes_por_worker=None, progresso=None):
+    """Yield the text of each page of a PDF, in page order.
+
+    Page ranges are extracted in parallel by a process pool; only a bounded
+    number of ranges is in flight at once, so peak memory stays around
+    workers * max_pendentes_por_worker * paginas_por_tarefa pages.
+    `progresso(paginas_feitas, total)` is called after each range.
+    """
+    workers = workers or PDF_WORKERS
+    paginas_por_tarefa = paginas_por_tarefa or PDF_PAGES_PER_TASK
+    if max_pendentes_por_worker is None:
+        max_pendentes_por_worker = PDF_MAX_PENDING_PER_WORKER
+
+    total = conta_paginas(caminho)
+    faixas = ((i, min(i + paginas_por_tarefa, total)) for i in range(0, total, paginas_por_tarefa))
+    feitas = 0
+
+    if workers <= 1 or total <= paginas_por_tarefa:
+        for inicio, fim in faixas:
+            yield from extrai_faixa(caminho, inicio, fim)
+            feitas = fim
+            if progresso:
+                progresso(feitas, total)
+        return
+
+    pool = _get_pool(workers)
+    limite = workers * max_pendentes_por_worker if max_pendentes_por_worker else None
+    pendentes = deque(
+        pool.submit(extrai_faixa, caminho, inicio, fim)
+        for inicio, fim in islice(faixas, limite)
+    )
+    try:
+        while pendentes:
+            paginas = pendentes.popleft().result()
+            # Refill the window before handing pages to the consumer
+            for inicio, fim in islice(faixas, 1):
+                pendentes.append(pool.submit(extrai_faixa, caminho, inicio, fim))
+            feitas += len(paginas)
+            yield from paginas
+            del paginas
+            if progresso:
+                progresso(feitas, total)
+    finally:
+        for futuro in pendentes:
+            futuro.cancel()
@@ -0,0 +1,413 @@
+import functools
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+import docstore
+
+try:
+    import numpy as np
+except ImportError:  # Vector search is optional
+    np = None
+
+INDEX_DIR = "indices"
+
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 200
+TOP_K = 6
+
+# Embeddings model for vector search (off when empty)
+EMBEDDINGS_MODEL = os.getenv("DOCGPT_EMBEDDINGS_MODEL", "")
+
+# Very common words that would only add noise to the BM25 query
+STOPWORDS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na",
+    "nos", "nas", "um", "uma", "que", "qual", "quais", "para", "por", "com",
+    "se", "ao", "the", "of", "and", "to", "in", "is", "what", "which", "on",
+}
+
+
+def divide_texto(texto, tamanho=CHUNK_SIZE, sobreposicao=CHUNK_OVERLAP):
+    """Split a document text into overlapping chunks."""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=tamanho, chunk_overlap=sobreposicao
+    )
+    return splitter.split_text(texto)
+
+
+def monta_consulta_fts(pergunta):
+    """Turn a free-form question into an FTS5 OR query of quoted terms."""
+    termos = []
+    for termo in re.findall(r"\w+", pergunta.lower()):
+        if len(termo) > 1 and termo not in STOPWORDS and termo not in termos:
+            termos.append(termo)
+    return " OR ".join(f'"{termo}"' for termo in termos)
+
+
+@functools.lru_cache(maxsize=1)
+def carrega_embeddings():
+    """Return the shared embeddings client, or None if vector search is disabled."""
+    if not EMBEDDINGS_MODEL or np is None:
+        return None
+    from langchain_openai import OpenAIEmbeddings
+    from llm_router import http_client
+
+    # Same keep-alive pool as the chat models: both talk to the OpenAI API
+    return OpenAIEmbeddings(model=EMBEDDINGS_MODEL, http_client=http_client())
+
+
+# Page cache of the shared connection to one document's chunks
+DOCUMENT_CACHE_BYTES = int(os.getenv("DOCGPT_DOCUMENT_CACHE_BYTES", str(2 * 1024 * 1024)))
+
+# Chunks sent per request when embedding an indexed document again
+EMBED_BATCH = 256
+
+
+def _cria_chunks(conn):
+    conn.execute(
+        """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+        content,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """
+    )
+
+
+class _Documento:
+    """What searching one indexed document keeps in memory, shared by every
+    session through docstore: a read-only connection to its chunks and its
+    vector matrix, if any."""
+
+    def __init__(self, db_path, vectors_path):
+        self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.conn.execute(f"PRAGMA cache_size = -{DOCUMENT_CACHE_BYTES // 1024}")
+        # One query at a time on the shared connection
+        self.lock = threading.Lock()
+        self.vetores = None
+        if np is not None and os.path.exists(vectors_path):
+            self.vetores = np.load(vectors_path)
+            total = self.query("SELECT COALESCE(MAX(rowid), 0) FROM chunks")[0][0]
+            if len(self.vetores) != total:
+                # Searched by BM25 alone until DocumentIndex.repair_vectors() runs
+                print(f"Ignoring {vectors_path}: {len(self.vetores)} vectors for {total} chunks")
+                self.vetores = None
+        # The page cache grows up to its cap, and never past the file
+        self.nbytes = min(os.path.getsize(db_path), DOCUMENT_CACHE_BYTES)
+        if self.vetores is not None:
+            self.nbytes += self.vetores.nbytes
+
+    def query(self, sql, parametros=()):
+        with self.lock:
+            return self.conn.execute(sql, parametros).fetchall()
+
+
+class DocumentIndex:
+    """Persistent chunk index of a chat: SQLite FTS5 (BM25) plus optional vectors.
+
+    Chunks and vectors are stored once per document, keyed by its content
+    hash, under index_dir/docs. A chat only holds references to the
+    documents it contains (in index_dir/documents.sqlite, shared by every
+    chat), so chats on the same document share its index on disk and, in
+    docstore, in memory. A document's files go when the last chat
+    referencing it does.
+    """
+
+    def __init__(self, chat_id, index_dir=INDEX_DIR):
+        self.chat_id = chat_id
+        self.index_dir = index_dir
+        self.registry_path = os.path.join(index_dir, "documents.sqlite")
+        # Per-chat files of indexes built before documents were shared
+        self._legados = [os.path.join(index_dir, f"{chat_id}{extensao}") for extensao in (".sqlite", ".npy")]
+        self._referencias = {}
+
+    def _registro(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        conn = sqlite3.connect(self.registry_path, timeout=30, isolation_level=None)
+        conn.execute(
+            """
+        CREATE TABLE IF NOT EXISTS document_refs (
+            chat_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            doc_key TEXT NOT NULL,
+            source TEXT,
+            PRIMARY KEY (chat_id, position)
+        )
+        """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS document_refs_doc_key ON document_refs (doc_key)")
+        return conn
+
+    def _caminhos(self, chave):
+        base = os.path.join(self.index_dir, "docs", f"{chave}")
+        return f"{base}.sqlite", f"{base}.npy"
+
+    def _documentos(self):
+        """(position, doc_key, source) of the chat's documents, in order."""
+        if not os.path.exists(self.registry_path):
+            return []
+        conn = self._registro()
+        linhas = conn.execute(
+            "SELECT position, doc_key, source FROM document_refs WHERE chat_id = ? ORDER BY position",
+            (self.chat_id,),
+        ).fetchall()
+        conn.close()
+        return linhas
+
+    def _documento(self, chave):
+        referencia = self._referencias.get(chave)
+        if referencia is None:
+            referencia = self._referencias[chave] = docstore.Referencia(
+                chave, lambda chave: _Documento(*self._caminhos(chave))
+            )
+        return referencia.get()
+
+    def exists(self):
+        return bool(self._documentos())
+
+    def build(self, texto, embeddings=None):
+        """Chunk the document text and (re)create the index."""
+        self.remove()
+        return self.add_document(texto, embeddings=embeddings)
+
+    def add_document(self, texto, fonte=None, embeddings=None, chave=None):
+        """Add a document to the index, labelled with its source; returns its number of chunks.
+
+        `texto` may also be an iterable of text blocks (e.g. a large file read
+        lazily), which are chunked and inserted one block at a time. `chave`
+        is the document's content hash: a document already indexed under it
+        (by any chat) is referenced instead of being chunked again, and
+        `texto` is not read. Without it the document is indexed for this
+        chat alone.
+        """
+        chave = chave or f"chat-{uuid.uuid4().hex}"
+        db_path, vectors_path = self._caminhos(chave)
+        if not os.path.exists(db_path):
+            # Built under temporary names, outside the registry's lock
+            temporarios = self._indexa(texto, embeddings, db_path, vectors_path)
+        else:
+            temporarios = None
+            if hasattr(texto, "close"):
+                texto.close()
+            # Indexed without vectors (e.g. before embeddings were enabled)
+            self._repara(chave, embeddings)
+
+        conn = self._registro()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if temporarios and not os.path.exists(db_path):
+                db_temporario, vetores_temporario = temporarios
+                if vetores_temporario:
+                    os.replace(vetores_temporario, vectors_path)
+                # The chunks go last: they are what marks the document indexed
+                os.replace(db_temporario, db_path)
+                temporarios = None
+            conn.execute(
+                """
+            INSERT INTO document_refs (chat_id, position, doc_key, source)
+            VALUES (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM document_refs WHERE chat_id = ?), ?, ?)
+            """,
+                (self.chat_id, self.chat_id, chave, fonte),
+            )
+            conn.execute("COMMIT")
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+            # Indexed by another chat meanwhile
+            for temporario in temporarios or ():
+                if temporario:
+                    os.remove(temporario)
+
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        total = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM chunks").fetchone()[0]
+        conn.close()
+        return total
+
+    def _indexa(self, texto, embeddings, db_path, vectors_path):
+        """Chunk a document into new files; returns their (chunks, vectors or None) temporary paths."""
+        blocos = [texto] if isinstance(texto, str) else texto
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        sufixo = f".{os.getpid()}_{uuid.uuid4().hex[:12]}.tmp"
+        db_temporario, vetores_temporario = db_path + sufixo, None
+        try:
+            conn = sqlite3.connect(db_temporario)
+            _cria_chunks(conn)
+            total = 0
+            vetores = []
+            with conn:
+                for bloco in blocos:
+                    chunks = divide_texto(bloco)
+                    conn.executemany(
+                        "INSERT INTO chunks (rowid, content) VALUES (?, ?)",
+                        ((total + i + 1, chunk) for i, chunk in enumerate(chunks)),
+                    )
+                    total += len(chunks)
+                    if embeddings is not None and chunks:
+                        vetores.append(np.asarray(embeddings.embed_documents(chunks), dtype=np.float32))
+            conn.close()
+
+            if vetores:
+                # Row i of the matrix is chunk rowid i + 1
+                vetores = np.vstack(vetores)
+                vetores /= np.linalg.norm(vetores, axis=1, keepdims=True) + 1e-12
+                vetores_temporario = vectors_path + sufixo
+                with open(vetores_temporario, "wb") as f:
+                    np.save(f, vetores)
+        except BaseException:
+            for temporario in (db_temporario, vetores_temporario):
+                if temporario and os.path.exists(temporario):
+                    os.remove(temporario)
+            raise
+        return db_temporario, vetores_temporario
+
+    def _repara(self, chave, embeddings):
+        # Embeds the chunks of an indexed document when its vector matrix
+        # is missing or out of line with them
+        db_path, vectors_path = self._caminhos(chave)
+        if embeddings is None or np is None or not os.path.exists(db_path):
+            return False
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            total = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM chunks").fetchone()[0]
+            if os.path.exists(vectors_path):
+                if len(np.load(vectors_path, mmap_mode="r")) == total:
+                    return False
+                print(f"Vectors of {chave} out of line with its {total} chunks: embedding them again")
+            elif not total:
+                return False
+            else:
+                print(f"{chave} has no vectors: embedding its {total} chunks")
+            vetores = []
+            cursor = conn.execute("SELECT content FROM chunks ORDER BY rowid")
+            while lote := [row[0] for row in cursor.fetchmany(EMBED_BATCH)]:
+                vetores.append(np.asarray(embeddings.embed_documents(lote), dtype=np.float32))
+        finally:
+            conn.close()
+
+        vetores = np.vstack(vetores)
+        vetores /= np.linalg.norm(vetores, axis=1, keepdims=True) + 1e-12
+        temporario = f"{vectors_path}.{os.getpid()}_{uuid.uuid4().hex[:12]}.tmp"
+        with open(temporario, "wb") as f:
+            np.save(f, vetores)
+        os.replace(temporario, vectors_path)
+        # Sessions load the new matrix on their next search
+        docstore.discard(chave)
+        return True
+
+    def repair_vectors(self, embeddings):
+        """Embed the chat's documents indexed without (aligned) vectors; returns how many were."""
+        return sum(self._repara(chave, embeddings) for _, chave, _ in self._documentos())
+
+    def size(self):
+        """Number of documents in the index."""
+        documentos = self._documentos()
+        return documentos[-1][0] if documentos else 0
+
+    def truncate(self, total):
+        """Drop the documents after the first `total`, e.g. of an interrupted load."""
+        self._solta("position > ?", (total,))
+
+    def remove(self):
+        self._solta("1", ())
+        for path in self._legados:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _solta(self, condicao, parametros):
+        # Drops references of the chat, and the files of documents no chat references anymore
+        if not os.path.exists(self.registry_path):
+            return
+        conn = self._registro()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            chaves = {
+                row[0] for row in conn.execute(
+                    f"SELECT doc_key FROM document_refs WHERE chat_id = ? AND {condicao}",
+                    (self.chat_id, *parametros),
+                )
+            }
+            conn.execute(f"DELETE FROM document_refs WHERE chat_id = ? AND {condicao}", (self.chat_id, *parametros))
+            for chave in chaves:
+                if conn.execute("SELECT 1 FROM document_refs WHERE doc_key = ? LIMIT 1", (chave,)).fetchone():
+                    continue
+                docstore.discard(chave)
+                for path in self._caminhos(chave):
+                    if os.path.exists(path):
+                        os.remove(path)
+            conn.execute("COMMIT")
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+        for chave in chaves:
+            referencia = self._referencias.pop(chave, None)
+            if referencia is not None:
+                referencia.release()
+
+    def search(self, pergunta, k=TOP_K, embeddings=None):
+        """Return the top-k chunks for a question, in document order."""
+        documentos = [(posicao, self._documento(chave), fonte) for posicao, chave, fonte in self._documentos()]
+        limite = k * 2
+        consulta_fts = monta_consulta_fts(pergunta)
+        consulta = None
+        if embeddings is not None and any(documento.vetores is not None for _, documento, _ in documentos):
+            consulta = np.asarray(embeddings.embed_query(pergunta), dtype=np.float32)
+            consulta /= np.linalg.norm(consulta) + 1e-12
+
+        # Candidates of every document, ranked together: (score, position, rowid)
+        bm25, vetorial = [], []
+        for posicao, documento, _ in documentos:
+            if consulta_fts:
+                bm25.extend(
+                    (score, posicao, rowid) for rowid, score in documento.query(
+                        """
+                    SELECT rowid, bm25(chunks) FROM chunks
+                    WHERE chunks MATCH ?
+                    ORDER BY bm25(chunks)
+                    LIMIT ?
+                    """,
+                        (consulta_fts, limite),
+                    )
+                )
+            if consulta is not None and documento.vetores is not None:
+                scores = documento.vetores @ consulta
+                melhores = min(limite, len(scores))
+                # argpartition needs a kth within the matrix
+                if melhores > 0:
+                    for i in np.argpartition(-scores, melhores - 1)[:melhores]:
+                        vetorial.append((-float(scores[i]), posicao, int(i) + 1))
+        rankings = [[(posicao, rowid) for _, posicao, rowid in sorted(candidatos)[:limite]]
+                    for candidatos in (bm25, vetorial)]
+
+        # Reciprocal rank fusion between BM25 and vector results
+        scores = {}
+        for ranking in rankings:
+            for lugar, chunk in enumerate(ranking):
+                scores[chunk] = scores.get(chunk, 0.0) + 1.0 / (60 + lugar)
+        selecionados = sorted(scores, key=scores.get, reverse=True)[:k]
+
+        trechos = []
+        for posicao, documento, fonte in documentos:
+            rowids = sorted(rowid for p, rowid in selecionados if p == posicao)
+            if selecionados and not rowids:
+                continue
+            if rowids:
+                marcadores = ",".join("?" * len(rowids))
+                linhas = documento.query(
+                    f"SELECT content FROM chunks WHERE rowid IN ({marcadores}) ORDER BY rowid", rowids
+                )
+            else:
+                # Nothing matched (e.g. "resuma o documento"): use the beginning
+                linhas = documento.query("SELECT content FROM chunks ORDER BY rowid LIMIT ?", (k - len(trechos),))
+            trechos.extend(f"Fonte: {fonte}\n{row[0]}" if fonte else row[0] for row in linhas)
+            if len(trechos) >= k:
+                break
+        return trechos
+
+
+def formata_contexto(trechos):
+    """Join retrieved chunks into the context block sent to the model."""
+    return "\n\n---\n\n".join(trechos)
@@ -0,0 +1,319 @@
+import csv
+import io
+import os
+import re
+import sqlite3
+import time
+from itertools import islice
+
+INDEX_DIR = "indices"
+
+# Rows inserted per batch while importing; memory stays flat whatever the file size
+CSV_CHUNK_ROWS = int(os.getenv("DOCGPT_CSV_CHUNK_ROWS", "5000"))
+
+# Limits of a generated query
+CSV_QUERY_MAX_ROWS = int(os.getenv("DOCGPT_CSV_QUERY_MAX_ROWS", "200"))
+CSV_QUERY_TIMEOUT = float(os.getenv("DOCGPT_CSV_QUERY_TIMEOUT", "5"))
+
+# Columns with few distinct values are indexed for filters and GROUP BY
+MAX_INDEXED_COLUMNS = 8
+SAMPLE_ROWS = 3
+
+SQL_PROMPT = """Você escreve consultas SQLite para responder perguntas sobre
+tabelas importadas de arquivos CSV. Esquema e perfil das tabelas:
+
+{perfil}
+
+Pergunta: {pergunta}
+
+Se a pergunta precisar de cálculos, filtros, contagens ou agregações sobre as
+linhas, responda apenas com uma única consulta SELECT, sem explicações e sem
+blocos de código. Use os nomes de tabelas e colunas entre aspas duplas.
+Se a pergunta não precisar de consulta, responda apenas NENHUMA."""
+
+
+class TableQueryError(Exception):
+    """A generated query was rejected, failed or ran over its time limit."""
+
+
+def _nome_sql(nome, usados):
+    """A unique, lowercase identifier derived from a header or file name."""
+    base = re.sub(r"\W+", "_", nome.strip().lower()).strip("_") or "coluna"
+    if base[0].isdigit():
+        base = f"c_{base}"
+    nome, n = base, 2
+    while nome in usados:
+        nome, n = f"{base}_{n}", n + 1
+    usados.add(nome)
+    return nome
+
+
+def _para_real_br(valor):
+    # 1.234,56 or 12,5
+    return float(valor.replace(".", "").replace(",", "."))
+
+
+CONVERSORES = (
+    ("INTEGER", int),
+    ("REAL", float),
+    ("REAL", _para_real_br),
+)
+
+
+def _infere_tipo(valores):
+    """Pick the SQLite type and converter that fit every non-empty sample value."""
+    valores = [valor for valor in valores if valor != ""]
+    for tipo, conversor in CONVERSORES:
+        try:
+            for valor in valores:
+                conversor(valor)
+        except ValueError:
+            continue
+        if valores:
+            return tipo, conversor
+    return "TEXT", str
+
+
+def _converte(valor, conversor):
+    if valor == "":
+        return None
+    try:
+        return conversor(valor)
+    except ValueError:
+        # Rows past the sample may not fit the inferred type; keep the text
+        return valor
+
+
+def _abre_texto(arquivo):
+    """Wrap a binary file in a text stream, guessing UTF-8 or Latin-1 from its start."""
+    inicio = arquivo.read(64 * 1024)
+    arquivo.seek(0)
+    try:
+        # A multi-byte character may be cut at the end of the sample
+        inicio.decode("utf-8-sig")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        encoding = "utf-8-sig" if e.start >= len(inicio) - 3 else "latin-1"
+    texto = io.TextIOWrapper(arquivo, encoding=encoding, errors="replace", newline="")
+    return texto, inicio.decode(encoding, errors="replace")
+
+
+def _formata_valor(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, float):
+        return f"{valor:.6g}"
+    texto = str(valor)
+    return texto if len(texto) <= 60 else texto[:57] + "..."
+
+
+def formata_resultado(colunas, linhas, truncado=False):
+    """Render query rows as a compact pipe-separated table for the prompt."""
+    partes = [" | ".join(colunas)]
+    partes += [" | ".join(_formata_valor(valor) for valor in linha) for linha in linhas]
+    if truncado:
+        partes.append(f"(resultado truncado em {len(linhas)} linhas)")
+    elif not linhas:
+        partes.append("(nenhuma linha)")
+    return "\n".join(partes)
+
+
+def extrai_sql(resposta):
+    """The SELECT statement in a model reply, or None if it declined to write one."""
+    sql = re.sub(r"^```\w*|```$", "", resposta.strip()).strip().rstrip(";").strip()
+    if not re.match(r"(?is)^(select|with)\b", sql):
+        return None
+    return sql
+
+
+class TableStore:
+    """Per-chat SQLite database holding the rows of the chat's CSV documents."""
+
+    def __init__(self, chat_id, index_dir=INDEX_DIR):
+        self.chat_id = chat_id
+        self.db_path = os.path.join(index_dir, f"{chat_id}.tables.sqlite")
+
+    def exists(self):
+        return os.path.exists(self.db_path)
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            """
+        CREATE TABLE IF NOT EXISTS _tabelas (
+            nome TEXT PRIMARY KEY,
+            fonte TEXT,
+            linhas INTEGER,
+            perfil TEXT
+        )
+        """
+        )
+        return conn
+
+    def import_csv(self, arquivo, fonte, chunk_rows=None):
+        """Stream a CSV file object into a new typed table; returns its profile.
+
+        Column types are inferred from the first chunk of rows, then the
+        rest of the file is inserted chunk by chunk.
+        """
+        chunk_rows = chunk_rows or CSV_CHUNK_ROWS
+        texto, amostra = _abre_texto(arquivo)
+        conn = self._connect()
+        try:
+            try:
+                dialeto = csv.Sniffer().sniff(amostra[:16 * 1024], delimiters=",;\t|")
+            except csv.Error:
+                dialeto = csv.excel
+            leitor = csv.reader(texto, dialeto)
+            cabecalho = next(leitor, None)
+            if not cabecalho:
+                raise ValueError(f"CSV sem cabeçalho: {fonte}")
+
+            # The store is rebuilt from the original file if it is ever lost,
+            # so the journal stays in memory: enough to roll back a failed import
+            conn.execute("PRAGMA journal_mode = MEMORY")
+            conn.execute("PRAGMA synchronous = OFF")
+            existentes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+            tabela = _nome_sql(os.path.splitext(os.path.basename(fonte))[0], existentes)
+            usados = set()
+            colunas = [_nome_sql(nome, usados) for nome in cabecalho]
+            largura = len(colunas)
+
+            lote = [(linha + [""] * largura)[:largura] for linha in islice(leitor, chunk_rows)]
+            tipos = [_infere_tipo([linha[i] for linha in lote]) for i in range(largura)]
+
+            definicao = ", ".join(f'"{coluna}" {tipo}' for coluna, (tipo, _) in zip(colunas, tipos))
+            marcadores = ", ".join("?" * largura)
+            total = 0
+            with conn:
+                # Begun explicitly, since DDL doesn't begin one: the new table
+                # rolls back with its rows if the import fails partway
+                conn.execute("BEGIN")
+                conn.execute(f'CREATE TABLE "{tabela}" ({definicao})')
+                while lote:
+                    conn.executemany(
+                        f'INSERT INTO "{tabela}" VALUES ({marcadores})',
+                        (
+                            [_converte(valor, conversor) for valor, (_, conversor) in zip(linha, tipos)]
+                            for linha in lote
+                        ),
+                    )
+                    total += len(lote)
+                    lote = [(linha + [""] * largura)[:largura] for linha in islice(leitor, chunk_rows)]
+
+                perfil = self._perfila(conn, tabela, fonte, colunas, tipos, total)
+                conn.execute(
+                    "INSERT INTO _tabelas (nome, fonte, linhas, perfil) VALUES (?, ?, ?, ?)",
+                    (tabela, fonte, total, perfil),
+                )
+            conn.execute("ANALYZE")
+        finally:
+            conn.close()
+            # Leave the caller's file open
+            texto.detach()
+        return perfil
+
+    def _perfila(self, conn, tabela, fonte, colunas, tipos, total):
+        linhas = [f'Tabela "{tabela}" (arquivo {fonte}, {total} linhas). Colunas:']
+        indexadas = 0
+        for coluna, (tipo, _) in zip(colunas, tipos):
+            distintos, minimo, maximo, nulos = conn.execute(
+                f'SELECT COUNT(DISTINCT "{coluna}"), MIN("{coluna}"), MAX("{coluna}"), '
+                f'SUM("{coluna}" IS NULL) FROM "{tabela}"'
+            ).fetchone()
+            descricao = f'- "{coluna}" {tipo}, {distintos} valores distintos'
+            if nulos:
+                descricao += f", {nulos} vazios"
+            if tipo != "TEXT" and minimo is not None:
+                descricao += f", de {_formata_valor(minimo)} a {_formata_valor(maximo)}"
+            elif distintos <= 10:
+                valores = conn.execute(
+                    f'SELECT DISTINCT "{coluna}" FROM "{tabela}" WHERE "{coluna}" IS NOT NULL LIMIT 10'
+                ).fetchall()
+                descricao += ": " + ", ".join(_formata_valor(valor) for valor, in valores)
+            linhas.append(descricao)
+
+            # Low-cardinality columns are the usual filter and GROUP BY keys
+            if indexadas < MAX_INDEXED_COLUMNS and 1 < distintos <= max(1000, total // 2):
+                conn.execute(f'CREATE INDEX "idx_{tabela}_{coluna}" ON "{tabela}" ("{coluna}")')
+                indexadas += 1
+
+        cursor = conn.execute(f'SELECT * FROM "{tabela}" LIMIT {SAMPLE_ROWS}')
+        linhas.append("Linhas de exemplo:")
+        linhas.append(formata_resultado(colunas, cursor.fetchall()))
+        return "\n".join(linhas)
+
+    def profile(self):
+        """Schema and sample-rows profile of every table, for the prompt."""
+        if not self.exists():
+            return ""
+        conn = self._connect()
+        perfis = [row[0] for row in conn.execute("SELECT perfil FROM _tabelas ORDER BY rowid")]
+        conn.close()
+        return "\n\n".join(perfis)
+
+    def execute(self, sql, max_rows=None, timeout=None):
+        """Run a read-only query with a row and time limit.
+
+        Returns (column names, rows, truncated). Raises TableQueryError.
+        """
+        max_rows = max_rows or CSV_QUERY_MAX_ROWS
+        timeout = timeout or CSV_QUERY_TIMEOUT
+
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        permitidas = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION,
+                      getattr(sqlite3, "SQLITE_RECURSIVE", 33)}
+        conn.set_authorizer(
+            lambda acao, *_: sqlite3.SQLITE_OK if acao in permitidas else sqlite3.SQLITE_DENY
+        )
+        fim = time.monotonic() + timeout
+        # A non-zero return aborts the query with "interrupted"
+        conn.set_progress_handler(lambda: time.monotonic() > fim, 10000)
+        try:
+            cursor = conn.execute(sql)
+            linhas = cursor.fetchmany(max_rows + 1)
+            colunas = [descricao[0] for descricao in cursor.description or ()]
+        except sqlite3.Error as e:
+            if time.monotonic() > fim:
+                raise TableQueryError(f"Consulta excedeu {timeout:g}s") from e
+            raise TableQueryError(str(e)) from e
+        finally:
+            conn.close()
+        return colunas, linhas[:max_rows], len(linhas) > max_rows
+
+    def size(self):
+        """Number of tables imported."""
+        if not self.exists():
+            return 0
+        conn = self._connect()
+        total = conn.execute("SELECT COUNT(*) FROM _tabelas").fetchone()[0]
+        conn.close()
+        return total
+
+    def truncate(self, total):
+        """Drop the tables imported after the first `total`, e.g. of an interrupted load.
+
+        Also drops a table whose import never finished (it has no profile).
+        """
+        if not self.exists():
+            return
+        conn = self._connect()
+        try:
+            mantidas = {row[0] for row in conn.execute("SELECT nome FROM _tabelas ORDER BY rowid LIMIT ?", (total,))}
+            tabelas = [
+                row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+                )
+            ]
+            with conn:
+                for tabela in tabelas:
+                    if tabela != "_tabelas" and tabela not in mantidas:
+                        conn.execute(f'DROP TABLE "{tabela}"')
+                        conn.execute("DELETE FROM _tabelas WHERE nome = ?", (tabela,))
+        finally:
+            conn.close()
+
+    def remove(self):
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)
@@ -0,0 +1,24 @@
+import functools
+
+# Encoding used by the gpt-4o family
+ENCODING_NAME = "o200k_base"
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as e:
+        # tiktoken downloads its tables on first use; offline, estimate instead
+        print(f"Token encoding unavailable, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(texto):
+    """Count the tokens of a text locally (about 4 characters per token as fallback)."""
+    encoding = _encoding()
+    if encoding is None:
+        return len(texto) // 4 + 1
+    return len(encoding.encode(texto, disallowed_special=()))